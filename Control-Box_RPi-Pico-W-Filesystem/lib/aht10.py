@@ -33,16 +33,40 @@ class AHT10:
     def read_raw(self):
         self.i2c.writeto(self.address, CMD_MEASURE)
         time.sleep_ms(AHT10_READ_DELAY_MS)
-        self.readings_raw = self.i2c.readfrom(AHT10_ADDRESS, 6)
+        self.readings_raw = self.i2c.readfrom(self.address, 6)
+        self._parse()
+
+    def _parse(self):
         self.results_parsed[0] = self.readings_raw[1] << 12 | self.readings_raw[2] << 4 | self.readings_raw[3] >> 4
         self.results_parsed[1] = (self.readings_raw[3] & 0x0F) << 16 | self.readings_raw[4] << 8 | self.readings_raw[5]
 
+    def start(self):
+        # Start a conversion without waiting; collect() it AHT10_READ_DELAY_MS later
+        self.i2c.writeto(self.address, CMD_MEASURE)
+
+    def collect(self):
+        # Temperature and humidity of the conversion start() began, or None
+        # if the sensor is still busy with it
+        self.readings_raw = self.i2c.readfrom(self.address, 6)
+        if self.readings_raw[0] & 0x80:
+            return None
+        self._parse()
+        return self._temperature(), (self.results_parsed[0] / KILOBYTE_CONST) * 100
+
     def humidity(self):
         self.read_raw()
         return (self.results_parsed[0] / KILOBYTE_CONST) * 100 
 
     def temperature(self):
         self.read_raw()
+        return self._temperature()
+
+    def measure(self):
+        # Temperature and humidity from a single conversion
+        self.read_raw()
+        return self._temperature(), (self.results_parsed[0] / KILOBYTE_CONST) * 100
+
+    def _temperature(self):
         if self.mode is 0:
             return (self.results_parsed[1] / KILOBYTE_CONST) * AHT_TEMPERATURE_CONST - AHT_TEMPERATURE_OFFSET
         else:
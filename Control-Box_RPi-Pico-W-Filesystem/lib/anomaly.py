@@ -0,0 +1,238 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Spots a stalled fan, a failed or shorted LED driver and a temperature out
+# of range within a few passes of the main loop, instead of in the hourly
+# averages, and keeps a short record of each for sending straight away.
+#
+# check() looks only at the readings already in the status, so it adds no
+# sensor reads. It learns what is normal for each setting: the fan RPM for
+# each fan duty, and the current (mam) for each set of red, green, blue,
+# white and fan duties, as exponentially weighted averages. A reading too
+# far from its baseline for HOLD passes in a row raises an alert, and HOLD
+# passes back within it clear the alert again. Readings that are out, or
+# come while an alert is up, are left out of the baseline. Readings just
+# after the duties change, and baselines with fewer than WARMUP readings,
+# are not judged. A fan that has never been seen turning (no tachometer)
+# is not judged either. Up to SETS duty sets keep a baseline each, so the
+# lights-on and lights-off settings are each learned once, not every day.
+#
+# Settings are in the "alerts" section of /config/device_settings.json:
+#
+# {"alerts": {"enabled": true, "fan low": 0.5, "led tolerance": 0.1,
+#             "led min ma": 20, "temperature": [10, 35], "hold": 2}}
+#
+# Each alert, raised (sta=1) or cleared (sta=0), is queued as a query string
+#   boa=<board>&kin=<fan|led|tem>&sta=1&val=<reading>&exp=<baseline>&dat=..&tim=..
+# for the main loop to send with send(), which keeps it if sending fails.
+#
+# Baselines are held as integers in sixteenths and the tolerances in 256ths,
+# in lists allocated once, so a pass where no alert changes allocates
+# nothing.
+
+import time
+
+SETS = 4  # Duty sets (and fan duties) with a baseline; the oldest is replaced
+WARMUP = 5  # Readings before a baseline is judged against
+EWMA_N = 8  # Weight of a new reading once warmed up: 1/EWMA_N
+SETTLE = 2  # Passes not judged after the duties change
+HOLD = 2
+MIN_RPM = 300  # A fan baseline below this is not judged
+QUEUE = 8  # Alerts waiting to be sent; the oldest are dropped
+RETRY_MS = 60000  # Wait after a failed send
+
+KINDS = ("fan", "led", "tem")
+
+
+class Baselines:
+    # EWMA of a reading for each of up to SETS keys, each a pair of small ints
+    def __init__(self):
+        self.keys = [None] * SETS
+        self.keys2 = [0] * SETS
+        self.values = [0] * SETS  # Sixteenths
+        self.counts = [0] * SETS
+        self.used = [0] * SETS  # Pass last used, to replace the oldest
+
+    def find(self, key, key2, tick):
+        # Slot for the key pair, taking over the least recently used one if it is new
+        oldest = 0
+        for i in range(SETS):
+            if self.keys[i] == key and self.keys2[i] == key2:
+                self.used[i] = tick
+                return i
+            if self.used[i] < self.used[oldest]:
+                oldest = i
+        self.keys[oldest] = key
+        self.keys2[oldest] = key2
+        self.values[oldest] = 0
+        self.counts[oldest] = 0
+        self.used[oldest] = tick
+        return oldest
+
+    def ready(self, i):
+        return self.counts[i] >= WARMUP
+
+    def expected(self, i):
+        return self.values[i] >> 4
+
+    def learn(self, i, value):
+        n = self.counts[i]
+        if n < EWMA_N:
+            n += 1
+            self.counts[i] = n
+        self.values[i] += ((value << 4) - self.values[i]) // n
+
+
+class Detector:
+    def __init__(self, board_id, config=None):
+        config = config or {}
+        self.board_id = board_id
+        self.fan_low = int(config.get("fan low", 0.5) * 256)
+        self.led_tolerance = int(config.get("led tolerance", 0.1) * 256)
+        self.led_min = config.get("led min ma", 20)
+        self.tem_low, self.tem_high = config.get("temperature", (10, 35))
+        self.tem_mid = (self.tem_low + self.tem_high) / 2
+        self.hold = config.get("hold", HOLD)
+        self.fans = Baselines()  # Keys: fan duty
+        self.leds = Baselines()  # Keys: red, green and blue duties; white and fan duties
+        self.lights = None  # Duty keys on the last pass
+        self.others = None
+        self.settle = SETTLE
+        self.passes = 0
+        self.active = [False] * len(KINDS)
+        self.runs = [0] * len(KINDS)  # Passes in a row that disagree with active
+        self.values = [0] * len(KINDS)  # Reading and baseline when last judged
+        self.expects = [0] * len(KINDS)
+        self.queue = []
+        self.retry_ms = None
+        self.raised = 0
+        self.sent = 0
+        self.failed = 0
+
+    def _judge(self, kind, bad, value, expect, status):
+        # Count a pass towards raising or clearing an alert; True if the
+        # reading should be kept out of the baseline
+        self.values[kind] = value
+        self.expects[kind] = expect
+        active = self.active[kind]
+        if bad == active:
+            self.runs[kind] = 0
+            return bad
+        self.runs[kind] += 1
+        if self.runs[kind] >= self.hold:
+            self.runs[kind] = 0
+            self.active[kind] = bad
+            if bad:
+                self.raised += 1
+            self._queue(kind, status)
+        return bad or active
+
+    def _queue(self, kind, status):
+        self.queue.append(
+            "boa=%s&kin=%s&sta=%d&val=%d&exp=%d&dat=%d-%02d-%02d&tim=%02d:%02d:%02d"
+            % (self.board_id, KINDS[kind], self.active[kind], self.values[kind],
+               self.expects[kind], status["yea"], status["mon"], status["day"],
+               status["hou"], status["min"], status["sec"])
+        )
+        while len(self.queue) > QUEUE:
+            self.queue.pop(0)
+
+    def check(self, status):
+        # Once per pass, after the status is read
+        self.passes += 1
+        # Duties packed into two small ints, so comparing them allocates nothing
+        lights = (status["red"] << 8 | status["gre"]) << 8 | status["blu"]
+        others = status["whi"] << 8 | status["fan"]
+        if lights != self.lights or others != self.others:
+            self.lights = lights
+            self.others = others
+            self.settle = SETTLE
+        if self.settle:
+            self.settle -= 1
+        else:
+            self._fan(status)
+            self._led(lights, others, status)
+        self._tem(status)
+
+    def _fan(self, status):
+        rpm = status["rpm"]
+        if rpm is None or not status["fan"]:
+            return
+        rpm = int(rpm)
+        i = self.fans.find(status["fan"], 0, self.passes)
+        expect = self.fans.expected(i)
+        if self.fans.ready(i) and expect >= MIN_RPM:
+            if self._judge(0, rpm << 8 < expect * self.fan_low, rpm, expect, status):
+                return
+        self.fans.learn(i, rpm)
+
+    def _led(self, lights, others, status):
+        mam = status["mam"]
+        if mam is None:
+            return
+        mam = int(mam)
+        i = self.leds.find(lights, others, self.passes)
+        expect = self.leds.expected(i)
+        if self.leds.ready(i):
+            limit = max(self.led_min, expect * self.led_tolerance >> 8)
+            if self._judge(1, abs(mam - expect) > limit, mam, expect, status):
+                return
+        self.leds.learn(i, mam)
+
+    def _tem(self, status):
+        tem = status["tem"]
+        if tem is None:
+            tem = status["sst"]  # Boxes without an AHT10 use the soil sensor's
+        if tem is None:
+            return
+        limit = self.tem_high if tem > self.tem_mid else self.tem_low
+        self._judge(2, not self.tem_low <= tem <= self.tem_high, int(tem), limit, status)
+
+    def send(self, func, now_ms):
+        # Send queued alerts through func(query), oldest first, until one fails
+        if self.retry_ms is not None and time.ticks_diff(now_ms, self.retry_ms) < 0:
+            return
+        self.retry_ms = None
+        while self.queue:
+            try:
+                func(self.queue[0])
+            except Exception:
+                self.failed += 1
+                self.retry_ms = time.ticks_add(now_ms, RETRY_MS)
+                return
+            self.queue.pop(0)
+            self.sent += 1
+
+    def report(self):
+        # Alerts raised, sent (raised and cleared) and failed sends, and
+        # those still up
+        up = "".join([KINDS[k][0] for k in range(len(KINDS)) if self.active[k]])
+        return "alerts=%d/%d/%d%s" % (self.raised, self.sent, self.failed, "/" + up if up else "")
+
+    def reset(self):
+        self.raised = 0
+        self.sent = 0
+        self.failed = 0
+
+    def table(self):
+        lines = ["alert  up  reading  baseline"]
+        for k in range(len(KINDS)):
+            lines.append("%-5s  %2s  %7d  %8d" % (
+                KINDS[k], "Y" if self.active[k] else "-", self.values[k], self.expects[k]))
+        lines.append("fan duty  rpm  readings")
+        for i in range(SETS):
+            if self.fans.keys[i] is not None:
+                lines.append("%8d  %4d  %8d" % (
+                    self.fans.keys[i], self.fans.expected(i), self.fans.counts[i]))
+        lines.append("red gre blu whi fan    mA  readings")
+        for i in range(SETS):
+            key = self.leds.keys[i]
+            if key is not None:
+                key2 = self.leds.keys2[i]
+                lines.append("%3d %3d %3d %3d %3d  %4d  %8d" % (
+                    key >> 16, key >> 8 & 255, key & 255, key2 >> 8, key2 & 255,
+                    self.leds.expected(i), self.leds.counts[i]))
+        lines.append("%d queued" % len(self.queue))
+        return "\n".join(lines)
@@ -0,0 +1,190 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Finds the sensors on the I2C buses and keeps track of which are present.
+# Each bus is scanned once and the result cached; a driver module is only
+# imported when its device answers. Reads go through read(), which returns
+# the default straight away for a device that is not there, so missing
+# hardware costs no bus time in the main loop. A device that fails several
+# reads in a row is dropped (the circuit breaker opens) and, like devices
+# missing at boot, is probed again by service() after a delay that doubles
+# up to an hour.
+
+import time
+
+READY = "ok"
+MISSING = "missing"
+
+
+def make_ina219(bus, address):
+    import ina219
+
+    ina = ina219.INA219(0.1, bus, address=address)
+    ina.configure()
+    return ina
+
+
+def make_soil(bus, address):
+    import stemma_soil_sensor
+
+    return stemma_soil_sensor.StemmaSoilSensor(bus, address)
+
+
+def make_aht10(bus, address):
+    import aht10
+
+    return aht10.AHT10(bus, address=address)
+
+
+def make_ds3231(bus, address):
+    from ds3231 import DS3231
+
+    rtc = DS3231(bus)
+    rtc.DateTime()  # Fails if the clock does not answer
+    return rtc
+
+
+DRIVERS = {
+    "ina219": make_ina219,
+    "soil": make_soil,
+    "aht10": make_aht10,
+    "ds3231": make_ds3231,
+}
+
+
+class Slot:
+    def __init__(self, name, bus, address, kind):
+        self.name = name
+        self.bus = bus
+        self.address = address
+        self.kind = kind
+        self.device = None
+        self.state = MISSING
+        self.failures = 0  # Consecutive failed reads
+        self.backoff = 0
+        self.next_ms = 0
+        self.probes = 0
+        self.trips = 0
+
+
+class BusManager:
+    def __init__(self, min_backoff=30, max_backoff=3600, trip=3):
+        self.min_backoff = min_backoff * 1000
+        self.max_backoff = max_backoff * 1000
+        self.trip = trip
+        self.slots = {}
+        self.order = []
+        self.present = {}  # id(bus) -> addresses found by the scan
+
+    def _present(self, bus):
+        found = self.present.get(id(bus))
+        if found is None:
+            try:
+                found = bus.scan()
+            except OSError:
+                found = []
+            self.present[id(bus)] = found
+        return found
+
+    def add(self, name, bus, address, kind):
+        # Register a device and connect it if the bus scan found it
+        slot = Slot(name, bus, address, kind)
+        self.slots[name] = slot
+        self.order.append(name)
+        if address in self._present(bus):
+            self._connect(slot)
+        else:
+            self._schedule(slot)
+        return slot.device
+
+    def unknown(self, bus):
+        # Addresses that answered the scan but no device was added for
+        claimed = [s.address for s in self.slots.values() if s.bus is bus]
+        return [addr for addr in self._present(bus) if addr not in claimed]
+
+    def _connect(self, slot):
+        try:
+            if hasattr(slot.bus, "site"):
+                slot.bus.site = slot.name
+            slot.device = DRIVERS[slot.kind](slot.bus, slot.address)
+            slot.state = READY
+            slot.failures = 0
+            slot.backoff = 0
+            return True
+        except Exception:
+            slot.device = None
+            self._schedule(slot)
+            return False
+
+    def _schedule(self, slot):
+        # Try again later, waiting twice as long each time
+        slot.state = MISSING
+        slot.backoff = min(self.max_backoff, max(self.min_backoff, slot.backoff * 2))
+        slot.next_ms = time.ticks_add(time.ticks_ms(), slot.backoff)
+
+    def get(self, name):
+        slot = self.slots.get(name)
+        return slot.device if slot else None
+
+    def read(self, name, func, default):
+        # func(device) if the device is there and answers, otherwise default
+        slot = self.slots.get(name)
+        if slot is None or slot.device is None:
+            return default
+        if hasattr(slot.bus, "site"):
+            slot.bus.site = name
+        try:
+            value = func(slot.device)
+            slot.failures = 0
+            return value
+        except Exception:
+            slot.failures += 1
+            if slot.failures >= self.trip:
+                slot.trips += 1
+                slot.device = None
+                self._schedule(slot)
+                print("I2C device " + name + " stopped responding")
+            return default
+
+    def service(self):
+        # Probe at most one missing device whose wait is over
+        now = time.ticks_ms()
+        for name in self.order:
+            slot = self.slots[name]
+            if slot.state == MISSING and time.ticks_diff(now, slot.next_ms) >= 0:
+                slot.probes += 1
+                if hasattr(slot.bus, "site"):
+                    slot.bus.site = "probe"
+                try:
+                    slot.bus.writeto(slot.address, b"")  # Address acknowledged?
+                except OSError:
+                    self._schedule(slot)
+                    return
+                if self._connect(slot):
+                    print("I2C device " + name + " connected")
+                return
+
+    def summary(self):
+        # "devices name=state/probes/trips ..."
+        out = "devices"
+        for name in self.order:
+            slot = self.slots[name]
+            out += " %s=%s/%d/%d" % (name, slot.state, slot.probes, slot.trips)
+        return out
+
+    def table(self):
+        lines = ["device     bus addr  state    probes trips  next probe"]
+        now = time.ticks_ms()
+        for name in self.order:
+            slot = self.slots[name]
+            wait = ""
+            if slot.state == MISSING:
+                wait = "%ds" % max(0, time.ticks_diff(slot.next_ms, now) // 1000)
+            lines.append(
+                "%-10s %-3s 0x%02x  %-8s %6d %5d  %s"
+                % (name, getattr(slot.bus, "name", ""), slot.address, slot.state,
+                   slot.probes, slot.trips, wait)
+            )
+        return "\n".join(lines)
@@ -0,0 +1,165 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Warm-restart checkpoint of the main loop's state, so a reset or brown-out
+# does not lose the hour's running averages or the queue of log uploads.
+#
+# The running averages, the number of readings in each, the log hour and
+# the boot count are small and change every loop. They are packed into a
+# fixed binary record and written at most once per interval, alternating
+# between slot files so an interrupted write leaves the previous slot
+# intact. The upload queue only changes when an entry is added or sent, so
+# it is kept in its own file and rewritten only then. Every record ends
+# with a CRC32 and is ignored if it does not match.
+
+import struct
+import time
+from binascii import crc32
+
+AVG_MAGIC = b"GBEC"
+OUTBOX_MAGIC = b"GBEO"
+VERSION = 2
+
+# magic, version, sequence, time saved, log hour, boot count, value count
+AVG_HEAD = "<4sBIIBHB"
+# magic, version, entry count
+OUTBOX_HEAD = "<4sBH"
+# flags (1 = has a time, 2 = tried), upload time, url length
+ENTRY_HEAD = "<BIH"
+
+
+def _seal(data):
+    return data + struct.pack("<I", crc32(data) & 0xFFFFFFFF)
+
+
+def _unseal(data):
+    # Payload of a record, or None if it is short or its CRC is wrong
+    if len(data) < 4:
+        return None
+    payload = data[:-4]
+    if struct.unpack("<I", data[-4:])[0] != crc32(payload) & 0xFFFFFFFF:
+        return None
+    return payload
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as file:
+            return _unseal(file.read())
+    except OSError:
+        return None
+
+
+class Checkpoint:
+    def __init__(self, keys, path="/checkpoint", slots=2, interval=300, store=None):
+        self.keys = sorted(keys)  # Dict order is not guaranteed to persist
+        self.path = path
+        self.slots = slots
+        self.interval = interval * 1000
+        self.store = store  # storage.Store that counts the writes, if any
+        self.seq = 0
+        self.boots = 0
+        self.last_ms = time.ticks_ms()
+        self.writes = 0
+        self.bytes = 0
+
+    def _slot(self, seq):
+        return "%s%d.bin" % (self.path, seq % self.slots)
+
+    def load(self):
+        # (time saved, log hour, averages, reading counts) from the newest
+        # valid slot, or None. Counts this boot either way.
+        best = None
+        for idx in range(self.slots):
+            payload = _read(self._slot(idx))
+            if payload is None or len(payload) < struct.calcsize(AVG_HEAD):
+                continue
+            magic, version, seq, saved, hour, boots, count = struct.unpack_from(AVG_HEAD, payload)
+            if magic != AVG_MAGIC or version != VERSION or count != len(self.keys):
+                continue
+            if best is None or seq > best[0]:
+                pos = struct.calcsize(AVG_HEAD)
+                values = struct.unpack_from("<%df" % count, payload, pos)
+                numbers = struct.unpack_from("<%dH" % count, payload, pos + 4 * count)
+                best = (seq, saved, hour, boots, values, numbers)
+        if best is None:
+            self.boots = 1
+            return None
+        self.seq, saved, hour, self.boots, values, numbers = best
+        self.boots += 1
+        averages = {}
+        counts = {}
+        for key, value, number in zip(self.keys, values, numbers):
+            averages[key] = round(value, 2)
+            counts[key] = number
+        averages["ent"] = int(averages.get("ent", 0))
+        return saved, hour, averages, counts
+
+    def save(self, averages, hour, force=False, counts=None):
+        # Write the averages, and how many readings each has, to the next
+        # slot if the interval has passed
+        now = time.ticks_ms()
+        if not force and time.ticks_diff(now, self.last_ms) < self.interval:
+            return False
+        self.last_ms = now
+        self.seq += 1
+        values = [averages[key] for key in self.keys]
+        numbers = [min(0xFFFF, counts.get(key, 0)) if counts else 0 for key in self.keys]
+        data = _seal(
+            struct.pack(
+                AVG_HEAD, AVG_MAGIC, VERSION, self.seq, time.time(), hour,
+                self.boots & 0xFFFF, len(values),
+            )
+            + struct.pack("<%df" % len(values), *values)
+            + struct.pack("<%dH" % len(numbers), *numbers)
+        )
+        self._write(self._slot(self.seq), data)
+        return True
+
+    def load_outbox(self):
+        # Upload queue in the main loop's format, or None
+        payload = _read(self.path + "_outbox.bin")
+        if payload is None or len(payload) < struct.calcsize(OUTBOX_HEAD):
+            return None
+        magic, version, count = struct.unpack_from(OUTBOX_HEAD, payload)
+        if magic != OUTBOX_MAGIC or version != VERSION:
+            return None
+        pos = struct.calcsize(OUTBOX_HEAD)
+        queue = []
+        for _ in range(count):
+            flags, when, length = struct.unpack_from(ENTRY_HEAD, payload, pos)
+            pos += struct.calcsize(ENTRY_HEAD)
+            entry = {}
+            if flags & 1:
+                entry["time"] = when
+                entry["url"] = payload[pos:pos + length].decode()
+                entry["tried"] = bool(flags & 2)
+            pos += length
+            queue.append(entry)
+        return queue or None
+
+    def save_outbox(self, queue):
+        parts = [struct.pack(OUTBOX_HEAD, OUTBOX_MAGIC, VERSION, len(queue))]
+        for entry in queue:
+            if "time" in entry:
+                url = entry["url"].encode()
+                flags = 1 | (2 if entry["tried"] else 0)
+                parts.append(struct.pack(ENTRY_HEAD, flags, entry["time"], len(url)))
+                parts.append(url)
+            else:
+                parts.append(struct.pack(ENTRY_HEAD, 0, 0, 0))
+        self._write(self.path + "_outbox.bin", _seal(b"".join(parts)))
+
+    def _write(self, path, data):
+        try:
+            if self.store:
+                self.store.replace(path, data, False)  # The slots are the safe copies
+            else:
+                with open(path, "wb") as file:
+                    file.write(data)
+            self.writes += 1
+            self.bytes += len(data)
+        except OSError as e:
+            print("Error saving checkpoint:", e)
@@ -0,0 +1,78 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Non-blocking command line on the USB serial console. The main loop calls
+# poll() once per pass; characters typed into the shell are collected until
+# Enter and the first word is looked up in the registered commands. Lines
+# that start with SOH (0x01) are requests from a program on the computer
+# rather than a person (frames.py); once checked they go to the function
+# registered for their letter with framed().
+
+import sys
+import select
+
+import frames
+
+
+class Console:
+    def __init__(self):
+        self.poller = select.poll()
+        self.poller.register(sys.stdin, select.POLLIN)
+        self.line = ""
+        self.commands = {}
+        self.handlers = {}  # Request letter -> func(seq, letter, words)
+        self.garbled = 0  # Requests with a wrong CRC, which the computer asks again
+        self.add("help", self.help, "List console commands")
+
+    def add(self, name, func, description=""):
+        self.commands[name] = (func, description)
+
+    def framed(self, letters, func):
+        # Have func(seq, letter, words) answer requests with these letters
+        for letter in letters:
+            self.handlers[letter] = func
+
+    def help(self):
+        for name in sorted(self.commands):
+            print("  %-10s %s" % (name, self.commands[name][1]))
+
+    def poll(self):
+        while self.poller.poll(0):
+            ch = sys.stdin.read(1)
+            if not ch:
+                break
+            if ch == "\r" or ch == "\n":
+                line = self.line.strip()
+                self.line = ""
+                if line[:1] == "\x01":
+                    self.request(line[1:])
+                elif line:
+                    self.run(line)
+            elif len(self.line) < 80:
+                self.line += ch
+
+    def request(self, line):
+        request = frames.parse(line)
+        if request is None:
+            self.garbled += 1
+            return
+        seq, letter, words = request
+        func = self.handlers.get(letter)
+        if func is None:
+            frames.send(getattr(sys.stdout, "buffer", sys.stdout), ord("X"), seq,
+                        ("unknown request " + letter).encode())
+            return
+        func(seq, letter, words)
+
+    def run(self, line):
+        words = line.split()
+        entry = self.commands.get(words[0].lower())
+        if entry is None:
+            print("Unknown command '" + words[0] + "'. Type 'help' for a list.")
+            return
+        try:
+            entry[0](*words[1:])
+        except Exception as e:
+            print("Command failed:", e)
@@ -111,17 +111,31 @@ class DS3231():
             self.Minute(dat[1]%60)
             self.Second(dat[2]%60)
 
+    # All seven time registers in one transaction, so they cannot roll over
+    # between reads. Writing the seconds register restarts the DS3231's
+    # second, and the rest follow in the same burst.
     def DateTime(self, dat = None):
         if dat == None:
-            return self.Date() + [self.Weekday()] + self.Time()
+            r = self.i2c.readfrom_mem(DS3231_I2C_ADDR, DS3231_REG_SEC, 7)
+            return [self.HexToDec(r[6]) + 2000, self.HexToDec(r[5] & 0x1F), self.HexToDec(r[4]),
+                    self.HexToDec(r[3]), self.HexToDec(r[2] & 0x3F), self.HexToDec(r[1]),
+                    self.HexToDec(r[0] & 0x7F)]
         else:
-            self.Year(dat[0])
-            self.Month(dat[1])
-            self.Day(dat[2])
-            self.Weekday(dat[3])
-            self.Hour(dat[4])
-            self.Minute(dat[5])
-            self.Second(dat[6])
+            self.i2c.writeto_mem(DS3231_I2C_ADDR, DS3231_REG_SEC, bytearray([
+                self.DecToHex(dat[6]%60), self.DecToHex(dat[5]%60), self.DecToHex(dat[4]%24),
+                self.DecToHex(dat[3]%8), self.DecToHex(dat[2]%32), self.DecToHex(dat[1]%13),
+                self.DecToHex(dat[0]%100)]))
+
+    def Aging(self, offset = None):
+        # Aging offset register, -128..127; each step is about 0.1 ppm,
+        # positive slows the oscillator
+        if offset == None:
+            value = self.getReg(DS3231_REG_AGOFF)
+            return value - 256 if value > 127 else value
+        else:
+            self.setReg(DS3231_REG_AGOFF, max(-128, min(127, offset)) & 0xFF)
+            # The new offset takes effect at the next temperature conversion
+            self.setReg(DS3231_REG_CTRL, self.getReg(DS3231_REG_CTRL) | 0x20)
 
     def ALARM(self, day, hour, minute, repeat):
         IE = self.getReg(DS3231_REG_CTRL)
@@ -0,0 +1,196 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Runs the lights and fan on the RP2040's second core, so a slow upload,
+# a flash write or an I2C timeout in the main loop no longer holds up the
+# outputs. The main loop (core 0) keeps sensor sampling, logging and the
+# network; each pass it turns the settings into a row of integer targets
+# per channel group and hands them over with update(). Core 1 runs a fixed
+# period loop that works out the time of day from ticks_ms, writes a PWM
+# duty only when it changes and records how late each pass started in a
+# ring buffer, which the main loop drains into the loop timer.
+#
+# Core 1 does not allocate: targets, the clock reference and the ring are
+# preallocated arrays, shared under one lock that is only held while they
+# are copied. Flash writes on core 0 still pause core 1 briefly, which the
+# recorded lateness shows.
+
+import _thread
+import time
+from array import array
+
+MAX_DUTY = (200, 89, 94, 146)  # Red, green, blue, white
+MAX_FAN = 255
+
+# Per group: lights on, lights off (seconds since midnight), red, green,
+# blue and white duty and fan duty with the lights on, fan duty with the
+# lights off (duty_u16 values)
+FIELDS = 8
+
+
+def toSeconds(input_time):
+    # Convert HH:MM to seconds since midnight
+    inH, inM = map(int, input_time.split(":"))
+    return (inH * 60 + inM) * 60
+
+
+def targets(lights, fan):
+    # One group's row of targets from gbe_settings "lights" and "fan" sections
+    duty = lights["duty"]
+    levels = (duty["red"], duty["green"], duty["blue"], duty["white"])
+    row = [toSeconds(lights["timer"]["on"]), toSeconds(lights["timer"]["off"])]
+    for level, top in zip(levels, MAX_DUTY):
+        row.append(int(min(top, level)) * 256)
+    row.append(int(min(MAX_FAN, fan["duty"]["when lights on"])) * 256)
+    row.append(int(min(MAX_FAN, fan["duty"]["when lights off"])) * 256)
+    return row
+
+
+class Ring:
+    # Fixed number of two-integer records passed from one core to the
+    # other. When full the oldest record is overwritten and counted.
+    def __init__(self, slots):
+        self.data = array("l", [0] * (2 * slots))
+        self.slots = slots
+        self.head = 0  # Next slot to write
+        self.count = 0
+        self.dropped = 0
+        self.lock = _thread.allocate_lock()
+
+    def put(self, first, second):
+        self.lock.acquire()
+        idx = 2 * self.head
+        self.data[idx] = first
+        self.data[idx + 1] = second
+        self.head = (self.head + 1) % self.slots
+        if self.count < self.slots:
+            self.count += 1
+        else:
+            self.dropped += 1
+        self.lock.release()
+
+    def get(self, into):
+        # Oldest record into into[0] and into[1]; False if there is none
+        self.lock.acquire()
+        if not self.count:
+            self.lock.release()
+            return False
+        idx = 2 * ((self.head - self.count) % self.slots)
+        into[0] = self.data[idx]
+        into[1] = self.data[idx + 1]
+        self.count -= 1
+        self.lock.release()
+        return True
+
+
+class Controller:
+    # groups: list of (five PWM outputs red/green/blue/white/fan, "lights"
+    # section or None, "fan" section or None); None follows gbe_settings
+    def __init__(self, groups, period_ms=100, slots=256):
+        self.groups = groups
+        self.outputs = []
+        for group in groups:
+            self.outputs.extend(group[0])
+        self.period_us = int(period_ms * 1000)
+        size = FIELDS * len(groups)
+        self.shared = array("l", [0] * size)  # Targets, written by core 0
+        self.work = array("l", [0] * size)  # Core 1's copy
+        self.written = array("l", [-1] * len(self.outputs))  # Last duty set
+        self.clock = array("l", [0, 0])  # Seconds since midnight at a ticks_ms
+        self.lock = _thread.allocate_lock()
+        self.ring = Ring(slots)
+        self.record = array("l", [0, 0])
+        self.running = False
+        self.passes = 0
+        self.busy_max = 0
+        self.error = None
+
+    def update(self, config, seconds, ms):
+        # Called from the main loop with the time read from the RTC
+        row = []
+        for group in self.groups:
+            row.extend(targets(group[1] or config["lights"], group[2] or config["fan"]))
+        self.lock.acquire()
+        for idx in range(len(row)):
+            self.shared[idx] = row[idx]
+        self.clock[0] = seconds
+        self.clock[1] = ms
+        self.lock.release()
+
+    def start(self):
+        # Run on core 1; update() must have been called once
+        self.running = True
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self):
+        # Core 1 finishes its current pass and returns
+        self.running = False
+
+    def _run(self):
+        try:
+            self._loop()
+        except Exception as e:
+            self.error = e
+            print("Control loop stopped on core 1:", e)
+        self.running = False
+
+    def _loop(self):
+        shared = self.shared
+        work = self.work
+        written = self.written
+        outputs = self.outputs
+        clock = self.clock
+        groups = len(self.groups)
+        period = self.period_us
+        due = time.ticks_us()
+        while self.running:
+            start = time.ticks_us()
+            late = max(0, time.ticks_diff(start, due))
+            self.lock.acquire()
+            for idx in range(len(work)):
+                work[idx] = shared[idx]
+            seconds = clock[0]
+            ref = clock[1]
+            self.lock.release()
+            seconds = (seconds + time.ticks_diff(time.ticks_ms(), ref) // 1000) % 86400
+            for grp in range(groups):
+                row = FIELDS * grp
+                out = 5 * grp
+                lit = work[row] <= seconds < work[row + 1]
+                for ch in range(5):
+                    if ch == 4:
+                        duty = work[row + 6] if lit else work[row + 7]
+                    else:
+                        duty = work[row + 2 + ch] if lit else 0
+                    if duty != written[out + ch]:
+                        outputs[out + ch].duty_u16(duty)
+                        written[out + ch] = duty
+            busy = time.ticks_diff(time.ticks_us(), start)
+            if busy > self.busy_max:
+                self.busy_max = busy
+            self.passes += 1
+            self.ring.put(late, busy)
+            due = time.ticks_add(due, period)
+            wait = time.ticks_diff(due, time.ticks_us())
+            if wait > 0:
+                time.sleep_us(wait)
+            elif wait < -period:
+                due = time.ticks_us()  # Fell a whole period behind; start afresh
+
+    def drain(self, timer):
+        # Move the lateness recorded on core 1 into the timer's "jitter" stage
+        while self.ring.get(self.record):
+            if timer:
+                timer.record("jitter", self.record[0])
+
+    def report(self):
+        # "core1=passes/dropped records/max pass us/state"
+        state = "run" if self.running else ("error" if self.error else "stop")
+        return "core1=%d/%d/%d/%s" % (self.passes, self.ring.dropped, self.busy_max, state)
+
+    def reset(self):
+        self.passes = 0
+        self.busy_max = 0
+        self.ring.dropped = 0
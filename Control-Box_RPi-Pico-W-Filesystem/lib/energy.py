@@ -0,0 +1,352 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Energy used by the LED panel and fan, from the INA219 read many times a
+# second rather than once a loop pass.
+#
+# The INA219 converts continuously, averaging as many samples as fit in
+# one timer period, and a machine.Timer reads its power register at "rate
+# hz" (20 by default), so no part of the current is missed between reads.
+# Each reading is multiplied by the milliseconds since the last one and
+# added up, so a late timer callback still counts the time it was late.
+# The bus voltage is read every VOLT_EVERY ticks. The reads go straight to
+# the I2C peripheral, into a buffer allocated once, bypassing the driver
+# and the I2C accounting, and the time spent in each callback is measured.
+#
+# The callback fills one of two sets of sums while the main loop takes
+# the other with read() once a pass: the mean volts, milliamps and
+# milliwatts over the pass, used as the INA219 reading. account() then
+# adds the pass's energy to today's, this hour's and the total for the
+# lights and fan setting of the pass ("red/green/blue/white/fan" duties,
+# up to STATES of them). The totals are saved to /energy.json every "save
+# s" seconds and at the end of each hour, straight away even with the
+# storage library, whose flushes can be further apart, and picked up again
+# after a restart; the days before today are kept there for KEEP_DAYS days.
+#
+# trace() has the callback also keep every nth power reading with the low
+# 16 bits of its ticks_ms, up to TRACE a pass, in the same two sets; after
+# read(), traced() gives the pass's readings to send to a computer
+# (telemetry.py). With no trace the callback does no more than before.
+# Settings are in the "energy" section of /config/device_settings.json:
+#
+# {"energy": {"enabled": true, "rate hz": 20, "save s": 300}}
+
+import json
+import os
+import time
+import machine
+from array import array
+
+RATE_HZ = 20
+VOLT_EVERY = 32  # Ticks between bus voltage reads
+STATES = 8  # Light and fan settings with their own total; the rest are "other"
+KEEP_DAYS = 31
+TRACE = 128  # Traced readings kept per pass
+SAVE_S = 300
+PATH = "/energy.json"
+
+REG_BUS = 0x02
+REG_POWER = 0x03
+GAIN_8_320MV = 3  # 3.2 A range on the 0.1 ohm shunt, so the gain never has to change
+MS_PER_HOUR = 3600000
+
+
+def averaging(period_ms):
+    # INA219 ADC setting with the most averaging whose shunt and bus
+    # conversions both fit in period_ms (12-bit alone is 532 us)
+    setting = 3  # ADC_12BIT
+    us = 532
+    while setting < 15 and 4 * us <= period_ms * 1000:
+        setting = 9 if setting == 3 else setting + 1  # ADC_2SAMP and up
+        us *= 2
+    return setting
+
+
+class Meter:
+    def __init__(self, manager, name="ina", config=None, path=PATH, store=None):
+        config = config or {}
+        self.manager = manager
+        self.name = name
+        self.path = path
+        self.store = store  # storage.Store to write through, if any
+        self.period_ms = max(1, int(1000 / config.get("rate hz", RATE_HZ)))
+        self.save_ms = int(config.get("save s", SAVE_S) * 1000)
+        self.timer = None
+        self.bus = None
+        self.address = 0
+        self.power_lsb = 0  # mW per count of the power register
+        self.buf = bytearray(2)
+        # Two sets of sums, filled by the timer callback in turn
+        self.half = 0
+        self.counts = [0, 0]  # Power register counts times ms
+        self.ms = [0, 0]
+        self.samples = [0, 0]
+        self.last_ms = None
+        self.volts_mv = 0
+        self.since_volts = VOLT_EVERY
+        self.pass_wh = 0.0
+        self.values = [None, None, None]  # Volts, mA and mW over the last pass
+        # Readings kept for a trace: (ticks_ms & 0xFFFF, power count) pairs
+        self.trace = None  # Two arrays while a trace is on
+        self.trace_n = [0, 0]
+        self.trace_every = 1
+        self.trace_skip = 0
+        self.trace_last = 0  # Set that read() last took, and its readings
+        self.trace_taken = 0
+        self.trace_lost = 0  # Readings that did not fit
+        # Callback cost and health
+        self.ticks = 0
+        self.reads = 0  # I2C transactions
+        self.busy_us = 0
+        self.busy_max = 0
+        self.late = 0  # Periods the callback ran late by, in all
+        self.fails = 0
+        self.overflows = 0
+        self.since_ms = time.ticks_ms()
+        # Totals
+        self.date = None
+        self.day_wh = 0.0
+        self.hour = None
+        self.hour_wh = 0.0
+        self.total_wh = 0.0
+        self.states = {}  # "r/g/b/w/f" -> Wh
+        self.days = {}  # Earlier days' "YYYY-MM-DD" -> Wh
+        self.duties = None  # Duties of the last pass, packed as in the state key
+        self.fans = None
+        self.state = "other"
+        self.saved_ms = time.ticks_ms()
+
+    def start(self):
+        # Set up the INA219 and the timer; False if the INA219 is not there
+        ina = self.manager.get(self.name)
+        if ina is None:
+            return False
+        adc = averaging(self.period_ms)
+        if not self.manager.read(
+            self.name,
+            lambda dev: dev.configure(gain=GAIN_8_320MV, bus_adc=adc, shunt_adc=adc) or True,
+            False,
+        ):
+            return False
+        self.bus = self.manager.slots[self.name].bus
+        self.address = self.manager.slots[self.name].address
+        self.power_lsb = ina._power_lsb * 1000  # Set by configure()
+        self.load()
+        self.last_ms = time.ticks_ms()
+        self.since_ms = self.last_ms
+        self.timer = machine.Timer(
+            mode=machine.Timer.PERIODIC, period=self.period_ms, callback=self._tick
+        )
+        return True
+
+    def stop(self):
+        if self.timer:
+            self.timer.deinit()
+            self.timer = None
+
+    def _tick(self, timer):
+        start = time.ticks_us()
+        half = self.half
+        try:
+            # The raw bus, so the callback never runs inside the I2C accounting
+            i2c = getattr(self.bus, "i2c", self.bus)
+            buf = self.buf
+            i2c.readfrom_mem_into(self.address, REG_POWER, buf)
+            self.reads += 1
+            now = time.ticks_ms()
+            dt = time.ticks_diff(now, self.last_ms)
+            self.last_ms = now
+            count = buf[0] << 8 | buf[1]
+            self.counts[half] += count * dt
+            self.ms[half] += dt
+            self.samples[half] += 1
+            trace = self.trace
+            if trace is not None:
+                self.trace_skip += 1
+                if self.trace_skip >= self.trace_every:
+                    self.trace_skip = 0
+                    n = self.trace_n[half]
+                    if n < TRACE:
+                        trace[half][2 * n] = now & 0xFFFF
+                        trace[half][2 * n + 1] = count
+                        self.trace_n[half] = n + 1
+                    else:
+                        self.trace_lost += 1
+            if dt >= 2 * self.period_ms:
+                self.late += dt // self.period_ms - 1
+            self.since_volts += 1
+            if self.since_volts >= VOLT_EVERY:
+                self.since_volts = 0
+                i2c.readfrom_mem_into(self.address, REG_BUS, buf)
+                self.reads += 1
+                if buf[1] & 1:
+                    self.overflows += 1  # Power reading out of range
+                self.volts_mv = (buf[0] << 8 | buf[1]) >> 3 << 2
+        except OSError:
+            self.fails += 1
+        us = time.ticks_diff(time.ticks_us(), start)
+        self.ticks += 1
+        self.busy_us += us
+        if us > self.busy_max:
+            self.busy_max = us
+
+    def read(self):
+        # Mean volts, mA and mW since the last call, or Nones if no reading came
+        half = self.half
+        self.half = 1 - half  # The callback fills the other set from here on
+        counts, ms, samples = self.counts[half], self.ms[half], self.samples[half]
+        self.counts[half] = 0
+        self.ms[half] = 0
+        self.samples[half] = 0
+        self.trace_last = half
+        self.trace_taken = self.trace_n[half]
+        self.trace_n[half] = 0  # Left alone until the callback comes back to it
+        out = self.values
+        if not samples or not ms:
+            self.pass_wh = 0.0
+            out[0] = out[1] = out[2] = None
+            return out
+        mw = counts * self.power_lsb / ms
+        self.pass_wh = mw * ms / 1000 / MS_PER_HOUR
+        volts = self.volts_mv / 1000
+        out[0] = volts
+        out[1] = mw / volts if volts else None
+        out[2] = mw
+        return out
+
+    def trace_rate(self, hz):
+        # Keep readings at about hz for traced(), or stop with 0; the rate
+        # it gives
+        if not hz or not self.timer:
+            self.trace = None
+            return 0
+        self.trace_every = max(1, round(1000 / hz / self.period_ms))
+        if self.trace is None:
+            self.trace_n[0] = self.trace_n[1] = 0
+            self.trace = [array("H", bytes(4 * TRACE)), array("H", bytes(4 * TRACE))]
+        return 1000 / (self.trace_every * self.period_ms)
+
+    def traced(self):
+        # The readings of the pass read() last took: (array of ms, count
+        # pairs, number of readings)
+        if self.trace is None:
+            return None, 0
+        return self.trace[self.trace_last], self.trace_taken
+
+    def account(self, status, date):
+        # Add the last pass's energy to the totals for its day, hour and setting
+        if self.date != date:
+            if self.date is not None:
+                self._close_day()
+            self.date = date
+        if self.hour is None:
+            self.hour = status["hou"]
+        duties = (status["red"] << 8 | status["gre"]) << 8 | status["blu"]
+        fans = status["whi"] << 8 | status["fan"]
+        if duties != self.duties or fans != self.fans:
+            self.duties = duties
+            self.fans = fans
+            key = "%d/%d/%d/%d/%d" % (
+                status["red"], status["gre"], status["blu"], status["whi"], status["fan"])
+            self.state = key if key in self.states or len(self.states) < STATES else "other"
+        wh = self.pass_wh
+        self.states[self.state] = self.states.get(self.state, 0.0) + wh
+        self.day_wh += wh
+        self.hour_wh += wh
+        self.total_wh += wh
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.saved_ms) >= self.save_ms:
+            self.save()
+
+    def _close_day(self):
+        self.days[self.date] = self.day_wh
+        while len(self.days) > KEEP_DAYS:
+            del self.days[min(self.days)]
+        self.day_wh = 0.0
+
+    def close_hour(self, hour):
+        # Energy in the hour just ended, in Wh; starts the next hour
+        wh = self.hour_wh
+        self.hour_wh = 0.0
+        self.hour = hour
+        self.save()
+        return wh
+
+    def save(self):
+        self.saved_ms = time.ticks_ms()
+        saved = {
+            "time": time.time(), "date": self.date, "hour": self.hour,
+            "day": self.day_wh, "hour wh": self.hour_wh, "total": self.total_wh,
+            "states": self.states, "days": self.days,
+        }
+        try:
+            if self.store:
+                self.store.replace(self.path, json.dumps(saved))  # Counted with the other writes
+            else:
+                with open(self.path + ".tmp", "w") as efile:
+                    json.dump(saved, efile)
+                os.rename(self.path + ".tmp", self.path)
+        except OSError as e:
+            print("Error saving energy totals:", e)
+
+    def load(self):
+        # Totals saved before a restart; today's and this hour's only count
+        # if they were saved today and this hour
+        try:
+            with open(self.path) as efile:
+                saved = json.load(efile)
+        except (OSError, ValueError):
+            return False
+        self.total_wh = saved.get("total", 0.0)
+        self.states = saved.get("states", {})
+        self.days = saved.get("days", {})
+        self.date = saved.get("date")
+        self.day_wh = saved.get("day", 0.0)  # Put with the earlier days if not today's
+        now = time.localtime()
+        if saved.get("hour") == now[3] and 0 <= time.time() - saved.get("time", 0) < 3600:
+            self.hour = now[3]
+            self.hour_wh = saved.get("hour wh", 0.0)
+        return True
+
+    def cpu(self):
+        # Percent of the time since the last reset spent in the timer callback
+        elapsed = time.ticks_diff(time.ticks_ms(), self.since_ms)
+        return self.busy_us / elapsed / 10 if elapsed > 0 else 0.0
+
+    def report(self):
+        # Ticks, periods late, failed reads, overflows, mean and max callback
+        # us and CPU percent, then today's Wh
+        return "energy=%d/%d/%d/%d/%d/%d/%.2f/%.1f" % (
+            self.ticks, self.late, self.fails, self.overflows,
+            self.busy_us // self.ticks if self.ticks else 0, self.busy_max, self.cpu(),
+            self.day_wh,
+        )
+
+    def reset(self):
+        self.ticks = 0
+        self.reads = 0
+        self.busy_us = 0
+        self.busy_max = 0
+        self.late = 0
+        self.fails = 0
+        self.overflows = 0
+        self.since_ms = time.ticks_ms()
+
+    def table(self):
+        lines = [
+            "rate %d Hz, %d ticks, %d reads, %d late, %d failed, %d overflows" % (
+                1000 // self.period_ms, self.ticks, self.reads, self.late, self.fails,
+                self.overflows),
+            "callback mean %d us, max %d us, %.2f%% CPU" % (
+                self.busy_us // self.ticks if self.ticks else 0, self.busy_max, self.cpu()),
+            "this hour %.2f Wh, today %.2f Wh, total %.2f Wh" % (
+                self.hour_wh, self.day_wh, self.total_wh),
+            "setting (r/g/b/w/fan)      Wh",
+        ]
+        for key in self.states:
+            lines.append("%-20s %8.2f" % (key, self.states[key]))
+        for date in sorted(self.days):
+            lines.append("%-20s %8.2f" % (date, self.days[date]))
+        return "\n".join(lines)
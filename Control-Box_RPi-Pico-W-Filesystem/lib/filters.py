@@ -0,0 +1,144 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Cleans up sensor readings before they are averaged and uploaded.
+#
+# A reading the sensor could not give is None, the missing-value marker,
+# rather than a zero that would be averaged in as if it were real. Each
+# reading key (as in the status: "ssm", "tem", "air2.hum" and so on) can
+# have a chain of stages, run in this order on every new reading:
+#
+#   "range": [low, high]  readings outside it are missing
+#   "max step": s         a reading further than s from the last one kept
+#                         is missing, unless STEP_RUN in a row are, in
+#                         which case the level really has changed
+#   "median": n           median of the last n readings kept
+#   "ewma": a             exponentially weighted average, weight a (0-1)
+#
+# set in the "filters" section of /config/device_settings.json, e.g.
+#
+# {"filters": {"ssm": {"range": [100, 2000], "max step": 150, "median": 5},
+#              "tem": {"range": [-40, 85], "max step": 5, "ewma": 0.5}}}
+#
+# A key listed there replaces its defaults below; {} turns them off.
+# Values are held in fixed point, in hundredths, and the median window and
+# its sorted copy are allocated once, so no buffers are built per reading.
+
+SCALE = 100  # Fixed point: hundredths
+STEP_RUN = 3
+
+DEFAULTS = {
+    "ssm": {"range": [100, 2000], "max step": 300, "median": 3},
+    "sst": {"range": [-20, 85]},
+    "tem": {"range": [-40, 85], "max step": 10},
+    "hum": {"range": [0, 100], "max step": 30},
+    "vol": {"range": [0, 32]},
+}
+
+
+class Filter:
+    def __init__(self, low=None, high=None, step=None, median=1, ewma=None):
+        self.low = None if low is None else int(low * SCALE)
+        self.high = None if high is None else int(high * SCALE)
+        self.step = None if step is None else int(step * SCALE)
+        size = max(1, int(median))
+        self.window = [0] * size  # Readings in arrival order
+        self.sorted = [0] * size  # The same, sorted
+        self.count = 0
+        self.pos = 0
+        self.weight = int(ewma * 256) if ewma else 0  # EWMA weight in 256ths
+        self.smooth = None
+        self.last = None  # Last reading kept
+        self.run = 0  # Readings rejected in a row
+        self.missing = 0
+        self.rejected = 0
+
+    def add(self, value):
+        # Filtered value of a new reading, or None
+        if value is None:
+            self.missing += 1
+            return None
+        x = int(value * SCALE + (0.5 if value >= 0 else -0.5))
+        if (self.low is not None and x < self.low) or (self.high is not None and x > self.high):
+            self.rejected += 1
+            return None
+        if self.step is not None and self.last is not None and abs(x - self.last) > self.step:
+            self.run += 1
+            if self.run < STEP_RUN:
+                self.rejected += 1
+                return None
+        self.run = 0
+        self.last = x
+        x = self._median(x)
+        if self.weight:
+            if self.smooth is None:
+                self.smooth = x
+            else:
+                # Rounded half away from zero, so the average settles as
+                # close to a rising level as to a falling one
+                step = (x - self.smooth) * self.weight
+                self.smooth += (step + 128) // 256 if step >= 0 else -((128 - step) // 256)
+            x = self.smooth
+        return x / SCALE
+
+    def _median(self, x):
+        size = len(self.window)
+        if size == 1:
+            return x
+        s = self.sorted
+        if self.count < size:
+            n = self.count
+            self.count += 1
+        else:
+            # Take the oldest reading out of the sorted copy
+            old = self.window[self.pos]
+            i = 0
+            while s[i] != old:
+                i += 1
+            while i < size - 1:
+                s[i] = s[i + 1]
+                i += 1
+            n = size - 1
+        i = n
+        while i > 0 and s[i - 1] > x:
+            s[i] = s[i - 1]
+            i -= 1
+        s[i] = x
+        self.window[self.pos] = x
+        self.pos = (self.pos + 1) % size
+        n += 1
+        if n % 2:
+            return s[n // 2]
+        return (s[n // 2 - 1] + s[n // 2]) // 2
+
+
+class Filters:
+    def __init__(self, config=None):
+        self.config = config or {}
+        self.chains = {}  # Key -> Filter, in the order keys were added
+
+    def chain(self, key):
+        # The Filter for a reading key
+        if key not in self.chains:
+            entry = self.config.get(key, DEFAULTS.get(key.split(".")[-1], {}))
+            low, high = entry.get("range", (None, None))
+            self.chains[key] = Filter(
+                low, high, entry.get("max step"), entry.get("median", 1), entry.get("ewma")
+            )
+        return self.chains[key]
+
+    def report(self):
+        # "filters key=missing/rejected ..." for keys that lost readings this hour
+        out = "filters"
+        for key in self.chains:
+            stage = self.chains[key]
+            if stage.missing or stage.rejected:
+                out += " %s=%d/%d" % (key, stage.missing, stage.rejected)
+        return out
+
+    def reset(self):
+        for stage in self.chains.values():
+            stage.missing = 0
+            stage.rejected = 0
@@ -0,0 +1,64 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Requests from and binary frames to a program on the computer, over the
+# USB console, shared by the log copy (serialsync.py) and the sample
+# stream (telemetry.py).
+#
+# A request is a line on the console that starts with SOH (0x01), so it is
+# never taken for a typed command, and ends with the CRC32 of the rest in
+# hex. It is plain text because the USB console treats Ctrl-C (0x03) as an
+# interrupt, which a binary request could contain:
+#
+#   \x01<seq> <letter> [<word> ...] <crc>
+#
+# The console (console.py) checks it and hands it to the function
+# registered for its letter. Replies are binary frames, written between
+# the status lines:
+#
+#   SOH "G" <type> <seq> <length u16> <payload> <CRC32 u32 of type to payload>
+#
+# with the request's seq, so the computer can tell them from the replies
+# to an earlier request. X frames carry an error message.
+
+import struct
+from binascii import crc32
+
+MAGIC = b"\x01G"
+HEAD = "<2sBBH"  # Magic, type, sequence, payload length
+HEAD_SIZE = 6
+CRC_SIZE = 4
+
+
+def parse(line):
+    # (seq, letter, [words]) from a request line without its SOH, or None
+    # if it is garbled
+    words = line.split()
+    if len(words) < 3:
+        return None
+    text = line[:line.rfind(" ")]
+    if "%08x" % (crc32(text.encode()) & 0xFFFFFFFF) != words[-1].lower():
+        return None
+    try:
+        return int(words[0]) & 255, words[1], words[2:-1]
+    except ValueError:
+        return None
+
+
+def seal(buf, kind, seq, length):
+    # Make buf a frame around the length bytes of payload already at
+    # buf[HEAD_SIZE:]; the size of the frame
+    struct.pack_into(HEAD, buf, 0, MAGIC, kind, seq & 255, length)
+    end = HEAD_SIZE + length
+    crc = crc32(memoryview(buf)[2:end]) & 0xFFFFFFFF
+    struct.pack_into("<I", buf, end, crc)
+    return end + CRC_SIZE
+
+
+def send(out, kind, seq, payload):
+    # Write one frame with payload
+    head = struct.pack(HEAD, MAGIC, kind, seq & 255, len(payload))
+    crc = crc32(payload, crc32(head[2:])) & 0xFFFFFFFF
+    out.write(head + payload + struct.pack("<I", crc))
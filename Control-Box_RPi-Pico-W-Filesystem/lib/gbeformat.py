@@ -7,15 +7,35 @@
 import re
 
 
-def columns(stat):
-    if stat["tem"] == 0:
+# A sensor reading that is missing, or was filtered out, is None. It is
+# shown as "-" on the console and left blank in the log and the upload.
+
+
+def rnd(value, digits=0):
+    # round() that keeps None
+    if value is None:
+        return None
+    return round(value, digits) if digits else round(value)
+
+
+def num(value, digits=0):
+    # Rounded value as text, or "" for None
+    return "" if value is None else str(rnd(value, digits))
+
+
+def col(fmt, value):
+    # Console column, "-" for None
+    if value is None:
+        return " " * (len(fmt % 0) - 1) + "-"
+    return fmt % value
+
+
+def columns(stat, date=None):
+    # date is ymd(stat) if the caller already has it
+    if stat["tem"] in (0, None):
         stat["tem"] = stat["sst"]
     return (
-        str(stat["yea"])
-        + "-"
-        + str("%02d" % stat["mon"])
-        + "-"
-        + str("%02d" % stat["day"])
+        (date or ymd(stat))
         + " "
         + str("%02d" % stat["hou"])
         + ":"
@@ -31,21 +51,21 @@ def columns(stat):
         + " "
         + str("%3.f" % stat["whi"])
         + "  "
-        + str("%5.2f" % stat["vol"])
+        + col("%5.2f", stat["vol"])
         + " "
-        + str("%4.f" % stat["mam"])
+        + col("%4.f", stat["mam"])
         + " "
-        + str("%5.2f" % stat["wat"])
+        + col("%5.2f", stat["wat"])
         + "  "
         + str("%3.f" % stat["fan"])
         + " "
         + str("%4.f" % stat["rpm"])
         + "  "
-        + str("%5.2f" % stat["tem"])
+        + col("%5.2f", stat["tem"])
         + " "
-        + str("%5.2f" % stat["hum"])
+        + col("%5.2f", stat["hum"])
         + " "
-        + str("%4.f" % stat["ssm"])
+        + col("%4.f", stat["ssm"])
     )
 
 
@@ -85,24 +105,57 @@ def hourlog(stat, log_avg):
         + "\t"
         + str(round(log_avg["whi"]))
         + "\t"
-        + str(round(log_avg["vol"], 2))
+        + num(log_avg["vol"], 2)
         + "\t"
-        + str(round(log_avg["mam"]))
+        + num(log_avg["mam"])
         + "\t"
-        + str("%.2f" % round(log_avg["wat"], 2))
+        + ("" if log_avg["wat"] is None else "%.2f" % round(log_avg["wat"], 2))
         + "\t"
         + str(round(log_avg["fan"]))
         + "\t"
         + str(round(log_avg["rpm"]))
         + "\t"
-        + str(log_avg["tem"])
+        + num(log_avg["tem"], 2)
         + "\t"
-        + str(log_avg["hum"])
+        + num(log_avg["hum"], 2)
         + "\t"
-        + str(round(log_avg["ssm"]))
+        + num(log_avg["ssm"])
     )
 
 
+# Log column names for the keys of extra chambers and sensors ("<name>.<key>")
+LABELS = {
+    "red": "Red",
+    "gre": "Green",
+    "blu": "Blue",
+    "whi": "White",
+    "fan": "Fan",
+    "rpm": "Fan RPM",
+    "vol": "Volts",
+    "mam": "Milliamps",
+    "wat": "Watts",
+    "tem": "Temperature",
+    "hum": "Humidity",
+    "ssm": "Soil moisture",
+    "sst": "Soil temperature",
+}
+
+
+def extra_head(keys):
+    head = ""
+    for key in keys:
+        name, field = key.split(".")
+        head += "\t" + name + " " + LABELS.get(field, field)
+    return head
+
+
+def extra_log(keys, log_avg):
+    line = ""
+    for key in keys:
+        line += "\t" + ("" if log_avg[key] is None else "%g" % round(log_avg[key], 2))
+    return line
+
+
 def url_query(stat, log_avg):
     return (
         "boa="
@@ -136,13 +189,13 @@ def url_query(stat, log_avg):
         + str(round(log_avg["whi"]))
         + "&"
         + "vol="
-        + str(round(log_avg["vol"], 2))
+        + num(log_avg["vol"], 2)
         + "&"
         + "mam="
-        + str(round(log_avg["mam"]))
+        + num(log_avg["mam"])
         + "&"
         + "wat="
-        + str(round(log_avg["wat"], 2))
+        + num(log_avg["wat"], 2)
         + "&"
         + "fan="
         + str(round(log_avg["fan"]))
@@ -151,16 +204,16 @@ def url_query(stat, log_avg):
         + str(round(log_avg["rpm"]))
         + "&"
         + "tem="
-        + str(round(log_avg["tem"], 2))
+        + num(log_avg["tem"], 2)
         + "&"
         + "hum="
-        + str(round(log_avg["hum"], 2))
+        + num(log_avg["hum"], 2)
         + "&"
         + "sst="
-        + str(round(log_avg["sst"], 2))
+        + num(log_avg["sst"], 2)
         + "&"
         + "ssm="
-        + str(round(log_avg["ssm"]))
+        + num(log_avg["ssm"])
         + "&"
         + "con="
         + str(stat["con"])
@@ -0,0 +1,382 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Lightweight MQTT 3.1.1 client for sending telemetry to a broker as an
+# alternative to the hourly HTTP upload. Hourly log records are sent with
+# QoS 1 and kept in a bounded queue on flash while the broker is unreachable,
+# as are alerts, on <prefix>/<board>/alert.
+# Configuration is read from /config/mqtt_settings.json, for example:
+#
+# {"broker": "192.168.1.10", "port": 1883, "publish interval": 60,
+#  "topic prefix": "gbe", "queue limit": 48, "http upload": false}
+
+import json
+import os
+import socket
+import struct
+import time
+
+
+class MQTTException(Exception):
+    pass
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=1883, user=None, password=None, keepalive=60):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.sock = None
+        self.pid = 0
+        self.cb = None
+        self.timeout = 5
+        self.last_tx = 0
+
+    def _send(self, data):
+        self.sock.sendall(data)
+        self.last_tx = time.ticks_ms()
+
+    def _recv(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise MQTTException("connection closed")
+            data += chunk
+        return data
+
+    def _send_str(self, s):
+        if isinstance(s, str):
+            s = s.encode()
+        self._send(struct.pack("!H", len(s)) + s)
+
+    def _recv_len(self):
+        n = 0
+        sh = 0
+        while True:
+            b = self._recv(1)[0]
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                return n
+            sh += 7
+
+    def _header(self, ptype, length):
+        # Fixed header with variable length remaining-length field
+        hdr = bytearray([ptype])
+        while length > 0x7F:
+            hdr.append((length & 0x7F) | 0x80)
+            length >>= 7
+        hdr.append(length)
+        return hdr
+
+    def _next_pid(self):
+        self.pid = self.pid % 65535 + 1
+        return self.pid
+
+    def connect(self, clean_session=False, timeout=5):
+        self.timeout = timeout
+        self.sock = socket.socket()
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(socket.getaddrinfo(self.server, self.port)[0][-1])
+        except:
+            self.close()
+            raise
+        length = 10 + 2 + len(self.client_id)
+        flags = 0x02 if clean_session else 0
+        if self.user is not None:
+            length += 2 + len(self.user) + 2 + len(self.pswd)
+            flags |= 0xC0
+        self._send(self._header(0x10, length))
+        self._send(b"\x00\x04MQTT\x04" + bytes([flags]) + struct.pack("!H", self.keepalive))
+        self._send_str(self.client_id)
+        if self.user is not None:
+            self._send_str(self.user)
+            self._send_str(self.pswd)
+        resp = self._recv(4)
+        if resp[0] != 0x20 or resp[1] != 0x02:
+            raise MQTTException("unexpected CONNACK")
+        if resp[3] != 0:
+            raise MQTTException("connection refused: %d" % resp[3])
+        return resp[2] & 1
+
+    def close(self):
+        try:
+            self.sock.close()
+        except:
+            pass
+        self.sock = None
+
+    def disconnect(self):
+        try:
+            self._send(b"\xe0\x00")
+        except:
+            pass
+        self.close()
+
+    def ping(self):
+        self._send(b"\xc0\x00")
+
+    def publish(self, topic, msg, qos=0, retain=False):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        length = 2 + len(topic) + len(msg)
+        if qos > 0:
+            length += 2
+        self._send(self._header(0x30 | qos << 1 | retain, length))
+        self._send_str(topic)
+        if qos > 0:
+            pid = self._next_pid()
+            self._send(struct.pack("!H", pid))
+        self._send(msg)
+        if qos == 1:
+            # Wait for the matching PUBACK, handling any messages that arrive first
+            while True:
+                op = self.wait_msg()
+                if op == 0x40:
+                    self._recv(1)
+                    if struct.unpack("!H", self._recv(2))[0] == pid:
+                        return
+                elif op is not None:
+                    self._recv(self._recv_len())
+
+    def subscribe(self, topic, qos=1):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        pid = self._next_pid()
+        self._send(self._header(0x82, 2 + 2 + len(topic) + 1))
+        self._send(struct.pack("!H", pid))
+        self._send_str(topic)
+        self._send(bytes([qos]))
+        while True:
+            op = self.wait_msg()
+            if op == 0x90:
+                resp = self._recv(4)
+                if resp[3] == 0x80:
+                    raise MQTTException("subscription refused")
+                return
+            elif op is not None:
+                self._recv(self._recv_len())
+
+    # Read one packet. Incoming PUBLISH packets are passed to the callback and
+    # return None; other packet types are returned for the caller to finish.
+    def wait_msg(self):
+        return self._dispatch(self._recv(1)[0])
+
+    # Non-blocking check for an incoming packet
+    def check_msg(self):
+        self.sock.setblocking(False)
+        try:
+            res = self.sock.recv(1)
+        except OSError:
+            return None
+        finally:
+            self.sock.settimeout(self.timeout)
+        if not res:
+            raise MQTTException("connection closed")
+        op = self._dispatch(res[0])
+        if op is not None:
+            self._recv(self._recv_len())  # Discard late PUBACKs and the like
+
+    def _dispatch(self, op):
+        if op == 0xD0:  # PINGRESP
+            self._recv(1)
+            return None
+        if op & 0xF0 != 0x30:
+            return op
+        self._recv_publish(op)
+        return None
+
+    def _recv_publish(self, op):
+        sz = self._recv_len()
+        topic_len = struct.unpack("!H", self._recv(2))[0]
+        topic = self._recv(topic_len)
+        sz -= topic_len + 2
+        if op & 6:
+            pid = struct.unpack("!H", self._recv(2))[0]
+            sz -= 2
+        msg = self._recv(sz)
+        if self.cb:
+            self.cb(topic, msg)
+        if op & 6 == 2:
+            self._send(b"\x40\x02" + struct.pack("!H", pid))
+
+
+class FlashQueue:
+    # Bounded queue of (topic, message) records kept on flash, one per line.
+    # Records are streamed line by line so the queue never has to fit in RAM.
+
+    def __init__(self, path, limit=48, store=None):
+        self.path = path
+        self.limit = limit
+        self.store = store  # storage.Store that gathers the appends, if any
+        self.count = 0
+        try:
+            with open(path) as qfile:
+                for line in qfile:
+                    self.count += 1
+        except OSError:
+            pass
+
+    def put(self, topic, msg):
+        if self.store:
+            self.store.append(self.path, topic + "\t" + msg + "\n")
+        else:
+            with open(self.path, "a") as qfile:
+                qfile.write(topic + "\t" + msg + "\n")
+        self.count += 1
+        if self.count > self.limit:
+            self._rewrite(self.count - self.limit)
+
+    def _rewrite(self, skip):
+        # Copy the queue to a new file, dropping the oldest records
+        if self.store:
+            self.store.flush(self.path)
+        kept = 0
+        written = 0
+        tmp_path = self.path + ".tmp"
+        with open(self.path) as qfile:
+            with open(tmp_path, "w") as tmp:
+                for idx, line in enumerate(qfile):
+                    if idx >= skip:
+                        tmp.write(line)
+                        kept += 1
+                        written += len(line)
+        os.remove(self.path)
+        if kept:
+            os.rename(tmp_path, self.path)
+        else:
+            os.remove(tmp_path)
+        self.count = kept
+        if self.store:
+            if kept:
+                self.store.wrote(self.path, written)
+            else:
+                self.store.forget(self.path)
+
+    def drain(self, send):
+        # Send queued records in order. A failure is raised once the records
+        # already sent are off the queue, so the caller knows the link is down
+        if not self.count:
+            return 0
+        if self.store:
+            self.store.flush(self.path)
+        sent = 0
+        try:
+            with open(self.path) as qfile:
+                for line in qfile:
+                    parts = line.rstrip("\n").split("\t", 1)
+                    if len(parts) == 2:
+                        send(parts[0], parts[1])
+                    sent += 1  # A damaged line is dropped rather than kept forever
+        finally:
+            if sent:
+                self._rewrite(sent)
+        return sent
+
+
+class Telemetry:
+    # Keeps an MQTT session alive from the main loop, publishing samples at a
+    # fixed interval and forwarding config pushed to <prefix>/<board>/config
+
+    def __init__(self, board_id, settings, queue_path="/mqtt_queue.txt", store=None):
+        self.settings = settings
+        self.interval = settings.get("publish interval", 60)
+        self.sample_qos = settings.get("sample qos", 0)
+        self.http = settings.get("http upload", False)
+        self.retry = settings.get("retry seconds", 30)
+        prefix = settings.get("topic prefix", "gbe") + "/" + board_id + "/"
+        self.sample_topic = prefix + "sample"
+        self.log_topic = prefix + "log"
+        self.config_topic = prefix + "config"
+        self.alert_topic = prefix + "alert"
+        self.client = MQTTClient(
+            "gbe-" + board_id,
+            settings["broker"],
+            settings.get("port", 1883),
+            settings.get("user"),
+            settings.get("password"),
+            settings.get("keepalive", 60),
+        )
+        self.client.cb = self._message
+        self.queue = FlashQueue(queue_path, settings.get("queue limit", 48), store)
+        self.on_config = None
+        self.connected = False
+        self.last_attempt = None
+        self.last_sample = None
+        self.published = 0
+        self.failures = 0
+
+    def _message(self, topic, msg):
+        if topic.decode() == self.config_topic and self.on_config:
+            try:
+                self.on_config(json.loads(msg))
+            except ValueError:
+                print("Invalid config received over MQTT")
+
+    def _lost(self):
+        self.connected = False
+        self.failures += 1
+        self.client.close()
+
+    def _publish(self, topic, msg, qos):
+        self.client.publish(topic, msg, qos)
+        self.published += 1
+
+    def connect(self):
+        self.last_attempt = time.time()
+        try:
+            self.client.connect()
+            self.client.subscribe(self.config_topic, 1)
+            self.connected = True
+            self.queue.drain(lambda topic, msg: self._publish(topic, msg, 1))
+        except Exception:
+            self._lost()
+        return self.connected
+
+    def service(self, status):
+        # Called once per main loop: reconnect, publish, and check for config
+        now = time.time()
+        if not self.connected:
+            if self.last_attempt is None or now - self.last_attempt >= self.retry:
+                self.connect()
+            if not self.connected:
+                return
+        try:
+            if self.last_sample is None or now - self.last_sample >= self.interval:
+                self.last_sample = now
+                self._publish(self.sample_topic, json.dumps(status), self.sample_qos)
+            elif time.ticks_diff(time.ticks_ms(), self.client.last_tx) > self.client.keepalive * 500:
+                self.client.ping()
+            self.client.check_msg()
+        except Exception:
+            self._lost()
+
+    def log(self, msg):
+        # Send an hourly record, queueing it on flash if the broker is unreachable
+        if self.connected:
+            try:
+                self._publish(self.log_topic, msg, 1)
+                return True
+            except Exception:
+                self._lost()
+        self.queue.put(self.log_topic, msg)
+        return False
+
+    def alert(self, msg):
+        # Send an alert record (lib/anomaly.py) now, queued like an hourly record
+        if self.connected:
+            try:
+                self._publish(self.alert_topic, msg, 1)
+                return True
+            except Exception:
+                self._lost()
+        self.queue.put(self.alert_topic, msg)
+        return False
@@ -0,0 +1,148 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Heap telemetry and scheduled garbage collection. The loop timer calls
+# start(), mark() and end() so the bytes allocated by each stage are known;
+# a drop in gc.mem_alloc() inside a stage means the automatic collector ran
+# there. idle() is called where a pause is harmless (before the main loop's
+# sleep) and collects once free memory falls below the threshold, so the
+# automatic collector should never have to step in during a stage.
+
+import gc
+import time
+
+
+class HeapMonitor:
+    def __init__(self, enabled=True, collect_below=None, gc_threshold=None):
+        self.enabled = enabled
+        gc.collect()
+        self.size = gc.mem_free() + gc.mem_alloc()
+        # Collect when less than a quarter of the heap is free, unless set
+        self.collect_below = collect_below or self.size // 4
+        if gc_threshold:
+            gc.threshold(gc_threshold)  # Automatic collection as a safety net
+        self.stages = {}  # name -> [bytes allocated, largest in one loop, stray collections]
+        self.order = []
+        self.last = 0
+        self.reset()
+
+    def reset(self):
+        for name in self.order:
+            entry = self.stages[name]
+            entry[0] = entry[1] = entry[2] = 0
+        self.loops = 0
+        self.free_min = self.size
+        self.alloc_peak = 0
+        self.collects = 0
+        self.collect_us = 0
+        self.collect_max_us = 0
+        self.stray = 0
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.last = gc.mem_alloc()
+
+    def mark(self, name):
+        # Attribute the allocations since the previous mark to this stage
+        if not self.enabled:
+            return
+        now = gc.mem_alloc()
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = [0, 0, 0]
+            self.order.append(name)
+        used = now - self.last
+        if used < 0:
+            entry[2] += 1  # Heap shrank, so the collector ran in this stage
+            self.stray += 1
+        else:
+            entry[0] += used
+            if used > entry[1]:
+                entry[1] = used
+        if now > self.alloc_peak:
+            self.alloc_peak = now
+        self.last = now
+
+    def end(self):
+        if not self.enabled:
+            return
+        self.loops += 1
+        free = self.size - self.last
+        if free < self.free_min:
+            self.free_min = free
+
+    def _collect(self):
+        gc.collect()
+        self.last = gc.mem_alloc()  # Not an allocation by the current stage
+
+    def idle(self):
+        # Collect now if free memory is low; returns True if it did
+        if not self.enabled or gc.mem_free() >= self.collect_below:
+            return False
+        t0 = time.ticks_us()
+        self._collect()
+        used = time.ticks_diff(time.ticks_us(), t0)
+        self.collects += 1
+        self.collect_us += used
+        if used > self.collect_max_us:
+            self.collect_max_us = used
+        return True
+
+    def largest_free(self):
+        # Largest single allocation that succeeds after a collection, found
+        # by bisection. Costs two collections and a dozen allocations.
+        self._collect()
+        low = 0
+        high = gc.mem_free()
+        while high - low > 64:
+            size = (low + high) // 2
+            try:
+                block = bytearray(size)
+                del block
+                low = size
+            except MemoryError:
+                high = size
+        self._collect()
+        return low
+
+    def report(self):
+        # "heap=min free/peak alloc/largest block/frag%" with fragmentation
+        # the free memory that cannot be had in one piece, then
+        # "gc=collections/avg ms/max ms/stray" and per stage
+        # "<stage>.alloc=bytes per loop/max bytes/stray"
+        largest = self.largest_free()
+        free = gc.mem_free()
+        loops = self.loops or 1
+        out = [
+            "heap=%d/%d/%d/%d" % (
+                self.free_min, self.alloc_peak, largest, 100 - largest * 100 // free),
+            "gc=%d/%.1f/%.1f/%d" % (
+                self.collects,
+                self.collect_us / (self.collects or 1) / 1000,
+                self.collect_max_us / 1000,
+                self.stray,
+            ),
+        ]
+        for name in self.order:
+            entry = self.stages[name]
+            out.append("%s.alloc=%d/%d/%d" % (name, entry[0] // loops, entry[1], entry[2]))
+        return out
+
+    def table(self):
+        # Figures for the console
+        largest = self.largest_free()
+        lines = [
+            "heap %d bytes, %d free, %d largest block, %d lowest free, %d peak allocated"
+            % (self.size, gc.mem_free(), largest, self.free_min, self.alloc_peak),
+            "collect below %d free: %d collections, max %.1f ms, %d in a stage"
+            % (self.collect_below, self.collects, self.collect_max_us / 1000, self.stray),
+            "stage      bytes/loop  max bytes  stray gc",
+        ]
+        loops = self.loops or 1
+        for name in self.order:
+            entry = self.stages[name]
+            lines.append("%-10s %10d %10d %9d" % (name, entry[0] // loops, entry[1], entry[2]))
+        return "\n".join(lines)
@@ -0,0 +1,189 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Drop-in wrapper for machine.I2C that counts transactions, bytes and bus
+# time per device address and per call site. Drivers are given the wrapper
+# instead of the raw bus; the main loop labels each sensor read with
+# bus.site and closes each loop with bus.end_cycle(). The first cycle holds
+# driver set-up at boot and is kept out of the per-loop figures, as is
+# traffic while bus.idle is set (between loop passes).
+#
+# Given its bus number and pins, the wrapper also frees a bus that a device
+# is holding stuck. After a timeout, or several failed transactions in a
+# row, and whenever check() is called, it reads the SDA and SCL levels; if
+# SDA is held low it clocks SCL until the device lets go, sends a stop and
+# sets the I2C peripheral up again. Errors, timeouts, stuck lines and
+# recoveries are counted in summary().
+
+import time
+from machine import I2C, Pin
+
+ETIMEDOUT = 110
+STREAK = 3  # Failed transactions in a row before the lines are checked
+
+
+class Bus:
+    def __init__(self, i2c, name="", bus_id=None, sda=None, scl=None, freq=400000, timeout=50000):
+        self.i2c = i2c
+        self.name = name
+        # Needed to free a stuck bus and set it up again
+        self.bus_id = bus_id
+        self.sda = sda
+        self.scl = scl
+        self.freq = freq
+        self.timeout = timeout
+        self.sda_pin = Pin(sda) if sda is not None else None
+        self.scl_pin = Pin(scl) if scl is not None else None
+        self.site = None
+        self.idle = False
+        self.boot = None
+        self.streak = 0
+        self.reset_stats()
+
+    def _count(self, addr, nbytes, start):
+        us = time.ticks_diff(time.ticks_us(), start)
+        entry = self.devices.get(addr)
+        if entry is None:
+            entry = self.devices[addr] = [0, 0, 0]
+        entry[0] += 1
+        entry[1] += nbytes
+        entry[2] += us
+        entry = self.sites.get(self.site)
+        if entry is None:
+            entry = self.sites[self.site] = [0, 0, 0]
+        entry[0] += 1
+        entry[1] += nbytes
+        entry[2] += us
+        if self.idle:
+            return
+        self.cycle[0] += 1
+        self.cycle[1] += nbytes
+        self.cycle[2] += us
+
+    def end_cycle(self):
+        # Close the accounting for one loop and return its totals
+        totals = self.cycle
+        if self.boot is None:
+            self.boot = totals
+            self.devices = {}
+            self.sites = {}
+        else:
+            for idx in range(3):
+                if totals[idx] > self.cycle_max[idx]:
+                    self.cycle_max[idx] = totals[idx]
+            self.cycles += 1
+        self.cycle = [0, 0, 0]
+        return totals
+
+    def reset_stats(self):
+        self.devices = {}  # address -> [transactions, bytes, microseconds]
+        self.sites = {}  # call site -> [transactions, bytes, microseconds]
+        self.cycle = [0, 0, 0]  # totals since the last end_cycle()
+        self.cycle_max = [0, 0, 0]
+        self.cycles = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.stuck = 0  # Times a line was found held low
+        self.recoveries = 0
+        self.failed = 0  # Recoveries that did not free the bus
+
+    def summary(self):
+        # Compact text form: per-device counts followed by the worst cycle
+        out = self.name + " max " + "/".join(str(v) for v in self.cycle_max)
+        for addr in sorted(self.devices):
+            out += " 0x%02x:%d/%d/%d" % ((addr,) + tuple(self.devices[addr]))
+        if self.errors or self.stuck:
+            out += " errors %d/%d stuck %d/%d/%d" % (
+                self.errors, self.timeouts, self.stuck, self.recoveries, self.failed)
+        return out
+
+    # ---- Stuck bus detection and recovery ----
+
+    def check(self):
+        # Both lines should be high while the bus is idle. If a device is
+        # holding SDA low, clock it free. Returns True if the bus is usable.
+        if self.sda_pin is None or (self.sda_pin.value() and self.scl_pin.value()):
+            return True
+        self.stuck += 1
+        if not self.scl_pin.value():
+            return False  # SCL held low: nothing the master can do
+        return self.recover()
+
+    def recover(self):
+        # Up to nine clocks let a device finish the byte it thinks it is
+        # sending, then a start and stop put every device back to idle
+        scl = Pin(self.scl, Pin.OPEN_DRAIN, value=1)
+        sda = Pin(self.sda, Pin.IN, Pin.PULL_UP)
+        for _ in range(9):
+            if sda.value():
+                break
+            scl.value(0)
+            time.sleep_us(5)
+            scl.value(1)
+            time.sleep_us(5)
+        sda = Pin(self.sda, Pin.OPEN_DRAIN, value=0)
+        time.sleep_us(5)
+        sda.value(1)
+        time.sleep_us(5)
+        freed = Pin(self.sda, Pin.IN, Pin.PULL_UP).value() == 1
+        self.reinit()
+        if freed:
+            self.recoveries += 1
+        else:
+            self.failed += 1
+        return freed
+
+    def reinit(self):
+        # Give the pins back to the I2C peripheral with the same settings
+        self.i2c = I2C(
+            self.bus_id, sda=Pin(self.sda), scl=Pin(self.scl),
+            freq=self.freq, timeout=self.timeout,
+        )
+        self.sda_pin = Pin(self.sda)
+        self.scl_pin = Pin(self.scl)
+        self.streak = 0
+
+    def _failed(self, e):
+        self.errors += 1
+        self.streak += 1
+        timeout = e.args and e.args[0] == ETIMEDOUT
+        if timeout:
+            self.timeouts += 1
+        if timeout or self.streak >= STREAK:
+            self.streak = 0
+            self.check()
+
+    def _call(self, func, addr, nbytes, *args):
+        start = time.ticks_us()
+        try:
+            result = func(addr, *args)
+            self.streak = 0
+            return result
+        except OSError as e:
+            self._failed(e)
+            raise
+        finally:
+            self._count(addr, nbytes, start)
+
+    def scan(self):
+        return self.i2c.scan()
+
+    def writeto(self, addr, buf, stop=True):
+        return self._call(self.i2c.writeto, addr, len(buf), buf, stop)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return self._call(self.i2c.readfrom, addr, nbytes, nbytes, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        return self._call(self.i2c.readfrom_into, addr, len(buf), buf, stop)
+
+    def writeto_mem(self, addr, memaddr, buf):
+        return self._call(self.i2c.writeto_mem, addr, len(buf) + 1, memaddr, buf)
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        return self._call(self.i2c.readfrom_mem, addr, nbytes + 1, memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        return self._call(self.i2c.readfrom_mem_into, addr, len(buf) + 1, memaddr, buf)
@@ -0,0 +1,168 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Per-stage timing of the main loop. Each stage keeps a fixed-size histogram
+# of durations in microseconds (two bins per power of two, up to ~16 s) from
+# which min/p50/p99/max are reported along with the number of overruns of
+# the stage's time budget. When disabled, start(), mark() and end() return
+# straight away. A heap monitor (heapmon.py) attached as `heap` is passed the
+# same start/mark/end calls whether timing is enabled or not.
+
+import time
+from array import array
+
+BINS = 48
+
+
+def _bin(us):
+    # Two bins per octave: 4-5 us, 6-7 us, 8-11 us, 12-15 us, ...
+    if us < 1:
+        return 0
+    n = 0
+    while us >= 4:
+        us >>= 1
+        n += 1
+    idx = 2 * n + us - 1
+    return idx if idx < BINS else BINS - 1
+
+
+def _lower(idx):
+    # Smallest duration that falls in bin idx
+    if idx < 3:
+        return idx + 1
+    n = (idx - 1) // 2
+    return (idx - 2 * n + 1) << n
+
+
+class Stage:
+    def __init__(self, name, budget_us):
+        self.name = name
+        self.budget_us = budget_us
+        self.bins = array("L", [0] * BINS)
+        self.reset()
+
+    def reset(self):
+        for idx in range(BINS):
+            self.bins[idx] = 0
+        self.count = 0
+        self.min = 0
+        self.max = 0
+        self.overruns = 0
+
+    def add(self, us):
+        self.bins[_bin(us)] += 1
+        if self.count == 0 or us < self.min:
+            self.min = us
+        if us > self.max:
+            self.max = us
+        if self.budget_us and us > self.budget_us:
+            self.overruns += 1
+        self.count += 1
+
+    def percentile(self, pct):
+        # Midpoint of the bin holding the requested rank, clamped to min/max
+        if not self.count:
+            return 0
+        rank = (self.count * pct + 99) // 100
+        seen = 0
+        for idx in range(BINS):
+            seen += self.bins[idx]
+            if seen >= rank:
+                mid = (_lower(idx) + _lower(idx + 1)) // 2
+                return min(max(mid, self.min), self.max)
+        return self.max
+
+
+class LoopTimer:
+    def __init__(self, enabled=True, budgets_ms=None, default_ms=0):
+        self.enabled = enabled
+        self.budgets_ms = budgets_ms or {}
+        self.default_ms = default_ms
+        self.stages = {}
+        self.order = []
+        self.t0 = 0
+        self.last = 0
+        self.heap = None
+
+    def _stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            budget = self.budgets_ms.get(name, self.default_ms)
+            stage = self.stages[name] = Stage(name, int(budget * 1000))
+            self.order.append(name)
+        return stage
+
+    def start(self):
+        # Call at the top of each loop
+        if self.heap:
+            self.heap.start()
+        if not self.enabled:
+            return
+        self.t0 = self.last = time.ticks_us()
+
+    def mark(self, name):
+        # Close the stage that ran since the previous mark
+        if self.heap:
+            self.heap.mark(name)
+        if not self.enabled:
+            return
+        now = time.ticks_us()
+        self._stage(name).add(time.ticks_diff(now, self.last))
+        self.last = now
+
+    def record(self, name, us):
+        # Add a duration measured elsewhere, e.g. on the other core
+        if self.enabled:
+            self._stage(name).add(us)
+
+    def end(self):
+        # Record the whole loop as the "loop" stage
+        if self.heap:
+            self.heap.end()
+        if not self.enabled:
+            return
+        self._stage("loop").add(time.ticks_diff(time.ticks_us(), self.t0))
+
+    def reset(self):
+        for name in self.order:
+            self.stages[name].reset()
+
+    def report(self):
+        # One "stage=min/p50/p99/max/overruns/count" entry per stage, in ms
+        out = []
+        for name in self.order:
+            st = self.stages[name]
+            out.append(
+                name
+                + "=%.1f/%.1f/%.1f/%.1f/%d/%d"
+                % (
+                    st.min / 1000,
+                    st.percentile(50) / 1000,
+                    st.percentile(99) / 1000,
+                    st.max / 1000,
+                    st.overruns,
+                    st.count,
+                )
+            )
+        return out
+
+    def table(self):
+        # Report formatted for the console
+        lines = ["stage        count     min     p50     p99     max  over  (ms)"]
+        for name in self.order:
+            st = self.stages[name]
+            lines.append(
+                "%-10s %7d %7.1f %7.1f %7.1f %7.1f %5d"
+                % (
+                    name,
+                    st.count,
+                    st.min / 1000,
+                    st.percentile(50) / 1000,
+                    st.percentile(99) / 1000,
+                    st.max / 1000,
+                    st.overruns,
+                )
+            )
+        return "\n".join(lines)
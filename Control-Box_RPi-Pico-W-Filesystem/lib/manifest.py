@@ -0,0 +1,209 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Index of the daily files in a folder (logs/ or diag/), so old files can
+# be removed without listing the folder, and files found without opening
+# them.
+#
+# Each day's file is a segment, kept in date order with its size and the
+# CRC32 of its contents, which are brought up to date as text is appended
+# (wrote()). retain() removes the oldest segments until the folder is
+# within its byte budget; the newest is always kept. It only looks at the
+# running total, so an hour with nothing to remove costs nothing. find()
+# and since() give the segments for a date or from a date on with a
+# binary search, for anything that exports the files.
+#
+# The index is kept in manifest.json in the folder itself, so it travels
+# with the files when they are copied off the box:
+#
+# {"version": 1, "segments": [["2024-05-01", 2412, 3735928559], ...]}
+#
+# At boot the sizes are checked against the files, and a segment whose
+# file has changed (text appended after the index was last saved) has its
+# CRC worked out again. Only when there is no index, or it cannot be read,
+# is the folder listed to build it. Budgets are in the "retention" section
+# of /config/device_settings.json, in KB:
+#
+# {"retention": {"logs kb": 256, "diag kb": 192}}
+
+import json
+import os
+from binascii import crc32
+
+VERSION = 1
+NAME = "manifest.json"
+EXT = ".txt"
+CHUNK = 512
+
+
+def _crc(path):
+    # CRC32 and size of a file, read a chunk at a time
+    crc = 0
+    size = 0
+    buf = bytearray(CHUNK)
+    with open(path, "rb") as file:
+        while True:
+            n = file.readinto(buf)
+            if not n:
+                break
+            crc = crc32(memoryview(buf)[:n], crc)
+            size += n
+    return crc & 0xFFFFFFFF, size
+
+
+class Manifest:
+    def __init__(self, folder, budget, store=None):
+        self.folder = folder
+        self.path = folder + "/" + NAME
+        self.budget = budget  # Bytes
+        self.store = store  # storage.Store to save through, if any
+        self.dates = []  # Oldest first
+        self.sizes = []
+        self.crcs = []
+        self.bytes = 0
+        self.removed = 0  # Segments removed since the last reset
+        self.rebuilt = False
+        self.load()
+
+    def file(self, date):
+        return self.folder + "/" + date + EXT
+
+    def _index(self, date):
+        # Position of date, or where it would go, in the sorted dates
+        lo, hi = 0, len(self.dates)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.dates[mid] < date:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def load(self):
+        try:
+            with open(self.path) as mfile:
+                saved = json.load(mfile)
+            if saved.get("version") != VERSION:
+                raise ValueError("version")
+            segments = saved["segments"]
+        except (OSError, ValueError, KeyError):
+            self.rebuild()
+            return
+        changed = False
+        for date, size, crc in segments:
+            try:
+                actual = os.stat(self.file(date))[6]
+            except OSError:
+                changed = True  # Removed some other way
+                continue
+            if actual != size:
+                crc, size = _crc(self.file(date))
+                changed = True
+            self._insert(date, size, crc)
+        if changed:
+            self.save()
+
+    def rebuild(self):
+        # Index the folder from a listing; only when there is no usable index
+        self.dates, self.sizes, self.crcs, self.bytes = [], [], [], 0
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(EXT) and name[:4].isdigit():
+                crc, size = _crc(self.folder + "/" + name)
+                self._insert(name[:-len(EXT)], size, crc)
+        self.rebuilt = True
+        self.save()
+
+    def _insert(self, date, size, crc):
+        i = self._index(date)
+        if i < len(self.dates) and self.dates[i] == date:
+            self.bytes += size - self.sizes[i]
+            self.sizes[i] = size
+            self.crcs[i] = crc
+        else:
+            self.dates.insert(i, date)
+            self.sizes.insert(i, size)
+            self.crcs.insert(i, crc)
+            self.bytes += size
+        return i
+
+    def wrote(self, path, text):
+        # Text has been appended to a file in the folder
+        date = path[path.rfind("/") + 1:-len(EXT)]
+        data = text.encode()
+        if self.dates and self.dates[-1] == date:
+            i = len(self.dates) - 1  # Nearly always today's
+        else:
+            i = self._index(date)
+            if i == len(self.dates) or self.dates[i] != date:
+                i = self._insert(date, 0, 0)
+        self.sizes[i] += len(data)
+        self.crcs[i] = crc32(data, self.crcs[i]) & 0xFFFFFFFF
+        self.bytes += len(data)
+        self.save()
+
+    def retain(self):
+        # Remove the oldest files until the folder is within its budget
+        while self.bytes > self.budget and len(self.dates) > 1:
+            path = self.file(self.dates[0])
+            try:
+                os.remove(path)
+            except OSError as e:
+                print("Error removing " + path + ":", e)
+            if self.store:
+                self.store.forget(path)
+            self.bytes -= self.sizes[0]
+            self.dates.pop(0)
+            self.sizes.pop(0)
+            self.crcs.pop(0)
+            self.removed += 1
+            self.save()
+
+    def find(self, date):
+        # (size, crc) of the segment for date, or None
+        i = self._index(date)
+        if i < len(self.dates) and self.dates[i] == date:
+            return self.sizes[i], self.crcs[i]
+        return None
+
+    def since(self, date=None):
+        # [(date, size, crc), ...] from date on, oldest first
+        i = self._index(date) if date else 0
+        return [(self.dates[j], self.sizes[j], self.crcs[j]) for j in range(i, len(self.dates))]
+
+    def save(self):
+        data = json.dumps({
+            "version": VERSION,
+            "segments": [[self.dates[i], self.sizes[i], self.crcs[i]] for i in range(len(self.dates))],
+        })
+        if self.store:
+            self.store.put(self.path, data)  # Written with the next flush
+            return
+        try:
+            with open(self.path + ".tmp", "w") as mfile:
+                mfile.write(data)
+            os.rename(self.path + ".tmp", self.path)
+        except OSError as e:
+            print("Error saving " + self.path + ":", e)
+
+    def report(self):
+        # "folder=segments/KB/removed", with "/r" if the index was rebuilt
+        return "%s=%d/%d/%d%s" % (
+            self.folder, len(self.dates), self.bytes // 1024, self.removed,
+            "/r" if self.rebuilt else "")
+
+    def reset(self):
+        self.removed = 0
+        self.rebuilt = False
+
+    def table(self):
+        lines = ["%s: %d files, %d of %d KB" % (
+            self.folder, len(self.dates), self.bytes // 1024, self.budget // 1024)]
+        for i in range(len(self.dates)):
+            lines.append("%s  %7d  %08x" % (self.dates[i], self.sizes[i], self.crcs[i]))
+        return "\n".join(lines)
@@ -0,0 +1,93 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Status LED (WS2812) driven by a PIO state machine. The neopixel module
+# times every bit on the CPU with interrupts off, which pulseLED() does
+# some five hundred times a pass; here write() only puts one word per
+# pixel in the state machine's FIFO and returns, and the PIO clocks the
+# bits out by itself. Strings longer than the FIFO are fed by DMA where
+# the firmware has rp2.DMA. Used like neopixel.NeoPixel, with the same
+# colour order, so the colours in main.py do not change.
+
+import rp2
+import time
+from array import array
+from machine import Pin
+
+FIFO_WORDS = 8  # TX FIFO joined with the unused RX FIFO
+PIO0_TXF0 = 0x50200010  # TX FIFO register of PIO0 state machine 0
+BIT_US = 1.25  # 800 kHz
+LATCH_US = 80  # Low time that ends a frame
+
+
+@rp2.asm_pio(
+    sideset_init=rp2.PIO.OUT_LOW,
+    out_shiftdir=rp2.PIO.SHIFT_LEFT,
+    autopull=True,
+    pull_thresh=24,
+    fifo_join=rp2.PIO.JOIN_TX,
+)
+def ws2812():
+    # 10 cycles per bit at 8 MHz: 800 kHz
+    wrap_target()
+    label("bitloop")
+    out(x, 1).side(0)[2]
+    jmp(not_x, "do_zero").side(1)[1]
+    jmp("bitloop").side(1)[4]
+    label("do_zero")
+    nop().side(0)[4]
+    wrap()
+
+
+class PioLED:
+    def __init__(self, pin, n=1, sm_id=0):
+        self.n = n
+        self.pixels = [(0, 0, 0)] * n
+        self.words = array("I", [0] * n)  # GRB in the top 24 bits, as the PIO shifts them out
+        self.sm = rp2.StateMachine(sm_id, ws2812, freq=8000000, sideset_base=Pin(pin))
+        self.sm.active(1)
+        self.dma = None
+        if n > FIFO_WORDS and hasattr(rp2, "DMA") and sm_id < 4:
+            self.dma = rp2.DMA()
+            self.dreq = sm_id  # DREQ_PIO0_TX0 + state machine
+            self.fifo = PIO0_TXF0 + 4 * sm_id
+        self.frame_us = int(24 * BIT_US * n) + LATCH_US
+        self.last_us = time.ticks_add(time.ticks_us(), -self.frame_us)
+        self.writes = 0
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, idx, value):
+        self.pixels[idx] = value
+
+    def __getitem__(self, idx):
+        return self.pixels[idx]
+
+    def fill(self, value):
+        for idx in range(self.n):
+            self.pixels[idx] = value
+
+    def write(self):
+        # Sent in the same byte order as neopixel.NeoPixel: second, first, third
+        for idx in range(self.n):
+            pix = self.pixels[idx]
+            self.words[idx] = (int(pix[1]) << 24) | (int(pix[0]) << 16) | (int(pix[2]) << 8)
+        # Let the previous frame go out and latch before starting the next
+        wait = self.frame_us - time.ticks_diff(time.ticks_us(), self.last_us)
+        if wait > 0:
+            time.sleep_us(wait)
+        if self.dma is not None:
+            while self.dma.active():
+                pass
+            ctrl = self.dma.pack_ctrl(size=2, inc_write=False, treq_sel=self.dreq)
+            self.dma.config(read=self.words, write=self.fifo, count=self.n, ctrl=ctrl, trigger=True)
+        else:
+            self.sm.put(self.words)  # The same words as the DMA sends
+        self.last_us = time.ticks_us()
+        self.writes += 1
+
+    def deinit(self):
+        self.sm.active(0)
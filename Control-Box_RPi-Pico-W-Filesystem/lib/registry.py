@@ -0,0 +1,196 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Extra light/fan channel groups and sensors, so one control box can run a
+# multi-shelf rack. The box's own channels on GPIO 0-4 and its own sensors
+# stay as they are; everything listed in the "devices" section of
+# /config/device_settings.json is added on top, for example:
+#
+# {"devices": {
+#   "chambers": [{"name": "shelf2", "pins": [7, 8, 9, 10, 11], "tach": 12,
+#                 "lights": {...}, "fan": {...}}],
+#   "sensors": [{"name": "soil2", "type": "soil", "bus": 1, "address": 55},
+#               {"name": "air2", "type": "aht10", "bus": 1, "address": 57},
+#               {"name": "power2", "type": "ina219", "bus": 0, "address": 65}]}}
+#
+# "pins" are the red, green, blue, white and fan PWM outputs. A chamber
+# without its own "lights" or "fan" settings follows gbe_settings.json.
+# Sensors are added to the bus manager (busmanager.py), so one that is
+# missing or drops off the bus reads as zeros and is looked for again later.
+# With a sampler (sampling.py) they are read at their own rate like the
+# box's own sensors, and report the sampler's latest values, with None for
+# a reading that is missing or was filtered out.
+# Each instance adds columns named "<name>.<key>" using the same keys as
+# the box's own readings (red, gre, blu, whi, fan, rpm, ssm, sst, tem, hum,
+# vol, mam, wat).
+
+from machine import Pin, PWM
+
+MAX_DUTY = (200, 89, 94, 146)  # Red, green, blue, white
+MAX_FAN = 255
+
+
+def toSeconds(input_time):
+    # Convert HH:MM to seconds since midnight
+    inH, inM = map(int, input_time.split(":"))
+    return (inH * 60 + inM) * 60
+
+
+class Chamber:
+    keys = ("red", "gre", "blu", "whi", "fan", "rpm")
+
+    def __init__(self, name, pins, tach=None, lights=None, fan=None):
+        self.name = name
+        self.channels = []
+        for pin in pins:
+            pwm = PWM(Pin(pin))
+            pwm.freq(20000)
+            pwm.duty_u16(0)
+            self.channels.append(pwm)
+        self.lights = lights
+        self.fan = fan
+        self.count = 0
+        self.tach = None
+        if tach is not None:
+            self.tach = Pin(tach, Pin.IN, Pin.PULL_UP)
+            self.tach.irq(trigger=Pin.IRQ_FALLING, handler=self._pulse)
+
+    def _pulse(self, pin):  # Triggered twice per fan rotation
+        self.count += 1
+
+    def control(self, seconds, config):
+        lights = self.lights or config["lights"]
+        fan = self.fan or config["fan"]
+        if toSeconds(lights["timer"]["on"]) <= seconds < toSeconds(lights["timer"]["off"]):
+            duty = lights["duty"]
+            levels = (duty["red"], duty["green"], duty["blue"], duty["white"])
+            for pwm, level, top in zip(self.channels, levels, MAX_DUTY):
+                pwm.duty_u16(int(min(top, level)) * 256)
+            fan_level = fan["duty"]["when lights on"]
+        else:
+            for pwm in self.channels[:4]:
+                pwm.duty_u16(0)
+            fan_level = fan["duty"]["when lights off"]
+        self.channels[4].duty_u16(int(min(MAX_FAN, fan_level)) * 256)
+
+    def read(self, elapsed_ms):
+        values = [round(pwm.duty_u16() / 256) for pwm in self.channels]
+        rpm = self.count / elapsed_ms * 30000 if self.tach and elapsed_ms > 0 else 0
+        self.count = 0
+        return values + [rpm]
+
+
+def _read_soil(soil):
+    return [soil.get_moisture(), round(soil.get_temp(), 2)]
+
+
+def _read_aht10(aht):
+    tem, hum = aht.measure()
+    return [round(tem, 2), round(hum, 2)]
+
+
+def _read_ina219(ina):
+    return [round(ina.voltage(), 2), round(ina.current()), round(ina.power() / 1000, 2)]
+
+
+# type -> (bus manager driver, keys, read function, default address)
+SENSOR_TYPES = {
+    "soil": ("soil", ("ssm", "sst"), _read_soil, 0x36),
+    "aht10": ("aht10", ("tem", "hum"), _read_aht10, 0x38),
+    "ina219": ("ina219", ("vol", "mam", "wat"), _read_ina219, 0x40),
+}
+
+
+class Sensor:
+    # A sensor looked after by the bus manager, read as zeros while missing
+    def __init__(self, name, kind, manager):
+        self.name = name
+        self.manager = manager
+        self.keys = SENSOR_TYPES[kind][1]
+        self.func = SENSOR_TYPES[kind][2]
+        self.default = [0] * len(self.keys)
+        self.sampler = None
+
+    def read(self, elapsed_ms):
+        if self.sampler:
+            return self.sampler.latest(self.name)
+        return self.manager.read(self.name, self.func, self.default)
+
+
+class Registry:
+    def __init__(self, devices, buses, manager):
+        self.instances = []
+        for entry in devices.get("chambers", []):
+            try:
+                self.instances.append(
+                    Chamber(
+                        entry["name"],
+                        entry["pins"],
+                        entry.get("tach"),
+                        entry.get("lights"),
+                        entry.get("fan"),
+                    )
+                )
+                print("Set up chamber " + entry["name"])
+            except Exception as e:
+                print("Unable to set up chamber", entry.get("name"), e)
+        for entry in devices.get("sensors", []):
+            try:
+                driver = SENSOR_TYPES[entry["type"]]
+                bus = buses[entry.get("bus", 1)]
+                name = entry["name"]
+                if manager.add(name, bus, entry.get("address", driver[3]), driver[0]):
+                    print("Connected to " + entry["type"] + " sensor " + name)
+                else:
+                    print("Sensor " + name + " not found, will keep looking")
+                self.instances.append(Sensor(name, entry["type"], manager))
+            except Exception as e:
+                print("Unable to set up sensor", entry.get("name"), e)
+
+    def columns(self):
+        # Keys the registry adds to the status, in log order
+        out = []
+        for device in self.instances:
+            for key in device.keys:
+                out.append(device.name + "." + key)
+        return out
+
+    def control(self, seconds, config):
+        for device in self.instances:
+            if isinstance(device, Chamber):
+                device.control(seconds, config)
+
+    def groups(self):
+        # (outputs, lights, fan) of each chamber, for the core 1 control loop
+        return [
+            (device.channels, device.lights, device.fan)
+            for device in self.instances
+            if isinstance(device, Chamber)
+        ]
+
+    def sampled(self, sampler):
+        # Read the sensors through sampler from now on (None to read directly)
+        for device in self.instances:
+            if isinstance(device, Sensor):
+                if sampler:
+                    sampler.add(device.name, device.func,
+                                [device.name + "." + key for key in device.keys])
+                device.sampler = sampler
+
+    def sample(self, status, elapsed_ms):
+        # Add every instance's readings to the status dict
+        for device in self.instances:
+            for key, value in zip(device.keys, device.read(elapsed_ms)):
+                status[device.name + "." + key] = value
+
+    def summary(self, status):
+        # Short text for the console, one group per instance
+        out = ""
+        for device in self.instances:
+            values = [status[device.name + "." + key] for key in device.keys]
+            out += "  " + device.name + " " + " ".join(
+                ["-" if v is None else "%g" % round(v, 2) for v in values]
+            )
+        return out
@@ -0,0 +1,245 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Reads each sensor at its own rate instead of on every pass of the main
+# loop. The LED current changes in milliseconds, air temperature over
+# minutes and soil moisture over hours, so each sensor has a period and an
+# oversampling count, set by its bus manager name in the "sampling" section
+# of /config/device_settings.json, for example:
+#
+# {"sampling": {"ina": {"period s": 0, "oversample": 8},
+#               "seesaw": {"period s": 60, "oversample": 4},
+#               "aht10": {"period s": 10}}}
+#
+# A period of 0 reads on every pass. An oversampled sensor is read on that
+# many passes in a row and the average published, one read per pass, so no
+# pass carries more bus traffic than before. The INA219 averages that many
+# conversions in its own ADC instead, which costs no bus time at all. The
+# AHT10 needs 75 ms per conversion, so a conversion is started in one pass
+# and collected in the next rather than slept through.
+#
+# Due reads are made bus by bus, collecting and starting conversions before
+# the other reads, so each bus is visited once per pass. latest() is what
+# a sensor last read as, and taken() the ticks_ms of that reading. Reads go
+# through the bus manager; a sensor that is missing reads as None, the
+# missing-value marker. With filters (filters.py) each new value goes
+# through its key's filter chain before it is published.
+
+import time
+
+# Bus manager driver kind -> period (s) and oversampling when not configured
+DEFAULTS = {"ina219": (0, 8), "soil": (60, 4), "aht10": (10, 1)}
+CONVERT_MS = {"aht10": 75}  # Kinds that are started and collected later
+STALE_MS = 1000  # A conversion not ready by then is started again
+FAILED = object()
+
+
+def _start(device):
+    device.start()
+    return True
+
+
+def _collect(device):
+    return device.collect()  # None while the conversion is running
+
+
+def ina_adc(samples):
+    # INA219 ADC setting that averages at least samples conversions (up to 128)
+    if samples <= 1:
+        return 3  # ADC_12BIT
+    setting = 9  # ADC_2SAMP
+    while setting < 15 and 1 << (setting - 8) < samples:
+        setting += 1
+    return setting
+
+
+class Channel:
+    def __init__(self, name, kind, func, size, period_ms, oversample, chains=None):
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.chains = chains  # A Filter per value, or None
+        self.period_ms = period_ms
+        self.oversample = oversample
+        self.batch = 1 if kind == "ina219" else oversample  # Readings per published value
+        self.convert = CONVERT_MS.get(kind)
+        self.device = None  # Device the INA219 averaging was set on
+        self.next_ms = time.ticks_ms()
+        self.sums = None
+        self.count = 0
+        self.started = None  # ticks_ms the running conversion started
+        self.values = [None] * size  # Published in place
+        self.at = None
+        self.reads = 0
+        self.fails = 0
+
+
+class Sampler:
+    def __init__(self, manager, config=None, filters=None):
+        self.manager = manager
+        self.config = config or {}
+        self.filters = filters
+        self.channels = {}
+        self.order = []
+        self.buses = []  # [bus, [channels]] in the order buses were first seen
+
+    def add(self, name, func, keys):
+        # Sample a bus manager device through func(device), which gives the
+        # values of keys (the status keys, for the filter settings)
+        slot = self.manager.slots.get(name)
+        if slot is None:
+            return
+        period, oversample = DEFAULTS.get(slot.kind, (0, 1))
+        entry = self.config.get(name, {})
+        chains = None
+        if self.filters:
+            chains = [self.filters.chain(key) for key in keys]
+        channel = Channel(
+            name, slot.kind, func, len(keys),
+            int(entry.get("period s", period) * 1000),
+            max(1, int(entry.get("oversample", oversample))),
+            chains,
+        )
+        self.channels[name] = channel
+        self.order.append(name)
+        for group in self.buses:
+            if group[0] is slot.bus:
+                group[1].append(channel)
+                break
+        else:
+            self.buses.append([slot.bus, [channel]])
+
+    def latest(self, name):
+        channel = self.channels.get(name)
+        return channel.values if channel else None
+
+    def taken(self, name):
+        channel = self.channels.get(name)
+        return channel.at if channel else None
+
+    def _setup(self, channel):
+        # Set the INA219's own averaging on each device object it gets
+        device = self.manager.get(channel.name)
+        if channel.kind != "ina219" or device is None or device is channel.device:
+            return
+        adc = ina_adc(channel.oversample)
+        if self.manager.read(
+            channel.name, lambda ina: ina.configure(bus_adc=adc, shunt_adc=adc) or True, FAILED
+        ) is not FAILED:
+            channel.device = device
+
+    def _due(self, channel, now):
+        return channel.count > 0 or time.ticks_diff(now, channel.next_ms) >= 0
+
+    def _publish(self, channel, values, now):
+        # values (None when missing) through the filters into channel.values
+        out = channel.values
+        for i in range(len(out)):
+            value = None if values is None else values[i]
+            if channel.chains:
+                value = channel.chains[i].add(value)
+            out[i] = value
+        if values is not None:
+            channel.at = now
+
+    def _add(self, channel, values, now):
+        if values is FAILED:
+            channel.fails += 1
+            channel.sums = None
+            channel.count = 0
+            if self.manager.get(channel.name) is None:
+                self._publish(channel, None, now)  # Missing until it is found again
+                channel.next_ms = time.ticks_add(now, channel.period_ms)
+            return  # Otherwise read again next pass
+        channel.reads += 1
+        if channel.count == 0:
+            channel.next_ms = time.ticks_add(now, channel.period_ms)
+        if channel.batch == 1:
+            self._publish(channel, values, now)
+            return
+        if channel.sums is None:
+            channel.sums = list(values)
+        else:
+            for i in range(len(values)):
+                channel.sums[i] += values[i]
+        channel.count += 1
+        if channel.count >= channel.batch:
+            for i in range(len(channel.sums)):
+                channel.sums[i] = round(channel.sums[i] / channel.count, 2)
+            self._publish(channel, channel.sums, now)
+            channel.sums = None
+            channel.count = 0
+
+    def service(self):
+        # Once per pass: the reads that are due, bus by bus
+        for bus, channels in self.buses:
+            for channel in channels:
+                if channel.started is None:
+                    continue
+                now = time.ticks_ms()
+                waited = time.ticks_diff(now, channel.started)
+                if waited < channel.convert:
+                    continue
+                values = self.manager.read(channel.name, _collect, FAILED)
+                if values is None:
+                    if waited < STALE_MS:
+                        continue  # Still converting; next pass
+                    channel.fails += 1  # Start it again
+                elif values is FAILED:
+                    self._add(channel, FAILED, now)
+                else:
+                    self._add(channel, [round(value, 2) for value in values], now)
+                channel.started = None
+            now = time.ticks_ms()
+            for channel in channels:
+                if channel.convert and channel.started is None and self._due(channel, now):
+                    if self.manager.read(channel.name, _start, FAILED) is FAILED:
+                        self._add(channel, FAILED, now)
+                    else:
+                        channel.started = now
+            for channel in channels:
+                if not channel.convert and self._due(channel, now):
+                    self._setup(channel)
+                    self._add(channel, self.manager.read(channel.name, channel.func, FAILED), now)
+
+    def prime(self):
+        # Read everything once, waiting for conversions, so the first pass has values
+        now = time.ticks_ms()
+        for name in self.order:
+            channel = self.channels[name]
+            self._setup(channel)
+            values = self.manager.read(name, channel.func, FAILED)
+            if values is FAILED:
+                self._publish(channel, None, now)
+            else:
+                self._publish(channel, values, now)
+                channel.next_ms = time.ticks_add(now, channel.period_ms)
+
+    def report(self):
+        # "sampling name=reads/fails ..."
+        out = "sampling"
+        for name in self.order:
+            channel = self.channels[name]
+            out += " %s=%d/%d" % (name, channel.reads, channel.fails)
+        return out
+
+    def reset(self):
+        for channel in self.channels.values():
+            channel.reads = 0
+            channel.fails = 0
+
+    def table(self):
+        lines = ["sensor     period s  oversample  reads fails  age s  values"]
+        now = time.ticks_ms()
+        for name in self.order:
+            channel = self.channels[name]
+            age = "-" if channel.at is None else "%.1f" % (time.ticks_diff(now, channel.at) / 1000)
+            lines.append(
+                "%-10s %8g  %10d  %5d %5d  %5s  %s"
+                % (name, channel.period_ms / 1000, channel.oversample, channel.reads,
+                   channel.fails, age,
+                   " ".join(["-" if v is None else "%g" % v for v in channel.values]))
+            )
+        return "\n".join(lines)
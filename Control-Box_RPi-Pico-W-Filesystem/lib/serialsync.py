@@ -0,0 +1,172 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Copies the daily log and diag files to a computer over the USB console
+# while the program keeps running, so they no longer have to be pulled
+# with an IDE after stopping it.
+#
+# Requests and replies are as in frames.py:
+#
+#   \x01<seq> I <crc>                             board and folders
+#   \x01<seq> L <folder> [<date>] <crc>           files from date on
+#   \x01<seq> S <folder> <date> <offset> <prefix crc> <crc>
+#                                                 everything from offset in
+#                                                 date's file on
+#   \x01<seq> C <crc>                             stop sending
+#
+# I: "board\tsoftware date\tfolder,folder"
+# L: per file <date 10 bytes> <size u32> <crc u32>, from the manifest
+# D: <date> <offset u32> <bytes>, a piece of a file
+# E: <date> <size u32> <crc u32>, a file is complete
+# Z: <files u16> <bytes u32>, all sent
+# X: an error message
+#
+# For S the host sends what it has of the date's file: its length and CRC.
+# If that does not match the start of the box's file the file is sent
+# again from 0, so a cut transfer resumes where it stopped and only new
+# data is sent. Later files follow in full. Pending writes are flushed
+# first. service() sends up to "frames per pass" D frames on each pass of
+# the main loop, so the loop keeps running while a transfer goes on.
+# Settings are in the "sync" section of /config/device_settings.json:
+#
+# {"sync": {"enabled": true, "frames per pass": 32, "frame bytes": 512}}
+
+import struct
+import sys
+from binascii import crc32
+
+import frames
+
+REQUESTS = "ILSC"
+SEGMENT = "<10sII"  # Date, size, CRC
+FRAMES = 32
+FRAME_BYTES = 512
+
+
+def _crc(path, length, buf):
+    # CRC32 of the first length bytes of a file
+    crc = 0
+    with open(path, "rb") as file:
+        while length > 0:
+            n = file.readinto(buf)
+            if not n:
+                break
+            n = min(n, length)
+            crc = crc32(memoryview(buf)[:n], crc)
+            length -= n
+    return crc & 0xFFFFFFFF
+
+
+class Sync:
+    def __init__(self, board_id, software, indexes, store=None, config=None, out=None):
+        config = config or {}
+        self.board_id = board_id
+        self.software = software
+        self.indexes = indexes  # Folder -> manifest.Manifest
+        self.store = store
+        self.frames = config.get("frames per pass", FRAMES)
+        self.buf = bytearray(config.get("frame bytes", FRAME_BYTES))
+        self.out = out or getattr(sys.stdout, "buffer", sys.stdout)
+        self.seq = 0
+        self.files = []  # (folder, date, size, crc) still to send, the first being sent
+        self.offset = 0
+        self.sent_files = 0
+        self.sent_bytes = 0
+        # Since the last reset
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def _send(self, kind, payload):
+        frames.send(self.out, kind, self.seq, payload)
+
+    def _error(self, message):
+        self.errors += 1
+        self._send(ord("X"), message.encode())
+
+    def request(self, seq, kind, args):
+        # A checked request from the console (frames.parse)
+        self.requests += 1
+        self.seq = seq
+        try:
+            if kind == "I":
+                self._send(ord("I"), (self.board_id + "\t" + self.software + "\t"
+                                       + ",".join(self.indexes)).encode())
+            elif kind == "L":
+                self._list(args)
+            elif kind == "S":
+                self._start(args[0], args[1], int(args[2]), int(args[3], 16))
+            elif kind == "C":
+                self.files = []
+            else:
+                self._error("unknown request " + kind)
+        except (IndexError, ValueError, KeyError, OSError) as e:
+            self._error("bad request: " + str(e))
+
+    def _list(self, args):
+        index = self.indexes[args[0]]
+        parts = []
+        for date, size, crc in index.since(args[1] if len(args) > 1 else None):
+            parts.append(struct.pack(SEGMENT, date.encode(), size, crc))
+        self._send(ord("L"), b"".join(parts))
+
+    def _start(self, folder, date, offset, prefix):
+        index = self.indexes[folder]
+        if self.store:
+            self.store.flush()  # So the files are as the manifest says
+        self.files = [(folder,) + segment for segment in index.since(date)]
+        self.offset = 0
+        self.sent_files = 0
+        self.sent_bytes = 0
+        if self.files and self.files[0][1] == date and 0 < offset <= self.files[0][2]:
+            if _crc(index.file(date), offset, self.buf) == prefix:
+                self.offset = offset  # The host has this much already
+        if not self.files:
+            self._send(ord("Z"), struct.pack("<HI", 0, 0))
+
+    def service(self):
+        # Once a pass: the next frames of a transfer
+        frames = 0
+        while self.files and frames < self.frames:
+            folder, date, size, crc = self.files[0]
+            if self.offset < size:
+                try:
+                    with open(self.indexes[folder].file(date), "rb") as file:
+                        file.seek(self.offset)
+                        while self.offset < size and frames < self.frames:
+                            n = file.readinto(self.buf)
+                            n = min(n or 0, size - self.offset)
+                            if not n:
+                                size = self.offset  # Shorter than the manifest says
+                                break
+                            self._send(ord("D"), struct.pack("<10sI", date.encode(), self.offset)
+                                       + self.buf[:n])
+                            self.offset += n
+                            self.sent_bytes += n
+                            self.bytes += n
+                            frames += 1
+                except OSError as e:
+                    self.files = []
+                    self._error("cannot read %s/%s: %s" % (folder, date, e))
+                    return
+                if self.offset < size:
+                    return  # More on the next pass
+            if size != self.files[0][2]:
+                crc = _crc(self.indexes[folder].file(date), size, self.buf)
+            self._send(ord("E"), struct.pack(SEGMENT, date.encode(), size, crc))
+            self.files.pop(0)
+            self.offset = 0
+            self.sent_files += 1
+            if not self.files:
+                self._send(ord("Z"), struct.pack("<HI", self.sent_files, self.sent_bytes))
+
+    def report(self):
+        # Requests, errors and KB sent since the last reset
+        return "sync=%d/%d/%d" % (self.requests, self.errors, self.bytes // 1024)
+
+    def reset(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
@@ -0,0 +1,249 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# File writes gathered in RAM and made together, with a count of the flash
+# wear each file causes.
+#
+# On littlefs every file opened for writing commits its metadata when it is
+# closed, and appending to a file copies its partly filled last block to a
+# freshly erased one. append() keeps the text for a file in RAM instead of
+# opening it there and then, and flush() writes each file's pending text
+# with one open. Pending text is flushed from service(), once a pass, when
+# there are "flush bytes" of it or the oldest is "flush s" old, and before
+# anything that could lose it: the program ending and a file being read
+# back or replaced. A new file gets its header line with the first text.
+# put() keeps the newest contents of a whole file, such as a set of saved
+# totals, to write with the next flush, so a file saved every few minutes
+# is only written once per flush. replace() writes a whole file at once.
+# Whole files go through a temporary file renamed over the old one, unless
+# the caller keeps its own copies. watch() has a function told of the text
+# appended to files in a folder once it is on flash, as the log manifest
+# (manifest.py) needs.
+#
+# Each write is counted against its file: bytes, writes (opens) and an
+# estimate of the blocks erased, one for each block an append reaches into
+# (the first being the copy of the last block) and one for each block of a
+# replaced file. The hour's figures go into the diagnostics; the totals, by
+# file with the dates left out of the names of log and diag files, are kept
+# in /wear.json, saved with the hourly records. Settings are in the
+# "storage" section of /config/device_settings.json:
+#
+# {"storage": {"flush bytes": 2048, "flush s": 900}}
+#
+# "flush s": 0 writes appended text straight away.
+
+import json
+import os
+import time
+
+FLUSH_BYTES = 2048
+FLUSH_S = 900
+MAX_PENDING = 8192  # Pending text kept for a file that cannot be written
+BLOCK = 4096
+SIZES = 8  # File sizes remembered; the rest are looked up again
+PATH = "/wear.json"
+
+
+def _key(path):
+    # Name the totals are kept under: logs/2024-05-01.txt counts as logs/*.txt
+    path = path.lstrip("/")
+    slash = path.rfind("/")
+    if slash >= 0 and path[slash + 1:slash + 2].isdigit():
+        return path[:slash + 1] + "*" + path[path.rfind("."):]
+    return path
+
+
+class Store:
+    def __init__(self, config=None, path=PATH):
+        config = config or {}
+        self.path = path
+        self.flush_bytes = config.get("flush bytes", FLUSH_BYTES)
+        self.flush_ms = int(config.get("flush s", FLUSH_S) * 1000)
+        self.pending = {}  # Path -> list of text waiting to be appended
+        self.whole = {}  # Path -> contents waiting to replace the file
+        self.pending_bytes = 0
+        self.first_ms = None  # ticks_ms of the oldest pending text
+        self.sizes = {}  # Path -> size on flash, -1 if there is no file
+        self.watchers = []  # (path prefix, func(path, text))
+        self.totals = {}  # Key -> [bytes, writes, erases] since "since"
+        self.since = None
+        # The hour's figures
+        self.writes = 0
+        self.bytes = 0
+        self.erases = 0
+        self.max_ms = 0
+        self.fails = 0
+        self.load()
+
+    def _size(self, path):
+        if path not in self.sizes:
+            if len(self.sizes) >= SIZES:
+                self.sizes.clear()
+            try:
+                self.sizes[path] = os.stat(path)[6]
+            except OSError:
+                self.sizes[path] = -1
+        return self.sizes[path]
+
+    def _count(self, path, nbytes, erases, ms):
+        key = _key(path)
+        if key not in self.totals:
+            self.totals[key] = [0, 0, 0]
+        entry = self.totals[key]
+        entry[0] += nbytes
+        entry[1] += 1
+        entry[2] += erases
+        self.writes += 1
+        self.bytes += nbytes
+        self.erases += erases
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def watch(self, prefix, func):
+        # Call func(path, text) after text is appended to a file under prefix
+        self.watchers.append((prefix, func))
+
+    def append(self, path, text, head=None):
+        # Add text to the end of a file, starting a new file with head
+        if path not in self.pending:
+            if head and self._size(path) <= 0:
+                text = head + text
+            self.pending[path] = []
+        self.pending[path].append(text)
+        self.pending_bytes += len(text)
+        if self.first_ms is None:
+            self.first_ms = time.ticks_ms()
+        if not self.flush_ms:
+            self.flush(path)
+
+    def service(self, now_ms):
+        # Once a pass: write everything pending if there is enough or it is old enough
+        if self.first_ms is None:
+            return
+        if (self.pending_bytes >= self.flush_bytes
+                or time.ticks_diff(now_ms, self.first_ms) >= self.flush_ms):
+            self.flush()
+
+    def put(self, path, data):
+        # Replace a file with data at the next flush
+        old = self.whole.get(path)
+        self.pending_bytes += len(data) - (len(old) if old else 0)
+        self.whole[path] = data
+        if self.first_ms is None:
+            self.first_ms = time.ticks_ms()
+        if not self.flush_ms:
+            self.flush(path)
+
+    def flush(self, path=None):
+        # Write what is pending for one file, or for all of them
+        for name in [path] if path else list(self.pending):
+            parts = self.pending.get(name)
+            if not parts:
+                continue
+            data = "".join(parts)
+            start = time.ticks_ms()
+            try:
+                with open(name, "a") as file:
+                    file.write(data)
+            except OSError as e:
+                self.fails += 1
+                print("Error writing " + name + ":", e)
+                if len(data) > MAX_PENDING:
+                    self.pending_bytes -= len(data)
+                    del self.pending[name]  # Give up rather than run out of memory
+                else:
+                    self.pending[name] = [data]
+                continue
+            size = max(0, self._size(name))
+            self.sizes[name] = size + len(data)
+            self._count(name, len(data), (size % BLOCK + len(data) + BLOCK - 1) // BLOCK,
+                        time.ticks_diff(time.ticks_ms(), start))
+            self.pending_bytes -= len(data)
+            del self.pending[name]
+            for prefix, func in self.watchers:
+                if name.startswith(prefix):
+                    func(name, data)
+        # Whole files last, so what the watchers saved goes in the same flush
+        for name in [path] if path else list(self.whole):
+            data = self.whole.pop(name, None)
+            if data is None:
+                continue
+            self.pending_bytes -= len(data)
+            try:
+                self.replace(name, data)
+            except OSError as e:
+                self.fails += 1
+                print("Error writing " + name + ":", e)
+        if not self.pending and not self.whole:
+            self.pending_bytes = 0
+            self.first_ms = None
+
+    def replace(self, path, data, atomic=True):
+        # Write a whole file now; raises OSError if it could not be written
+        self.forget(path)
+        start = time.ticks_ms()
+        target = path + ".tmp" if atomic else path
+        with open(target, "wb" if isinstance(data, bytes) else "w") as file:
+            file.write(data)
+        if atomic:
+            os.rename(target, path)
+        self.wrote(path, len(data), time.ticks_diff(time.ticks_ms(), start))
+
+    def wrote(self, path, nbytes, ms=0):
+        # Count a whole file of nbytes written some other way
+        self.sizes[path] = nbytes
+        self._count(path, nbytes, (nbytes + BLOCK - 1) // BLOCK, ms)
+
+    def forget(self, path):
+        # Drop what is pending for a file that has been removed or replaced
+        self.sizes.pop(path, None)
+        if path in self.pending:
+            self.pending_bytes -= sum([len(part) for part in self.pending.pop(path)])
+        if path in self.whole:
+            self.pending_bytes -= len(self.whole.pop(path))
+
+    def save(self):
+        # Totals to /wear.json with the next flush, counted like any other file
+        if self.since is None:
+            self.since = time.time()
+        self.put(self.path, json.dumps({"since": self.since, "files": self.totals}))
+
+    def load(self):
+        try:
+            with open(self.path) as wfile:
+                saved = json.load(wfile)
+        except (OSError, ValueError):
+            return False
+        self.since = saved.get("since")
+        self.totals = saved.get("files", {})
+        return True
+
+    def report(self):
+        # Writes, bytes and blocks erased this hour, slowest write in ms,
+        # failed writes and bytes still pending
+        return "storage=%d/%d/%d/%d/%d/%d" % (
+            self.writes, self.bytes, self.erases, self.max_ms, self.fails, self.pending_bytes)
+
+    def reset(self):
+        self.writes = 0
+        self.bytes = 0
+        self.erases = 0
+        self.max_ms = 0
+        self.fails = 0
+
+    def table(self):
+        lines = [
+            "this hour %d writes, %d bytes, %d erases, slowest %d ms, %d failed" % (
+                self.writes, self.bytes, self.erases, self.max_ms, self.fails),
+            "%d bytes pending in %d files" % (
+                self.pending_bytes, len(self.pending) + len(self.whole)),
+            "file                       bytes  writes  erases",
+        ]
+        for key in sorted(self.totals):
+            entry = self.totals[key]
+            lines.append("%-22s %9d %7d %7d" % (key, entry[0], entry[1], entry[2]))
+        if self.since:
+            lines.append("since %d-%02d-%02d" % time.localtime(self.since)[:3])
+        return "\n".join(lines)
@@ -0,0 +1,160 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Samples sent to a computer over the USB console as binary frames
+# (frames.py), instead of or as well as the status line printed each pass.
+#
+# In "text" mode the status line is printed as before; in "binary" mode it
+# is not, so a box with nothing attached writes nothing to the console on
+# each pass. Either way, frames are only sent to a computer that has asked
+# for them within the last "hold s" seconds:
+#
+#   \x01<seq> T [<rate hz>] <crc>       send samples, or stop with rate 0
+#
+# which is answered with a T frame, "board\tsoftware\tversion\trate hz",
+# the rate being the nearest the energy meter's timer can give (0 without
+# the meter); "rate hz" is used when the computer does not give one. The
+# computer asks again every few seconds to keep the samples coming. On
+# each pass the box then sends, in one write:
+#
+# S: the pass's reading, SAMPLE: ticks_ms u32, year u16, month, day, hour,
+#    minute, second, red, green, blue, white and fan duties (bytes), then
+#    fan RPM, volts x100, mA, watts x100, air temperature x100, humidity
+#    x100, soil moisture and soil temperature x100 as i16, MISSING for a
+#    reading the box does not have
+# P: the power readings the energy meter's timer took during the pass at
+#    the rate asked for (energy.py): ticks_ms u32 and mW per count f32,
+#    then ticks_ms & 0xFFFF and the power register count, u16 each
+#
+# Only the box's own sensors are sent, not extra chambers. Settings are in
+# the "console" section of /config/device_settings.json; "mode" can also
+# be changed with the "mode" console command:
+#
+# {"console": {"mode": "text", "rate hz": 10, "hold s": 10}}
+
+import struct
+import sys
+import time
+
+import frames
+
+VERSION = 1
+MODES = ("text", "binary")
+RATE_HZ = 10
+HOLD_S = 10
+SAMPLE = "<IHBBBBBBBBBBhhhhhhhh"
+SAMPLE_SIZE = 32
+MISSING = -32768
+SCALED = (("rpm", 1), ("vol", 100), ("mam", 1), ("wat", 100),
+          ("tem", 100), ("hum", 100), ("ssm", 1), ("sst", 100))
+POWER = "<If"  # ticks_ms, mW per count, then the readings
+POWER_SIZE = 8
+TRACE = 128  # Readings a P frame can hold, as energy.TRACE
+FRAME_EXTRA = frames.HEAD_SIZE + frames.CRC_SIZE
+
+
+def _i16(value, scale):
+    if value is None:
+        return MISSING
+    value = round(value * scale)
+    return -32767 if value < -32767 else 32767 if value > 32767 else value
+
+
+class Stream:
+    def __init__(self, board_id, software, config=None, meter=None, out=None):
+        config = config or {}
+        self.board_id = board_id
+        self.software = software
+        self.meter = meter  # energy.Meter for the power readings, if any
+        self.text = config.get("mode", "text") != "binary"
+        self.rate = config.get("rate hz", RATE_HZ)
+        self.hold_ms = int(config.get("hold s", HOLD_S) * 1000)
+        self.out = out or getattr(sys.stdout, "buffer", sys.stdout)
+        self.until = None  # ticks_ms the computer's request runs out at
+        self.seq = 0
+        self.hz = 0
+        self.buf = bytearray(2 * FRAME_EXTRA + SAMPLE_SIZE + POWER_SIZE + 4 * TRACE)
+        # Since the last reset
+        self.requests = 0
+        self.frames = 0
+        self.bytes = 0
+
+    def select(self, mode=None):
+        # Console command: show or change the mode
+        if mode is not None:
+            if mode not in MODES:
+                print("Modes are " + ", ".join(MODES))
+                return
+            self.text = mode == "text"
+        state = "%g Hz to a computer" % self.hz if self.attached() else "no computer attached"
+        print("Console mode: %s (%s)" % ("text" if self.text else "binary", state))
+
+    def request(self, seq, letter, words):
+        # A checked T request from the console (frames.parse)
+        self.requests += 1
+        try:
+            hz = float(words[0]) if words else self.rate
+        except ValueError:
+            frames.send(self.out, ord("X"), seq, b"bad rate")
+            return
+        self.seq = seq
+        if hz <= 0:
+            self._stop()
+        else:
+            self.until = time.ticks_add(time.ticks_ms(), self.hold_ms)
+            self.hz = self.meter.trace_rate(hz) if self.meter else 0
+        frames.send(self.out, ord("T"), seq, ("%s\t%s\t%d\t%g" % (
+            self.board_id, self.software, VERSION, self.hz)).encode())
+
+    def _stop(self):
+        self.until = None
+        self.hz = 0
+        if self.meter:
+            self.meter.trace_rate(0)
+
+    def attached(self):
+        # True while a computer's request for samples holds
+        if self.until is None:
+            return False
+        if time.ticks_diff(self.until, time.ticks_ms()) < 0:
+            self._stop()  # Nobody asked again: the computer has gone
+            return False
+        return True
+
+    def send(self, status):
+        # Once a pass, after the status is read: the frames, if anyone wants them
+        if not self.attached():
+            return
+        buf = self.buf
+        struct.pack_into(
+            SAMPLE, buf, frames.HEAD_SIZE, time.ticks_ms(),
+            status["yea"], status["mon"], status["day"], status["hou"], status["min"], status["sec"],
+            status["red"], status["gre"], status["blu"], status["whi"], status["fan"],
+            *[_i16(status[key], scale) for key, scale in SCALED])
+        size = frames.seal(buf, ord("S"), self.seq, SAMPLE_SIZE)
+        count = 1
+        trace, n = self.meter.traced() if self.meter else (None, 0)
+        if n:
+            view = memoryview(buf)[size:]
+            struct.pack_into(POWER, view, frames.HEAD_SIZE, time.ticks_ms(), self.meter.power_lsb)
+            struct.pack_into("<%dH" % (2 * n), view, frames.HEAD_SIZE + POWER_SIZE, *trace[:2 * n])
+            size += frames.seal(view, ord("P"), self.seq, POWER_SIZE + 4 * n)
+            count += 1
+        self.out.write(memoryview(buf)[:size])
+        self.frames += count
+        self.bytes += size
+
+    def report(self):
+        # Requests, frames and KB sent and power readings that did not fit
+        # in a frame since the last reset
+        lost = self.meter.trace_lost if self.meter else 0
+        return "stream=%d/%d/%d/%d" % (self.requests, self.frames, self.bytes // 1024, lost)
+
+    def reset(self):
+        self.requests = 0
+        self.frames = 0
+        self.bytes = 0
+        if self.meter:
+            self.meter.trace_lost = 0
@@ -0,0 +1,404 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# Keeps the internal clock, and the DS3231, on network time without
+# calling the blocking ntptime.settime() every hour.
+#
+# The RTC only counts whole seconds, so first the module finds where each
+# RTC second starts on the ticks_ms count. The RTC and ticks run from the
+# same crystal, so that phase only moves when the RTC is set. It is narrowed
+# down by reading the RTC just as a second should start, halving the
+# uncertainty each time, during the main loop's idle time.
+#
+# An SNTP query goes out at the start of the idle time and the reply is
+# waited for with select.poll inside it, so the loop never waits longer
+# than it already did. The four timestamps of the exchange give the clock's
+# offset and the round-trip delay. The offset is removed in slews of at
+# most SLEW_MS. Each slew is written to the RTC at the moment a new second
+# should start, never close to the turn of an hour, and only larger errors
+# are stepped. The offsets, with the corrections added back, give the
+# crystal's drift. It is corrected between queries, and queries are spaced
+# out to max_poll while the offset stays small.
+#
+# After each query the DS3231 is compared with the corrected clock in the
+# same way and its drift estimated. It is only rewritten when it is off by
+# more than DS_LIMIT_MS, with all registers in one transaction. With trim
+# set, its aging offset is adjusted once the drift is known.
+
+import select
+import socket
+import struct
+import time
+
+import machine
+
+NTP_DELTA = 2208988800 if time.gmtime(0)[0] == 1970 else 3155673600
+PHASE_MS = 4  # Phase needed before a query or a correction
+DS_PHASE_MS = 10
+SLEW_MS = 500  # Largest correction written at once
+SLEW_MIN_MS = 50  # Corrections smaller than this wait
+STEP_MS = 10000  # Errors larger than this are corrected at once
+DS_LIMIT_MS = 500
+GOOD_MS = 50  # Offsets under this lengthen the poll interval
+BAD_MS = 250  # and over this shorten it
+RETRY_S = 64
+LOOKUP_TIMEOUTS = 3  # Timeouts in a row before the server is looked up again
+SAMPLES = 8
+REBASE_MS = 1 << 27  # Keep ticks differences well inside ticks_diff's range
+
+
+def slope(samples):
+    # Least-squares slope of (seconds, ms) samples, in ms per second
+    n = len(samples)
+    mt = sum(s[0] for s in samples) / n
+    my = sum(s[1] for s in samples) / n
+    num = 0.0
+    den = 0.0
+    for t, y in samples:
+        num += (t - mt) * (y - my)
+        den += (t - mt) * (t - mt)
+    return num / den if den else 0.0
+
+
+class Phase:
+    """Where the seconds of a whole-second clock start, as bounds in ms.
+
+    For a clock phase K, the clock's time in ms since TimeSync.base is
+    ticks since TimeSync.ref plus K.
+    """
+
+    def __init__(self):
+        self.lo = None
+        self.hi = None
+
+    def reset(self):
+        self.lo = None
+        self.hi = None
+
+    def observe(self, sec_ms, d1, d2):
+        # The clock read sec_ms (in ms since base) between ticks d1 and d2
+        lo = sec_ms - d2
+        hi = sec_ms + 1000 - d1
+        if self.lo is None or max(lo, self.lo) >= min(hi, self.hi):
+            self.lo, self.hi = lo, hi  # First reading, or the clock was set
+        else:
+            self.lo, self.hi = max(lo, self.lo), min(hi, self.hi)
+
+    def width(self):
+        return 1000 if self.lo is None else self.hi - self.lo
+
+    def mid(self):
+        return (self.lo + self.hi) // 2
+
+    def edge(self, d):
+        # First ticks value from d at which a second starts, by mid()
+        return d + (-(d + self.mid())) % 1000
+
+
+class TimeSync:
+    def __init__(self, tz, ds3231=None, server="pool.ntp.org", min_poll=256,
+                 max_poll=65536, trim=False, timeout_ms=1000):
+        self.tz = tz
+        self.ds = ds3231
+        self.server = server
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.trim = trim
+        self.timeout_ms = timeout_ms
+        self.base = time.time()  # Local epoch seconds of ms 0
+        self.ref = time.ticks_ms()  # Ticks at ms 0
+        self.started = self.base
+        self.rtc = Phase()
+        self.dsp = Phase()
+        self.addr = None
+        self.timeouts = 0  # Queries in a row with no reply
+        self.sock = None
+        self.poller = None
+        self.poll = min_poll
+        self.due = 0.0  # Seconds since start of the next query
+        self.last_d = 0
+        self.pending = 0.0  # Estimated error of the RTC, ms (true minus RTC)
+        self.drift = 0.0  # ms the error grows per ms
+        self.ppm = None
+        self.samples = []  # (seconds since start, offset plus corrections so far)
+        self.applied = 0  # ms added to the RTC by corrections
+        self.before = None  # RTC phase before the last correction
+        self.ds_check = False
+        self.ds_samples = []
+        self.ds_applied = 0
+        self.ds_err = None
+        self.ds_ppm = None
+        self.ds_writes = 0
+        self.offset = None
+        self.delay = None
+        self.best_delay = None
+        self.queries = 0
+        self.fails = 0
+        self.rejected = 0
+        self.slews = 0
+        self.steps = 0
+
+    # ------------------------------------------------------------ time
+    def _d(self, ticks=None):
+        return time.ticks_diff(time.ticks_ms() if ticks is None else ticks, self.ref)
+
+    def _seconds(self, d):
+        return (self.base - self.started) + d / 1000
+
+    def _rebase(self):
+        d = self._d()
+        if d > REBASE_MS:
+            n = d // 1000
+            self.ref = time.ticks_add(self.ref, n * 1000)
+            self.base += n  # Phases stay the same
+            self.last_d -= n * 1000
+
+    def _observe(self):
+        # Read the RTC just once and narrow its phase
+        t1 = time.ticks_ms()
+        sec = time.time()
+        t2 = time.ticks_ms()
+        self.rtc.observe((sec - self.base) * 1000, self._d(t1), self._d(t2))
+
+    def _observe_ds(self):
+        t1 = time.ticks_ms()
+        dt = self.ds.DateTime()
+        t2 = time.ticks_ms()
+        sec = time.mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0))
+        self.dsp.observe((sec - self.base) * 1000, self._d(t1), self._d(t2))
+
+    def _refine(self, phase, observe, width, end):
+        # Read the clock as its seconds should start until the phase is
+        # known to within width ms or the idle time runs out
+        if phase.lo is None:
+            observe()
+        while phase.width() > width:
+            now = self._d()
+            edge = phase.edge(now + 2)
+            if edge > end - 2:
+                return
+            time.sleep_ms(edge - now)
+            observe()
+
+    def _wait_second(self, k, end):
+        # Sleep until a second starts for phase k; its ms since base, or
+        # None if that is past the end of the idle time
+        now = self._d()
+        at = now + 2 + (-(now + 2 + k)) % 1000
+        if at > end - 2:
+            return None
+        time.sleep_ms(at - now)
+        return at + k
+
+    # ------------------------------------------------------------ SNTP
+    def _ntp(self, ms):
+        # NTP seconds and fraction of local time ms since base
+        secs = self.base + ms // 1000 - int(self.tz * 3600) + NTP_DELTA
+        return secs & 0xFFFFFFFF, ((ms % 1000) << 32) // 1000
+
+    def _local(self, data, at):
+        secs, frac = struct.unpack_from("!II", data, at)
+        return (secs - NTP_DELTA + int(self.tz * 3600) - self.base) * 1000 + ((frac * 1000) >> 32)
+
+    def _query(self, end):
+        self.queries += 1
+        try:
+            if self.addr is None:
+                self.addr = socket.getaddrinfo(self.server, 123)[0][-1]
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.sock.setblocking(False)
+                self.poller = select.poll()
+                self.poller.register(self.sock, select.POLLIN)
+            k = self.rtc.mid()
+            packet = bytearray(48)
+            packet[0] = 0x23  # Version 4, client
+            t1 = self._d() + k
+            struct.pack_into("!II", packet, 40, *self._ntp(t1))
+            self.sock.sendto(packet, self.addr)
+            stop = min(end, self._d() + self.timeout_ms)
+            while True:
+                wait = stop - self._d()
+                if wait <= 0 or not self.poller.poll(wait):
+                    raise OSError(110)  # ETIMEDOUT
+                data = self.sock.recv(48)
+                t4 = self._d() + k
+                if len(data) == 48 and data[24:32] == packet[40:48]:
+                    break  # Anything else is a late reply to an earlier query
+            if data[0] & 7 != 4 or data[0] >> 6 == 3 or not 0 < data[1] < 16:
+                raise OSError(5)  # Not a synchronised server reply
+        except OSError as e:
+            self.fails += 1
+            # A lost packet keeps the address; a failed lookup, a socket error
+            # or a server that stays silent has it looked up again next time
+            if e.args and e.args[0] == 110:
+                self.timeouts += 1
+            if self.timeouts >= LOOKUP_TIMEOUTS or not (e.args and e.args[0] == 110):
+                self.addr = None
+                self.timeouts = 0
+            self.due = self._seconds(self._d()) + min(self.poll, RETRY_S << min(self.fails, 6))
+            return
+        self.timeouts = 0
+        t2 = self._local(data, 32)
+        t3 = self._local(data, 40)
+        offset = ((t2 - t1) + (t3 - t4)) // 2
+        delay = (t4 - t1) - (t3 - t2)
+        now = self._seconds(t4 - k)
+        if self.best_delay is None or delay < self.best_delay:
+            self.best_delay = delay
+        if delay > 3 * self.best_delay + 100:
+            self.rejected += 1  # Queued somewhere on the way; try again soon
+            self.due = now + RETRY_S
+            return
+        self.fails = 0
+        self.offset = offset
+        self.delay = delay
+        self.pending = float(offset)
+        self.last_d = t4 - k
+        if abs(offset) >= STEP_MS:
+            self.samples = []  # Time zone change or lost time; the drift so far still holds
+        else:
+            self.samples.append((now, offset + self.applied))
+            self.samples = self.samples[-SAMPLES:]
+            if len(self.samples) >= 3 and now - self.samples[0][0] >= 1800:
+                rate = slope(self.samples)  # ms per second
+                self.drift = rate / 1000
+                self.ppm = -rate * 1000  # Positive if the crystal runs fast
+        if abs(offset) < GOOD_MS:
+            self.poll = min(self.max_poll, self.poll * 2)
+        elif abs(offset) > BAD_MS:
+            self.poll = max(self.min_poll, self.poll // 4)
+        self.due = now + self.poll
+        if self.ds:
+            self.ds_check = True
+            self.dsp.reset()
+
+    # ----------------------------------------------------- corrections
+    def _correct(self, end):
+        # Write the RTC at the moment a second starts on the corrected clock
+        pending = int(self.pending)
+        step = pending if abs(pending) > STEP_MS else max(-SLEW_MS, min(SLEW_MS, pending))
+        k = self.rtc.mid()
+        if abs(step) <= SLEW_MS:
+            into = (self.base + (self._d() + k) // 1000) % 3600
+            if into < 5 or into > 3594:
+                return  # Not across the turn of an hour
+        ms = self._wait_second(k + step, end)
+        if ms is None:
+            return
+        t = time.localtime(self.base + ms // 1000)
+        machine.RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+        # What the write changed is measured once the new phase is found
+        self.before = k
+        self.rtc.reset()
+        if abs(step) > SLEW_MS:
+            self.steps += 1
+        else:
+            self.slews += 1
+
+    def _settled(self):
+        # A correction's new phase is known: book what it changed
+        applied = self.rtc.mid() - self.before
+        self.before = None
+        self.applied += applied
+        self.pending -= applied
+
+    def _compare_ds(self, end):
+        if self.dsp.width() > DS_PHASE_MS:
+            return
+        self.ds_check = False
+        err = self.dsp.mid() - self.rtc.mid() - int(self.pending)  # DS3231 ahead
+        now = self._seconds(self._d())
+        self.ds_err = err
+        self.ds_samples.append((now, err + self.ds_applied))
+        self.ds_samples = self.ds_samples[-SAMPLES:]
+        if len(self.ds_samples) >= 3 and now - self.ds_samples[0][0] >= 21600:
+            self.ds_ppm = slope(self.ds_samples) * 1000
+            if self.trim and now - self.ds_samples[0][0] >= 172800 and abs(self.ds_ppm) >= 0.2:
+                # Each aging step is about 0.1 ppm; the drift so far starts again
+                self.ds.Aging(self.ds.Aging() + int(round(self.ds_ppm * 10)))
+                self.ds_samples = []
+                self.ds_ppm = None
+        if abs(err) > DS_LIMIT_MS:
+            ms = self._wait_second(self.rtc.mid() + int(self.pending), end)
+            if ms is not None:
+                t = time.localtime(self.base + ms // 1000)
+                self.ds.DateTime([t[0], t[1], t[2], t[6], t[3], t[4], t[5]])
+                self.ds_applied += err
+                self.ds_writes += 1
+
+    # ----------------------------------------------------------- idle
+    def idle(self, ms, online=True, tz=None):
+        # Spend ms of idle time keeping the clock, sleeping for what is left
+        start = time.ticks_ms()
+        end = self._d(start) + ms
+        try:
+            self._rebase()
+            end = self._d(start) + ms
+            if tz is not None and tz != self.tz:
+                self.tz = tz
+                self.due = 0.0  # The RTC is off by the change; measure it now
+            now = self._d()
+            self.pending += self.drift * (now - self.last_d)
+            self.last_d = now
+            self._observe()
+            known = self.rtc.width() <= PHASE_MS
+            if self.before is not None:
+                self._refine(self.rtc, self._observe, PHASE_MS, end)
+                if self.rtc.width() <= PHASE_MS:
+                    self._settled()
+            elif known and online and self._seconds(now) >= self.due:
+                self._query(end)
+            elif known and abs(self.pending) >= SLEW_MIN_MS:
+                self._correct(end)
+            elif known and self.ds_check:
+                try:
+                    self._refine(self.dsp, self._observe_ds, DS_PHASE_MS, end)
+                    self._compare_ds(end)
+                except OSError:
+                    self.ds_check = False  # DS3231 not answering; next query tries again
+            self._refine(self.rtc, self._observe, PHASE_MS, end)
+        except Exception as e:
+            print("Clock sync error:", e)
+        left = time.ticks_diff(time.ticks_add(start, ms), time.ticks_ms())
+        if left > 0:
+            time.sleep_ms(left)
+
+    # --------------------------------------------------------- figures
+    def report(self):
+        # Last offset and delay (ms), crystal drift (ppm), poll interval (s),
+        # queries, failed queries, slews and steps, DS3231 error (ms) and drift
+        def num(value, fmt):
+            return "-" if value is None else fmt % value
+
+        return "clock=%s/%s/%s/%d/%d/%d/%d/%d/%s/%s" % (
+            num(self.offset, "%d"), num(self.delay, "%d"), num(self.ppm, "%+.1f"),
+            self.poll, self.queries, self.fails, self.slews, self.steps,
+            num(self.ds_err, "%d"), num(self.ds_ppm, "%+.1f"),
+        )
+
+    def reset(self):
+        self.queries = 0
+        self.fails = 0
+        self.rejected = 0
+        self.slews = 0
+        self.steps = 0
+
+    def table(self):
+        now = self._seconds(self._d())
+        lines = [
+            "offset ms      %s (delay %s ms, best %s ms)" % (self.offset, self.delay, self.best_delay),
+            "rtc phase      %s ms wide, %d ms still to correct" % (self.rtc.width(), self.pending),
+            "drift ppm      %s (%d samples)" % (
+                "unknown" if self.ppm is None else "%+.1f" % self.ppm, len(self.samples)),
+            "poll s         %d, next in %d s" % (self.poll, max(0, self.due - now)),
+            "queries        %d (%d failed, %d rejected)" % (self.queries, self.fails, self.rejected),
+            "corrections    %d slews, %d steps, %d ms in all" % (self.slews, self.steps, self.applied),
+        ]
+        if self.ds:
+            lines.append("ds3231         %s ms, drift %s ppm, %d rewrites" % (
+                self.ds_err, "unknown" if self.ds_ppm is None else "%+.1f" % self.ds_ppm,
+                self.ds_writes))
+        return "\n".join(lines)
@@ -0,0 +1,94 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# When the hourly log record is uploaded, and how fast a backlog is sent.
+#
+# Each box uploads at its own slot, a fixed number of seconds into the
+# hour, so a fleet's uploads are spread over the whole hour rather than
+# the two minutes after it. The server can assign the slot, and the rate
+# at which a backlog left by a wifi outage may be sent, by adding
+#   "upload": {"slot": 1234, "rate": 0.2, "burst": 3}
+# to its phonehome.php or log.php reply. Until it does, the slot comes
+# from a hash of the board ID, which is the same on every boot.
+#
+# A backlog is paced by a token bucket: each request takes a token, tokens
+# come back at "rate" per second and at most "burst" are saved up. The
+# main loop sends what the bucket allows each pass and the rest on later
+# passes, instead of sending everything at once half a second apart.
+
+import time
+
+WINDOW = 3600  # Slots are seconds into the hour
+RATE = 0.2  # Backlog requests per second
+BURST = 3
+
+
+def spread(board_id, window=WINDOW):
+    # FNV-1a hash of the board ID, so boxes fall evenly over the window
+    h = 2166136261
+    for ch in board_id:
+        h = ((h ^ ord(ch)) * 16777619) & 0xFFFFFFFF
+    return h % window
+
+
+class Uplink:
+    def __init__(self, board_id, rate=RATE, burst=BURST):
+        self.slot = spread(board_id)
+        self.assigned = False  # True once the server has set the slot
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_ms = None
+        self.sent = 0
+        self.failed = 0
+        self.paced = 0  # Loop passes that left requests for the next pass
+
+    def assign(self, reply):
+        # Take the slot and rate from a server reply, and return the reply
+        # without them so the rest can be checked and saved as gbe_settings
+        if not isinstance(reply, dict):
+            return reply
+        upload = reply.pop("upload", None)
+        if isinstance(upload, dict):
+            try:
+                slot = int(upload.get("slot", self.slot))
+                rate = float(upload.get("rate", self.rate))
+                burst = int(upload.get("burst", self.burst))
+                if 0 <= slot < WINDOW and rate > 0 and burst >= 1:
+                    self.slot, self.rate, self.burst = slot, rate, burst
+                    self.tokens = min(self.tokens, burst)
+                    if "slot" in upload:
+                        self.assigned = True
+            except (TypeError, ValueError):
+                pass
+        return reply
+
+    def due(self, now):
+        # Upload time for the record made at now, just after the hour turned
+        return now - now % WINDOW + self.slot
+
+    def take(self, now_ms):
+        # True if a request may go now; uses up one token
+        if self.last_ms is not None:
+            self.tokens = min(
+                self.burst, self.tokens + time.ticks_diff(now_ms, self.last_ms) * self.rate / 1000
+            )
+        self.last_ms = now_ms
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def report(self):
+        # Slot (h = from the board ID hash, s = from the server), requests
+        # sent and failed, and passes that left part of a backlog for later
+        return "uplink=%d%s/%d/%d/%d" % (
+            self.slot, "s" if self.assigned else "h", self.sent, self.failed, self.paced
+        )
+
+    def reset(self):
+        self.sent = 0
+        self.failed = 0
+        self.paced = 0
@@ -0,0 +1,139 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# RASPBERRY PI PICO / MICROPYTHON
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+# The time of day for the main loop without reading the RTC on every pass.
+#
+# The RTC and ticks_ms run from the same crystal, so once it is known at
+# which ticks value each RTC second starts, the time follows from ticks_ms
+# alone. With the timesync library, sync() takes the phase that library has
+# measured in the idle time between passes. Without it, idle() finds the
+# phase by reading the RTC just as a second should start, halving the
+# uncertainty each time, and then sleeps. tick() at the start of a pass
+# sets the time, the seconds since midnight and the hour, minute and second
+# with integer arithmetic, in place. The date, and its string, are only
+# worked out again when the day turns.
+#
+# The time does not go back by less than HOLD_MS, as after a slew or when
+# the phase gets sharper; it holds still until it catches up instead.
+# Larger steps, such as a time zone change, go through at once.
+
+import time
+
+PHASE_MS = 4
+HOLD_MS = 2000
+REBASE_MS = 1 << 27  # Keep ticks differences well inside ticks_diff's range
+
+
+class WallTime:
+    def __init__(self):
+        self.ref = time.ticks_ms()
+        self.base = time.time()  # Local epoch seconds at ticks ref
+        self.lo = None  # Bounds on K, where ms since ref plus K is ms since base
+        self.hi = None
+        self.last = None  # ms since base at the last tick
+        self.day_start = None  # Epoch seconds of the current day's midnight
+        self.date = ""  # YYYY-MM-DD
+        self.dt = [0, 0, 0, 0, 0, 0, 0, 0]  # As machine.RTC().datetime(), updated in place
+        self.time = self.base  # Local epoch seconds
+        self.seconds = 0  # Since midnight
+        self.ms = self.ref  # ticks_ms of the last tick
+        self.resets = 0  # Phase lost because the RTC was set
+        self.held = 0  # Passes held back rather than going back in time
+        self._observe()
+        self.tick()
+
+    def width(self):
+        return 1000 if self.lo is None else self.hi - self.lo
+
+    def moved(self):
+        # The RTC has just been set: find its phase again
+        self.lo = None
+        self.hi = None
+        self.resets += 1
+
+    def _bound(self, lo, hi):
+        # Narrow the phase to lo..hi, or start again there if they disagree
+        if self.lo is None or max(lo, self.lo) >= min(hi, self.hi):
+            if self.lo is not None:
+                self.resets += 1  # The RTC was set
+            self.lo, self.hi = lo, hi
+        else:
+            self.lo, self.hi = max(lo, self.lo), min(hi, self.hi)
+
+    def _observe(self):
+        t1 = time.ticks_diff(time.ticks_ms(), self.ref)
+        sec_ms = (time.time() - self.base) * 1000
+        t2 = time.ticks_diff(time.ticks_ms(), self.ref)
+        self._bound(sec_ms - t2, sec_ms + 1000 - t1)
+
+    def sync(self, clock=None):
+        # Once per pass, in the idle time: one RTC read, and the phase
+        # timesync has measured if there is one
+        d = time.ticks_diff(time.ticks_ms(), self.ref)
+        if d > REBASE_MS:
+            n = d // 1000
+            self.ref = time.ticks_add(self.ref, n * 1000)
+            self.base += n
+            if self.last is not None:
+                self.last -= n * 1000
+        self._observe()
+        phase = clock.rtc if clock else None
+        if phase and phase.lo is not None:
+            # timesync counts from its own ref and base
+            shift = time.ticks_diff(self.ref, clock.ref) - (self.base - clock.base) * 1000
+            self._bound(phase.lo + shift, phase.hi + shift)
+
+    def idle(self, ms):
+        # Spend ms of idle time narrowing the phase, sleeping for what is left
+        start = time.ticks_ms()
+        try:
+            self.sync()
+            while self.width() > PHASE_MS:
+                now = time.ticks_diff(time.ticks_ms(), self.ref)
+                edge = now + 2 + (-(now + 2 + (self.lo + self.hi) // 2)) % 1000
+                if edge - now > ms - 2 - time.ticks_diff(time.ticks_ms(), start):
+                    break
+                time.sleep_ms(edge - now)
+                self._observe()
+        except Exception as e:
+            print("Wall time error:", e)
+        left = time.ticks_diff(time.ticks_add(start, ms), time.ticks_ms())
+        if left > 0:
+            time.sleep_ms(left)
+
+    def tick(self, ticks=None):
+        # Time at ticks (now by default) into time, seconds, dt and date
+        if ticks is None:
+            ticks = time.ticks_ms()
+        ms = time.ticks_diff(ticks, self.ref) + (self.lo + self.hi) // 2
+        if self.last is not None and 0 < self.last - ms < HOLD_MS:
+            ms = self.last
+            self.held += 1
+        self.last = ms
+        t = self.base + ms // 1000
+        if self.day_start is None or not 0 <= t - self.day_start < 86400:
+            self._day(t)
+        s = t - self.day_start
+        self.time = t
+        self.seconds = s
+        self.ms = ticks
+        dt = self.dt
+        dt[4] = s // 3600
+        dt[5] = s // 60 % 60
+        dt[6] = s % 60
+
+    def _day(self, t):
+        lt = time.localtime(t)
+        self.day_start = t - (lt[3] * 3600 + lt[4] * 60 + lt[5])
+        self.dt[0], self.dt[1], self.dt[2], self.dt[3] = lt[0], lt[1], lt[2], lt[6]
+        self.date = "%d-%02d-%02d" % (lt[0], lt[1], lt[2])
+
+    def report(self):
+        # Phase uncertainty (ms), times the RTC was found set and passes held
+        return "wall=%d/%d/%d" % (self.width(), self.resets, self.held)
+
+    def reset(self):
+        self.resets = 0
+        self.held = 0
@@ -63,24 +63,104 @@ except:
     print("gbeformat library not loaded into /lib/")
 
 try:
-    from ds3231 import DS3231  # I2C real time clock
+    import busmanager  # Finds I2C sensors and imports only the drivers needed
 except:
-    print("ds3231 I2C clock library not loaded into /lib/")
+    print("busmanager I2C device library not loaded into /lib/")
 
 try:
-    import ina219  # Current sensor
+    import i2cbus  # I2C transaction accounting
 except:
-    print("ina210 I2C current sensor library not loaded into /lib/")
+    print("i2cbus I2C accounting library not loaded into /lib/")
 
 try:
-    import seesaw, stemma_soil_sensor  # Soil moisture sensor
+    import looptimer  # Main loop stage timing
 except:
-    print("Seesaw I2C soil moisture sensor libraries not loaded into /lib/")
+    print("looptimer library not loaded into /lib/")
 
 try:
-    import aht10  # Temperature and humidity sensor
+    import heapmon  # Heap telemetry and scheduled garbage collection
 except:
-    print("aht10 I2C temperature and humidity sensor libraries not loaded into /lib/")
+    print("heapmon library not loaded into /lib/")
+
+try:
+    import registry  # Extra chambers and sensors for multi-shelf racks
+except:
+    print("registry library not loaded into /lib/")
+
+try:
+    import checkpoint  # Warm-restart snapshot of averages and uploads
+except:
+    print("checkpoint library not loaded into /lib/")
+
+try:
+    import pioled  # Status LED driven by a PIO state machine
+except:
+    print("pioled library not loaded into /lib/")
+
+try:
+    import console  # Commands typed into the USB console
+except:
+    print("console library not loaded into /lib/")
+
+try:
+    import dualcore  # Lights and fan control loop on the second core
+except:
+    print("dualcore library not loaded into /lib/")
+
+try:
+    import uplink  # Upload slot in the hour and backlog pacing
+except:
+    print("uplink library not loaded into /lib/")
+
+try:
+    import timesync  # Network time without blocking the main loop
+except:
+    print("timesync library not loaded into /lib/")
+
+try:
+    import filters  # Missing-value marker and filter chains for sensor readings
+except:
+    print("filters library not loaded into /lib/")
+
+try:
+    import sampling  # Each sensor read at its own rate
+except:
+    print("sampling library not loaded into /lib/")
+
+try:
+    import walltime  # Time of day from ticks_ms between RTC reads
+except:
+    print("walltime library not loaded into /lib/")
+
+try:
+    import anomaly  # Fan, LED driver and temperature alerts within seconds
+except:
+    print("anomaly library not loaded into /lib/")
+
+try:
+    import energy  # Energy from the INA219 read many times a second
+except:
+    print("energy library not loaded into /lib/")
+
+try:
+    import storage  # File writes gathered in RAM, with flash wear figures
+except:
+    print("storage library not loaded into /lib/")
+
+try:
+    import manifest  # Index of the daily log files for retention and export
+except:
+    print("manifest library not loaded into /lib/")
+
+try:
+    import serialsync  # Log files copied over the USB console while running
+except:
+    print("serialsync library not loaded into /lib/")
+
+try:
+    import telemetry  # Binary samples for a computer on the USB console
+except:
+    print("telemetry library not loaded into /lib/")
 
 
 # ---Load lights, fan, time zone configuration from JSON file---
@@ -89,9 +169,86 @@ with open("/config/gbe_settings.json") as settings_file:
     config = json.load(settings_file)
     settings_file.close()
 
+# Optional settings for this box's hardware and diagnostics. These stay on the
+# device and are not replaced by configuration from the GBE cloud, e.g.
+# {"timing": {"enabled": true, "budget ms": {"loop": 3000, "status": 250}},
+#  "heap": {"enabled": true, "collect below": 40000, "gc threshold": 0},
+#  "checkpoint": {"enabled": true, "interval s": 300},
+#  "control": {"dual core": true, "period ms": 100},
+#  "status led": {"pio": true, "state machine": 0},
+#  "cloud": {"url": "http://growingbeyond.earth"},
+#  "clock": {"sync": true, "server": "pool.ntp.org", "min poll s": 256,
+#            "max poll s": 65536, "trim ds3231": false},
+#  "devices": {"chambers": [...], "sensors": [...]},
+#  "sampling": {"ina": {"period s": 0, "oversample": 8}, "seesaw": {...}},
+#  "filters": {"ssm": {"range": [100, 2000], "max step": 300, "median": 3}},
+#  "alerts": {"enabled": true, "fan low": 0.5, "led tolerance": 0.1},
+#  "energy": {"enabled": true, "rate hz": 20, "save s": 300},
+#  "storage": {"enabled": true, "flush bytes": 2048, "flush s": 900},
+#  "retention": {"logs kb": 256, "diag kb": 192},
+#  "sync": {"enabled": true, "frames per pass": 32, "frame bytes": 512},
+#  "console": {"mode": "text", "rate hz": 10, "hold s": 10},
+#  "i2c": {"retry min s": 30, "retry max s": 3600,
+#          "i2c0": {"freq": 400000, "timeout ms": 50}, "i2c1": {...}}}
+# See lib/registry.py for the "devices" section, lib/sampling.py for
+# "sampling", lib/filters.py for "filters", lib/anomaly.py for "alerts",
+# lib/energy.py for "energy", lib/storage.py for "storage",
+# lib/manifest.py for "retention", lib/serialsync.py for "sync",
+# lib/telemetry.py for "console" and lib/timesync.py for "clock", whose
+# "sync" (on unless false) is network time, not the top-level "sync".
+try:
+    with open("/config/device_settings.json") as device_file:
+        device_config = json.load(device_file)
+        device_file.close()
+except:
+    device_config = {}
+
+# Log, diagnostics and queue files are appended through the store, which
+# gathers the writes in RAM and counts the flash wear of each file
+storage_config = device_config.get("storage", {})
+store = None
+if storage_config.get("enabled", True):
+    try:
+        store = storage.Store(storage_config)
+    except:
+        store = None
+
+# The daily log and diag files are indexed in a manifest in each folder, and
+# the oldest removed when a folder goes over its size budget
+retention_config = device_config.get("retention", {})
+log_index = diag_index = None
+try:
+    log_index = manifest.Manifest("logs", retention_config.get("logs kb", 256) * 1024, store)
+    diag_index = manifest.Manifest("diag", retention_config.get("diag kb", 192) * 1024, store)
+    if store:
+        store.watch("logs/", log_index.wrote)  # Told once the text is on flash
+        store.watch("diag/", diag_index.wrote)
+except Exception as e:
+    log_index = diag_index = None
+    print("Log files are cleaned up by count:", e)
+
+# Where phonehome.php and log.php are, e.g. a local Host-Tools/gbe_server.py
+cloud_url = device_config.get("cloud", {}).get("url", "http://growingbeyond.earth")
+
+# Upload slot and backlog rate, until the server assigns them
+try:
+    uploads = uplink.Uplink(board_id)
+except:
+    uploads = None
+
 # -----------Set up status LED and do a magenta pulse------------
 
-np = neopixel.NeoPixel(machine.Pin(6), 1)
+# A PIO state machine clocks the bits out, so writes return straight away
+# and do not turn interrupts off; the neopixel module is the fallback
+led_config = device_config.get("status led", {})
+np = None
+if led_config.get("pio", True):
+    try:
+        np = pioled.PioLED(6, 1, led_config.get("state machine", 0))
+    except:
+        print("PIO status LED not available")
+if np is None:
+    np = neopixel.NeoPixel(machine.Pin(6), 1)
 npc = {
     "red": [0, 1, 0],
     "green": [1, 0, 0],
@@ -135,9 +292,11 @@ startup_message = None
 if wlan.isconnected():
     try:
         result = urequests.get(
-            "http://growingbeyond.earth/phonehome.php?boa=" + board_id + "&mac=" + mac_address + "&sof=" + software_date
+            cloud_url + "/phonehome.php?boa=" + board_id + "&mac=" + mac_address + "&sof=" + software_date
         )
         cloudinfo = json.loads(result.text)
+        if uploads:
+            uploads.assign(cloudinfo)  # Upload slot and rate, if the server sent them
         device_name = cloudinfo['site_name']
         startup_message = cloudinfo['startup_message']
         print("Connected to GBE Cloud")
@@ -145,43 +304,111 @@ if wlan.isconnected():
         print("Unable to connect to GBE Cloud")
 
 
+# Replace the running configuration and save it to gbe_settings.json.
+# Every upload reply carries the configuration, so it is only written when
+# it has changed.
+def saveConfig(incoming_config):
+    global config
+    if gbeformat.valid_config(incoming_config) and incoming_config != config:
+        config = incoming_config
+        if store:
+            store.replace("/config/gbe_settings.json", json.dumps(config))
+            return
+        settings_file = open("/config/gbe_settings.json", "w")
+        settings_file.write(json.dumps(config))
+        settings_file.close()
+
+
+# --------Set up MQTT telemetry if a broker is configured--------
+
+mqtt = None
+try:
+    with open("/config/mqtt_settings.json") as mqtt_file:
+        mqtt_config = json.load(mqtt_file)
+        mqtt_file.close()
+    import gbemqtt  # MQTT client with offline queue
+
+    mqtt = gbemqtt.Telemetry(board_id, mqtt_config, store=store)
+    mqtt.on_config = saveConfig  # Before connecting: a retained config comes straight away
+    if wlan.isconnected() and mqtt.connect():
+        print("Connected to MQTT broker")
+except:
+    mqtt = None
+
+
 # -------Set up I2C bus 0 for devices inside the control box----
 
-i2c0 = machine.I2C(0, sda=machine.Pin(16), scl=machine.Pin(17))
+# Speed and per-transaction timeout can be set for each bus, e.g.
+# "i2c": {"i2c1": {"freq": 100000, "timeout ms": 10}}
+i2c_config = device_config.get("i2c", {})
+
 
+def openBus(bus_id, sda, scl, name, timeout_ms):
+    settings = i2c_config.get(name, {})
+    freq = settings.get("freq", 400000)
+    timeout = int(settings.get("timeout ms", timeout_ms) * 1000)
+    i2c = machine.I2C(
+        bus_id, sda=machine.Pin(sda), scl=machine.Pin(scl), freq=freq, timeout=timeout
+    )
+    try:
+        # Count transactions, bytes and bus time, and free the bus if it gets stuck
+        return i2cbus.Bus(i2c, name, bus_id, sda, scl, freq, timeout)
+    except:
+        return i2c
+
+
+i2c0 = openBus(0, 16, 17, "i2c0", 50)
+
+# Scan both buses once; sensors that are missing or stop responding are
+# looked for again with a growing delay instead of on every loop
 try:
-    ina = ina219.INA219(0.1, i2c0)
-    ina.configure()
-    print("Connected to LED panel current sensor")
+    sensors = busmanager.BusManager(
+        i2c_config.get("retry min s", 30), i2c_config.get("retry max s", 3600)
+    )
 except:
-    ina = False
+    sensors = None
+
+if sensors and sensors.add("ina", i2c0, 0x40, "ina219"):
+    print("Connected to LED panel current sensor")
 
 
 # ----Set up I2C bus 1 for devices outside the control box-------
 
-i2c1 = machine.I2C(1, sda=machine.Pin(18), scl=machine.Pin(19), freq=400000)
+# A shorter timeout, as a device on the external connector can hang the bus
+i2c1 = openBus(1, 18, 19, "i2c1", 20)
 
-try:
-    seesaw = stemma_soil_sensor.StemmaSoilSensor(i2c1)
+if sensors and sensors.add("seesaw", i2c1, 0x36, "soil"):
     print("Connected to external soil moisture sensor")
-except:
-    seesaw = False
 
-try:
-    aht10 = aht10.AHT10(i2c1)
+if sensors and sensors.add("aht10", i2c1, 0x38, "aht10"):
     print("Connected to external temperature and humidity sensor")
-except:
-    aht10 = False
+
+
+# ----Set up extra chambers and sensors listed in device_settings----
+
+devices = None
+extra_keys = []
+if device_config.get("devices"):
+    try:
+        devices = registry.Registry(device_config["devices"], (i2c0, i2c1), sensors)
+        extra_keys = devices.columns()
+    except Exception as e:
+        print("Unable to set up extra devices:", e)
 
 
 # ---Set internal clock using network time or I2C realtime clock---
 
 try:  # get local time from I2C RTC
-    rtc = DS3231(i2c0)
+    rtc = sensors.add("rtc", i2c0, 0x68, "ds3231")
     lt = [x for x in rtc.DateTime()] + [0]
 except:
     rtc = False
 
+if sensors:
+    for bus in (i2c0, i2c1):
+        for addr in sensors.unknown(bus):
+            print("Unrecognized I2C device at " + hex(addr))
+
 # Use internal clock if its time is already set
 if machine.RTC().datetime()[0] > 2021:
     lt = list(machine.RTC().datetime())
@@ -222,6 +449,28 @@ if ntp:
 if lt:
     print("Clock set\n")
 
+# Keep the clock on network time from here on, in the main loop's idle time
+clock_config = device_config.get("clock", {})
+clock = None
+if clock_config.get("sync", True):
+    try:
+        clock = timesync.TimeSync(
+            config["time zone"]["GMT offset"],
+            rtc or None,
+            clock_config.get("server", "pool.ntp.org"),
+            clock_config.get("min poll s", 256),
+            clock_config.get("max poll s", 65536),
+            clock_config.get("trim ds3231", False),
+        )
+    except:
+        clock = None
+
+# Work the time out from ticks_ms in the main loop instead of reading the RTC
+try:
+    wall = walltime.WallTime()
+except:
+    wall = None
+
 
 # ---------------Set up variables for logging--------------------
 
@@ -242,8 +491,42 @@ log_avg = {
     "sst": 0,
     "ssm": 0,
 }
+for key in extra_keys:
+    log_avg[key] = 0  # Averages for extra chambers and sensors
+log_cnt = {}  # Readings in each average; missing ones are left out
+for key in log_avg:
+    log_cnt[key] = 0
 sched = [{}]
 
+# Pick up the running averages and queued uploads saved before a restart.
+# Averages are only used if they were saved earlier in this same hour.
+checkpoint_config = device_config.get("checkpoint", {})
+snapshot = None
+if checkpoint_config.get("enabled", True):
+    try:
+        snapshot = checkpoint.Checkpoint(
+            log_avg, interval=checkpoint_config.get("interval s", 300), store=store
+        )
+        saved = snapshot.load()
+        if saved and saved[0] // 3600 == time.time() // 3600 and saved[1] == loghour:
+            log_avg.update(saved[2])
+            log_cnt.update(saved[3])
+        queued = snapshot.load_outbox()
+        if queued:
+            for cache in queued:
+                if "time" in cache:
+                    # Don't wait for a time that only a clock reset put in the future
+                    # (an upload slot is at most an hour away)
+                    cache["time"] = min(cache["time"], time.time() + 3600)
+            sched = queued
+        if log_avg["ent"] or "time" in sched[-1]:
+            print(
+                "Restored %d samples and %d queued uploads from checkpoint\n"
+                % (log_avg["ent"], len([c for c in sched if "time" in c]))
+            )
+    except:
+        print("Unable to restore checkpoint")
+
 # ---------------Set up LED and fan control--------------------
 # Connect 24v MOSFETs to PWM channels on GPIO Pins 0-4
 # Set PWM frequency on all channels
@@ -259,10 +542,46 @@ w.freq(20000)  # White channel
 f = machine.PWM(machine.Pin(4))
 f.freq(20000)  # Fan
 
+# ---------------Set up main loop diagnostics--------------------
+
+timing_config = device_config.get("timing", {})
+budgets_ms = {"loop": 3000, "led": 2500, "upload": 5000, "alert": 5000, "hourly": 1000,
+              "jitter": 20}
+budgets_ms.update(timing_config.get("budget ms", {}))
+try:
+    timer = looptimer.LoopTimer(timing_config.get("enabled", True), budgets_ms, 250)
+except:
+    timer = None
+
+# Collect garbage between loops so the automatic collector does not run
+# inside a stage, and track allocation per stage through the loop timer
+heap_config = device_config.get("heap", {})
+try:
+    heap = heapmon.HeapMonitor(
+        heap_config.get("enabled", True),
+        heap_config.get("collect below"),
+        heap_config.get("gc threshold"),
+    )
+    if timer:
+        timer.heap = heap
+except:
+    heap = None
+
+try:
+    shell = console.Console()
+except:
+    shell = None
+
 # Initialize variables for counting fan RPMs
 counter = 0
 prev_ms = 0
 
+# Lights and fan run on core 1 unless switched off or _thread is missing
+control_config = device_config.get("control", {})
+control_period_ms = control_config.get("period ms", 100)
+control = None
+last_control_ms = None
+
 # Clean up lights in case of a previous crash
 r.duty_u16(0)
 g.duty_u16(0)
@@ -274,6 +593,10 @@ w.duty_u16(0)
 
 
 def getRTC():
+    # Time for this pass, from ticks_ms when the walltime library is loaded
+    if wall:
+        wall.tick()
+        return wall.dt, wall.seconds, wall.ms
     # Read the time from the internal clock
     rtc_dt = machine.RTC().datetime()
     rtc_seconds = ((((rtc_dt[4]) * 60) + rtc_dt[5]) * 60) + rtc_dt[6]
@@ -281,13 +604,19 @@ def getRTC():
     return rtc_dt, rtc_seconds, rtc_ms
 
 
-def updateRTC(ntp):
-    if wlan.isconnected() and ntp == False:
+def localTime():
+    # Local epoch seconds as of this pass
+    return wall.time if wall else time.time()
+
+
+def updateRTC():  # Without the timesync library
+    global rtc, ntp
+    if wlan.isconnected():
         try:  # Use network time if available
             ntptime.settime()  # Set the internal RTC time to the network time in UTC
             ct = time.localtime(
-                time.time() - (abs(config["time zone"]["GMT offset"])) * 3600
-            )  # Correct time for local time zone
+                time.time() + (config["time zone"]["GMT offset"]) * 3600
+            )  # Correct time for local time zone, as at startup
             lt = [
                 ct[0],
                 ct[1],
@@ -299,15 +628,19 @@ def updateRTC(ntp):
                 0,
             ]  # Format time for setting RTC
             machine.RTC().datetime(lt)  # Set internal clock
+            if wall:
+                wall.moved()
+            ntp = True
         except:
             ntp = False
 
-    try:
-        rtc.DateTime(
-            machine.RTC().datetime()
-        )  # Set I2C RTC -- Done hourly to prevent drift
-    except:
-        rtc = False
+    if rtc:
+        try:
+            rtc.DateTime(
+                machine.RTC().datetime()
+            )  # Set I2C RTC -- Done hourly to prevent drift
+        except:
+            rtc = False
 
 
 def toSeconds(input_time):
@@ -344,6 +677,19 @@ def controlLightsAndFan():
         w.duty_u16(0)
         f.duty_u16(int(min(255, config["fan"]["duty"]["when lights off"])) * 256)
 
+    if devices:
+        devices.control(rtc_seconds, config)  # Extra chambers
+
+
+def loopJitter(now_ms):
+    # With the lights and fan in the main loop, how much later than one
+    # core 1 period each pass came, so both ways show in the same figures
+    global last_control_ms
+    if timer and last_control_ms is not None:
+        late = time.ticks_diff(now_ms, last_control_ms) - control_period_ms
+        timer.record("jitter", max(0, late) * 1000)
+    last_control_ms = now_ms
+
 
 def steadyLED(color):
     np[0] = tuple([int(rgb * 255) for rgb in npc[color]])
@@ -369,36 +715,70 @@ def fanPulse(pin):  # Count fan rotation, triggered twice per rotation
     counter += 1
 
 
+def idleBuses(idle):  # Keep I2C traffic between passes out of the per-loop figures
+    for bus in (i2c0, i2c1):
+        if hasattr(bus, "idle"):
+            bus.idle = idle
+            bus.site = "clock" if idle else None
+
+
+def closeBusCycles():  # End one accounting cycle on each I2C bus
+    for bus in (i2c0, i2c1):
+        if hasattr(bus, "end_cycle"):
+            bus.end_cycle()
+            bus.check()  # Free the bus if a device is holding it
+
+
+def readINA(ina):
+    return ina.voltage(), ina.current(), ina.power()
+
+
+def readSeesaw(seesaw):
+    return seesaw.get_moisture(), seesaw.get_temp()
+
+
+def readAHT10(aht10):
+    return aht10.measure()  # One conversion for both values
+
+
 def tryGetINA():  # Read current sensor
-    try:
-        return ina.voltage(), ina.current(), ina.power()
-    except:
+    if not sensors:
         return 0, 0, 0
+    if meter:
+        return meter.read()  # Means over the pass from the energy meter
+    if sampler:
+        return sampler.latest("ina")
+    return sensors.read("ina", readINA, (0, 0, 0))
 
 
 def tryGetSeesaw():  # Read soil moisture & temp sensor
-    try:
-        return seesaw.get_moisture(), seesaw.get_temp()
-    except:
+    if not sensors:
         return 0, 0
+    if sampler:
+        return sampler.latest("seesaw")
+    return sensors.read("seesaw", readSeesaw, (0, 0))
 
 
 def tryGetAHT10():  # Read temperature & humidity sensor
-    try:
-        return aht10.temperature(), aht10.humidity()
-    except:
+    if not sensors:
         return 0, 0
+    if sampler:
+        return sampler.latest("aht10")
+    return sensors.read("aht10", readAHT10, (0, 0))
 
 
 def getStatus():
+    if sampler:
+        sampler.service()  # Read the sensors that are due
     vol, mam, mwa = tryGetINA()  # Read current sensor
     ssm, sst = tryGetSeesaw()  # Read soil moisture & temp sensor
     tem, hum = tryGetAHT10()  # Read temperature & humidity sensor
+    rnd = gbeformat.rnd  # Keeps None for a missing reading
 
-    return {
+    status = {
         "boa": board_id,  # Unique ID of Raspberry Pi Pico
         "sof": software_date,
-        "tim": time.time(),  # Local time
+        "tim": localTime(),  # Local time
         "yea": rtc_dt[0],  # Current year
         "mon": rtc_dt[1],  # Current month
         "day": rtc_dt[2],  # Current day
@@ -409,14 +789,14 @@ def getStatus():
         "gre": round(g.duty_u16() / 256),  # Green LED channel brightness
         "blu": round(b.duty_u16() / 256),  # Blue LED channel brightness
         "whi": round(w.duty_u16() / 256),  # White LED channel brightness
-        "vol": round(vol, 2),  # Sensor: INA219 voltage
-        "mam": round(mam),  # Sensor: INA219 current (milliamps)
-        "wat": round(mwa / 1000, 2),  # Sensor: INA219 power (watts)
+        "vol": rnd(vol, 2),  # Sensor: INA219 voltage
+        "mam": rnd(mam),  # Sensor: INA219 current (milliamps)
+        "wat": rnd(None if mwa is None else mwa / 1000, 2),  # Sensor: INA219 power (watts)
         "fan": round(f.duty_u16() / 256),  # Fan speed setting
-        "ssm": round(ssm),  # Sensor: Seesaw I2C soil moisture
-        "sst": round(sst, 2),  # Sensor: Seesaw I2C temperature
-        "tem": round(tem, 2),  # Sensor: AHT10 I2C temperature
-        "hum": round(hum, 2),  # Sensor: AHT10 I2C humidity
+        "ssm": rnd(ssm),  # Sensor: Seesaw I2C soil moisture
+        "sst": rnd(sst, 2),  # Sensor: Seesaw I2C temperature
+        "tem": rnd(tem, 2),  # Sensor: AHT10 I2C temperature
+        "hum": rnd(hum, 2),  # Sensor: AHT10 I2C humidity
         "rpm": counter / (rtc_ms - prev_ms) * 30000,  # Sensor: Fan RPM
         "con": config["lights"]["timer"]["on"],  # Config: Lights on time
         "cof": config["lights"]["timer"]["off"],  # Config: Lights off time
@@ -428,19 +808,131 @@ def getStatus():
         "cwh": config["lights"]["duty"]["white"],  # Config: White LED brightness
         "ctz": config["time zone"]["GMT offset"]  # Config: Time zone
     }
-
-
-# Remove old log files, keeping the specified number
-def cleanLogs(keep_number):
+    if devices:
+        devices.sample(status, rtc_ms - prev_ms)  # Extra chambers and sensors
+    if meter:
+        meter.account(status, wall.date if wall else gbeformat.ymd(status))
+    return status
+
+
+# The hour's averages, with None (left blank in the log) for a reading
+# that was missing all hour
+def hourAverages():
+    averages = {}
+    for key in log_avg:
+        averages[key] = log_avg[key] if key == "ent" or log_cnt[key] else None
+    return averages
+
+
+# Send one alert record now: over MQTT unless the box uploads over HTTP,
+# otherwise to alert.php. Raises if it could not be sent.
+def sendAlert(query):
+    if mqtt and not mqtt.http:
+        mqtt.alert(query)  # Queued on flash if the broker is down
+        return
+    result = urequests.get(cloud_url + "/alert.php?" + query)
+    status = result.status_code
+    result.close()
+    if not 200 <= status < 300:
+        raise OSError("alert.php returned %d" % status)  # Kept and sent again later
+
+
+# Remove old log files, keeping the specified number (without the manifest library)
+def cleanLogs(keep_number, folder="logs"):
     try:
-        log_list = os.listdir("logs")
+        log_list = sorted([name for name in os.listdir(folder) if name[:4].isdigit()])
         del_files = range(len(log_list) - keep_number)
         for idx in del_files:
-            os.remove("logs/" + log_list[idx])
-    except:
+            os.remove(folder + "/" + log_list[idx])
+    except Exception as e:
         print("Error cleaning up log files:", e)
 
 
+# Loop timing, heap, I2C device and bus figures for the hourly diagnostics record
+def diagnostics():
+    entries = []
+    if timer and timer.enabled:
+        entries += timer.report()
+        timer.reset()
+    if heap and heap.enabled:
+        entries += heap.report()
+        heap.reset()
+    if control:
+        entries.append(control.report())
+        control.reset()
+    if uploads:
+        entries.append(uploads.report())
+        uploads.reset()
+    if clock:
+        entries.append(clock.report())
+        clock.reset()
+    if wall:
+        entries.append(wall.report())
+        wall.reset()
+    if sampler:
+        entries.append(sampler.report())
+        sampler.reset()
+        if sampler.filters:
+            entries.append(sampler.filters.report())
+            sampler.filters.reset()
+    if alerts:
+        entries.append(alerts.report())
+        alerts.reset()
+    if meter:
+        entries.append(meter.report())
+        meter.reset()
+    if store:
+        entries.append(store.report())
+        store.reset()
+    for index in (log_index, diag_index):
+        if index:
+            entries.append(index.report())
+            index.reset()
+    if link:
+        entries.append(link.report())
+        link.reset()
+    if stream:
+        entries.append(stream.report())
+        stream.reset()
+    if snapshot:
+        # Boots since the checkpoint files were created, writes and bytes
+        entries.append("checkpoint=%d/%d/%d" % (snapshot.boots, snapshot.writes, snapshot.bytes))
+    if sensors:
+        entries.append(sensors.summary())
+    for bus in (i2c0, i2c1):
+        if hasattr(bus, "summary"):
+            entries.append(bus.summary())
+            bus.reset_stats()
+    return entries
+
+
+# Append hourly diagnostics to today's file in the diag directory
+def writeDiag(stat):
+    try:
+        entries = diagnostics()
+        if entries:
+            if not fileExists("diag"):
+                os.mkdir("diag")
+            diag_path = "diag/" + (wall.date if wall else gbeformat.ymd(stat)) + ".txt"
+            line = "%02d:%02d\t" % (stat["hou"], stat["min"]) + "\t".join(entries) + "\n"
+            if store:
+                store.append(diag_path, line)
+                return
+            diagfile = open(diag_path, "a")
+            diagfile.write(line)
+            diagfile.close()
+            if diag_index:
+                diag_index.wrote(diag_path, line)
+    except Exception as e:
+        print("Error saving the diagnostics file:", e)
+
+
+def printI2C():
+    for bus in (i2c0, i2c1):
+        if hasattr(bus, "summary"):
+            print(bus.summary())
+
+
 # Check to see if a file exists
 def fileExists(filename):
     try:
@@ -450,6 +942,73 @@ def fileExists(filename):
         return False
 
 
+# ------Measure the energy used with the INA219 on a timer-------
+
+energy_config = device_config.get("energy", {})
+meter = None
+if sensors and energy_config.get("enabled", True):
+    try:
+        meter = energy.Meter(sensors, "ina", energy_config, store=store)
+        if meter.start():
+            print("Measuring energy %d times a second" % (1000 // meter.period_ms))
+        else:
+            meter = None
+    except Exception as e:
+        meter = None
+        print("Energy is not measured:", e)
+
+
+# -------------Read each sensor at its own rate from here on-------------
+
+sampler = None
+if sensors:
+    try:
+        try:
+            cleaner = filters.Filters(device_config.get("filters"))
+        except:
+            cleaner = None
+        sampler = sampling.Sampler(sensors, device_config.get("sampling"), cleaner)
+        if not meter:
+            sampler.add("ina", readINA, ("vol", "mam", "wat"))  # Otherwise the meter has it
+        sampler.add("seesaw", readSeesaw, ("ssm", "sst"))
+        sampler.add("aht10", readAHT10, ("tem", "hum"))
+        if devices:
+            devices.sampled(sampler)  # Extra sensors
+        sampler.prime()
+    except Exception as e:
+        sampler = None
+        if devices:
+            devices.sampled(None)
+        print("Sensors are read on every loop:", e)
+
+# Watch the readings for a stalled fan, a failed LED driver or the chamber
+# getting too hot or cold, and send an alert straight away
+alert_config = device_config.get("alerts", {})
+alerts = None
+if alert_config.get("enabled", True):
+    try:
+        alerts = anomaly.Detector(board_id, alert_config)
+    except:
+        alerts = None
+
+
+# ----------Start the lights and fan control loop on core 1---------
+
+if control_config.get("dual core", True):
+    try:
+        groups = [((r, g, b, w, f), None, None)]
+        if devices:
+            groups += devices.groups()  # Extra chambers
+        control = dualcore.Controller(groups, control_period_ms)
+        rtc_dt, rtc_seconds, rtc_ms = getRTC()
+        control.update(config, rtc_seconds, rtc_ms)
+        control.start()
+        print("Lights and fan control running on core 1")
+    except Exception as e:
+        control = None
+        print("Lights and fan control stays in the main loop:", e)
+
+
 # ----------------------------Main Start----------------------------
 # Print information at startup
 net = wlan.ifconfig()
@@ -476,108 +1035,321 @@ print(
 p5 = Pin(5, Pin.IN, Pin.PULL_UP)
 p5.irq(trigger=Pin.IRQ_FALLING, handler=fanPulse)
 
+# Commands that can be typed into the shell while the program runs
+if shell:
+    if timer:
+        shell.add("timing", lambda: print(timer.table()), "Main loop stage timing this hour")
+    if heap:
+        shell.add("heap", lambda: print(heap.table()), "Heap use and garbage collection this hour")
+    shell.add("i2c", printI2C, "I2C transactions/bytes/us per device this hour")
+    if clock:
+        shell.add("clock", lambda: print(clock.table()), "Network time offset, drift and polling")
+    if sampler:
+        shell.add("sampling", lambda: print(sampler.table()), "Sensor periods, oversampling and last readings")
+    if alerts:
+        shell.add("alerts", lambda: print(alerts.table()), "Fan, LED and temperature alerts and baselines")
+    if meter:
+        shell.add("energy", lambda: print(meter.table()), "Energy by hour, day and light setting, and timer cost")
+    if log_index:
+        shell.add("logs", lambda: print(log_index.table() + "\n" + diag_index.table()),
+                  "Daily log and diag files, sizes and checksums")
+    if store:
+        shell.add("storage", lambda: print(store.table()), "Flash writes and wear by file, and writes pending")
+    if sensors:
+        shell.add("sensors", lambda: print(sensors.table()), "I2C devices found and missing")
+
+# A computer can copy the log and diag files over the console while the program runs
+sync_config = device_config.get("sync", {})
+link = None
+if shell and log_index and sync_config.get("enabled", True):
+    try:
+        link = serialsync.Sync(
+            board_id, software_date, {"logs": log_index, "diag": diag_index}, store, sync_config
+        )
+        shell.framed(serialsync.REQUESTS, link.request)
+    except:
+        link = None
+
+# Samples in binary for a computer that asks for them; status lines in text mode only
+stream = None
+if shell:
+    try:
+        stream = telemetry.Stream(board_id, software_date, device_config.get("console", {}), meter)
+        shell.framed("T", stream.request)
+        shell.add("mode", stream.select, "Console mode, text or binary (status lines or none)")
+    except:
+        stream = None
+
+
+# Leave the lights, fan and I2C to whoever stops the program, with what is
+# pending written out
+def stopProgram():
+    if control:
+        control.stop()  # Core 1 would go on driving the lights and fan
+    if meter:
+        meter.stop()  # And the timer would go on reading the INA219
+    if store:
+        store.flush()
+
+
+# Keep sensor setup at boot out of the per-loop I2C figures
+closeBusCycles()
+first_loop = True
+usb_checked = False  # Until a supply voltage has been read
+
 # Main Loop
 while True:
     try:
+        if timer:
+            timer.start()
         rtc_dt, rtc_seconds, rtc_ms = getRTC()
-        controlLightsAndFan()
+        if control and control.running:
+            control.update(config, rtc_seconds, rtc_ms)  # Core 1 sets the outputs
+            control.drain(timer)
+        else:
+            controlLightsAndFan()
+            loopJitter(rtc_ms)
+        if timer:
+            timer.mark("control")
 
         status_now = getStatus()  # Read settings and sensor data
         prev_ms = rtc_ms
         counter = 0  # Reset fan RPM counter
-
-        print(gbeformat.columns(status_now))  # Print status to the shell
-
-        # If power is coming from USB, assume a computer is connected and halt program execution
-        if log_avg["ent"] == 0 and status_now["vol"] < 18 and ina:
-            print(
-                "\n\n24v power not detected. Ending program to allow access to the filesystem . . .\n"
-            )
-            steadyLED("green")
-            break
-
-        # Calculate running average of sensor readings
+        if alerts:
+            alerts.check(status_now)  # Compare with the learned baselines
+        if timer:
+            timer.mark("status")
+
+        if stream and not stream.text:
+            if status_now["tem"] in (0, None):
+                status_now["tem"] = status_now["sst"]  # As columns() does, for the log
+        elif devices:
+            print(gbeformat.columns(status_now, wall and wall.date) + devices.summary(status_now))
+        else:
+            print(gbeformat.columns(status_now, wall and wall.date))  # Print status to the shell
+        if stream:
+            stream.send(status_now)  # Binary samples, if a computer has asked for them
+        if timer:
+            timer.mark("print")
+
+        # If power is coming from USB, assume a computer is connected and halt program execution.
+        # Checked until the first voltage reading comes in, as a failed read is None.
         if (
-            log_avg["ent"] > 0
-        ):  # Skip the first sensor readings to let fan RPMs stabilize
-            for idx, dic in enumerate(log_avg):
-                if dic != "ent":
-                    log_avg[dic] = round(
-                        (log_avg[dic] * (log_avg["ent"] - 1) + status_now[dic])
-                        / log_avg["ent"],
-                        2,
-                    )
-        log_avg["ent"] += 1
+            (log_avg["ent"] == 0 or not usb_checked)
+            and sensors
+            and sensors.get("ina")
+            and status_now["vol"] is not None
+        ):
+            usb_checked = True
+            if status_now["vol"] < 18:
+                print(
+                    "\n\n24v power not detected. Ending program to allow access to the filesystem . . .\n"
+                )
+                steadyLED("green")
+                stopProgram()  # The computer is about to read the files
+                break
+
+        # Calculate running average of sensor readings. After a restart the
+        # restored averages already have entries, so only skip the reading.
+        if log_avg["ent"] == 0 or not first_loop:
+            if (
+                log_avg["ent"] > 0
+            ):  # Skip the first sensor readings to let fan RPMs stabilize
+                for idx, dic in enumerate(log_avg):
+                    if dic != "ent" and status_now[dic] is not None:
+                        log_cnt[dic] += 1  # Missing readings are left out
+                        log_avg[dic] = round(
+                            (log_avg[dic] * (log_cnt[dic] - 1) + status_now[dic])
+                            / log_cnt[dic],
+                            2,
+                        )
+            log_avg["ent"] += 1
+        first_loop = False
+        if snapshot:
+            snapshot.save(log_avg, loghour, False, log_cnt)  # At most once per interval
+        if timer:
+            timer.mark("average")
 
         # If wifi is connected, upload hourly log and update clock at specified time, looping through
         # cached log entries. If upload fails, do not try again until a new entry is appended.
+        # A backlog goes as fast as the upload rate allows, the rest on the next passes.
         if (
             wlan.isconnected()
             and "time" in sched[-1]
-            and sched[-1]["time"] < time.time()
+            and sched[-1]["time"] < localTime()
             and not sched[-1]["tried"]
         ):
             try:
-                sched[-1]["tried"] = True
-                for cache in sched:
+                while "time" in sched[0]:
+                    if uploads and not uploads.take(time.ticks_ms()):
+                        uploads.paced += 1
+                        break
                     result = urequests.get(
-                        "http://growingbeyond.earth/log.php?" + cache["url"]
+                        cloud_url + "/log.php?" + sched[0]["url"]
                     )
                     # Parse incoming JSON and update gbe_settings.json if valid
-                    incoming_config = json.loads(result.text)
-                    if gbeformat.valid_config(incoming_config):
-                        config = incoming_config
-                        settings_file = open("/config/gbe_settings.json", "w")
-                        settings_file.write(json.dumps(config))
-                        settings_file.close()
+                    reply = json.loads(result.text)
+                    if uploads:
+                        reply = uploads.assign(reply)
+                        uploads.sent += 1
+                    saveConfig(reply)
                     sched.pop(0)  # Remove the uploaded entry from the scheduled uploads
-                    time.sleep(0.5)
-                sched = [{}]
+                    if not sched:
+                        sched = [{}]
+                    elif not uploads:
+                        time.sleep(0.5)
             except:
-                while True:
-                    if len(sched) > 48:
-                        sched.pop(0)  # Cache http requests for 48 hours
-                    else:
-                        break
-            updateRTC(ntp)
+                sched[-1]["tried"] = True
+                if uploads:
+                    uploads.failed += 1
+            if snapshot:
+                snapshot.save_outbox(sched)
+            if not clock and ("time" not in sched[-1] or sched[-1]["tried"]):
+                updateRTC()
+        if timer:
+            timer.mark("upload")
+
+        # Alerts go out as soon as they are raised, not at the upload slot
+        if alerts and alerts.queue and ((mqtt and not mqtt.http) or wlan.isconnected()):
+            alerts.send(sendAlert, time.ticks_ms())
+            if timer:
+                timer.mark("alert")
+
+        # Publish samples and pick up config pushed over MQTT
+        if mqtt and wlan.isconnected():
+            mqtt.service(status_now)
+            if timer:
+                timer.mark("mqtt")
 
         # ----------Hourly log updates and clock maintenance-------------
         if loghour != rtc_dt[4]:
             loghour = rtc_dt[4]
 
+            hour_avg = hourAverages()
+            # Energy used in the hour, as an extra column and upload field
+            energy_col = energy_query = ""
+            if meter:
+                hour_wh = meter.close_hour(loghour)
+                energy_col = "\t" + gbeformat.num(hour_wh, 3)
+                energy_query = "&whh=" + gbeformat.num(hour_wh, 3)
+
             # write hourly log to today's log file
             try:
-                logfile_path = "logs/" + gbeformat.ymd(status_now) + ".txt"
-                if not fileExists(logfile_path):
+                logfile_path = "logs/" + (wall.date if wall else gbeformat.ymd(status_now)) + ".txt"
+                log_head = (
+                    gbeformat.hourlog_head()
+                    + gbeformat.extra_head(extra_keys)
+                    + ("\tWatt hours" if meter else "")
+                    + "\n"
+                )
+                log_line = (
+                    gbeformat.hourlog(status_now, hour_avg)
+                    + gbeformat.extra_log(extra_keys, hour_avg)
+                    + energy_col
+                    + "\n"
+                )
+                if store:
+                    store.append(logfile_path, log_line, log_head)  # Written with the next flush
+                else:
+                    if not fileExists(logfile_path):
+                        log_line = log_head + log_line
                     logfile = open(logfile_path, "a")
-                    logfile.write(gbeformat.hourlog_head() + "\n")
+                    logfile.write(log_line)
                     logfile.close()
-                logfile = open(logfile_path, "a")
-                logfile.write(gbeformat.hourlog(status_now, log_avg) + "\n")
-                logfile.close()
-            except:
+                    if log_index:
+                        log_index.wrote(logfile_path, log_line)
+            except Exception as e:
                 print("Error saving the log file:", e)
 
-            # Schedule log upload and clock update for a random time in the next two minutes
-            # to avoid having all devices hit the GBE and NTP servers at the same time
-            # Use a list to cache http requests in RAM in case wifi is down temporarily
-            if "time" in sched[-1]:
-                sched.append({})
-            sched[-1]["time"] = time.time() + random.randint(0, 120)
-            sched[-1]["url"] = gbeformat.url_query(status_now, log_avg)
-            sched[-1]["tried"] = False
+            # Send the hourly record over MQTT, queued on flash if the broker is down
+            if mqtt:
+                mqtt.log(gbeformat.url_query(status_now, hour_avg) + energy_query)
+                if not mqtt.http and not clock:
+                    updateRTC()
 
-            cleanLogs(30)  # Remove old log files, keeping 30
+            # Schedule log upload and clock update for this box's slot in the hour (or a
+            # random time in the next two minutes without the uplink library) to avoid
+            # having all devices hit the GBE and NTP servers at the same time
+            # Use a list to cache http requests in RAM in case wifi is down temporarily
+            if not mqtt or mqtt.http:
+                if "time" in sched[-1]:
+                    sched.append({})
+                if uploads:
+                    sched[-1]["time"] = uploads.due(localTime())
+                else:
+                    sched[-1]["time"] = localTime() + random.randint(0, 120)
+                sched[-1]["url"] = gbeformat.url_query(status_now, hour_avg) + energy_query
+                sched[-1]["tried"] = False
+                while len(sched) > 48:
+                    sched.pop(0)  # Cache http requests for 48 hours
+
+            if log_index:
+                log_index.retain()  # Remove the oldest log files over the budget
+            else:
+                cleanLogs(30)  # Remove old log files, keeping 30
+            writeDiag(status_now)  # Loop timing, heap and I2C figures for the past hour
+            if diag_index:
+                diag_index.retain()
+            else:
+                cleanLogs(30, "diag")
+            if store:
+                store.save()  # Flash wear totals
 
             for idx, dic in enumerate(log_avg):
                 log_avg[dic] = 0  # Reset running averages
+                log_cnt[dic] = 0
+            if snapshot:
+                snapshot.save(log_avg, loghour, True, log_cnt)
+                snapshot.save_outbox(sched)
+            if timer:
+                timer.mark("hourly")
+
+        # Write the gathered log, diagnostics and queue text when enough has built up
+        if store:
+            store.service(time.ticks_ms())
+            if timer:
+                timer.mark("flush")
 
         if wlan.isconnected():
             pulseLED("blue")  # Pulse status LED
         else:
             pulseLED("white")
-
+        if timer:
+            timer.mark("led")
+
+        if sensors:
+            sensors.service()  # Look again for missing I2C devices when due
+        if timer:
+            timer.mark("probe")
+
+        closeBusCycles()  # Close I2C accounting for this loop
+        if shell:
+            shell.poll()  # Run any command typed into the shell
+        if link:
+            link.service()  # Send the next part of a log transfer
+        if timer:
+            timer.mark("console")
+            timer.end()
+
+    except KeyboardInterrupt:  # Stopped from the console: keep what is pending
+        stopProgram()
+        raise
     except Exception as e:  # Catch-all error handler
         print("Failed Main Loop! Trying again: ", e)
 
-    time.sleep(2)  # Wait few seconds before repeating
+    try:
+        if heap:
+            heap.idle()  # Collect garbage here rather than inside a stage
+        if clock:  # Wait few seconds before repeating, keeping the clock meanwhile
+            idleBuses(True)
+            clock.idle(2000, wlan.isconnected(), config["time zone"]["GMT offset"])
+            idleBuses(False)
+            if wall:
+                wall.sync(clock)  # Take the RTC phase timesync has measured
+        elif wall:
+            wall.idle(2000)  # Wait, finding where RTC seconds start meanwhile
+        else:
+            time.sleep(2)  # Wait few seconds before repeating
+    except KeyboardInterrupt:  # Most of the time is spent waiting here
+        stopProgram()
+        raise
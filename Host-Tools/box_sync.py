@@ -0,0 +1,255 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Copy the daily log and diag files off many boxes over USB while they run.
+
+Each box answers requests on its USB console (lib/serialsync.py) without
+stopping its program. Files go into a directory per box, named after its
+board ID, in the layout fleet_logs.py reads:
+
+    python box_sync.py /dev/ttyACM0 /dev/ttyACM1 --out fleet
+    python box_sync.py /dev/ttyACM* --out fleet --jobs 8
+    python box_sync.py /tmp/box0 --out fleet       # python -m gbesim --pty /tmp/box0
+
+    fleet/e6614104033f7a2d/logs/2024-05-01.txt
+    fleet/e6614104033f7a2d/diag/2024-05-01.txt
+
+For each folder the box lists its files from the newest one already here
+on, with their sizes and CRCs. The first that differs is fetched from
+where the local copy ends, provided the local copy is the start of the
+box's file, and the files after it in full. So a second run fetches only
+what has been logged since the first, and a run that was cut off, or a
+frame that was lost, carries on from the last byte written. Every frame
+and every complete file is checked against its CRC32.
+"""
+
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+import zlib
+
+from gbeserial import SEGMENT, FrameReader, SerialPort, request
+
+FOLDERS = ("logs", "diag")
+EXT = ".txt"
+DATA = struct.Struct("<10sI")
+DONE = struct.Struct("<HI")
+
+
+class SyncError(Exception):
+    pass
+
+
+def file_crc(path):
+    # (size, CRC32) of a local file, (0, 0) if there is none
+    crc = 0
+    size = 0
+    try:
+        with open(path, "rb") as file:
+            while True:
+                data = file.read(65536)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+    except FileNotFoundError:
+        pass
+    return size, crc
+
+
+def local_dates(folder):
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len(EXT)] for name in names if name.endswith(EXT) and name[:4].isdigit())
+
+
+class Box:
+    """One box on one serial port."""
+
+    def __init__(self, path, out, timeout, retries, verbose=False):
+        self.path = path
+        self.out = out
+        self.timeout = timeout
+        self.retries = retries
+        self.verbose = verbose
+        self.port = None
+        self.reader = FrameReader()
+        self.frames = []
+        self.seq = 0
+        self.board_id = None
+        self.files = 0
+        self.bytes = 0
+        self.resumed = 0
+
+    async def _frame(self, seq):
+        # The next frame answering request seq; text lines are skipped
+        deadline = time.monotonic() + self.timeout
+        while True:
+            while self.frames:
+                kind, fseq, payload = self.frames.pop(0)
+                if kind is None:
+                    if self.verbose:
+                        print("%s: %s" % (self.path, payload), file=sys.stderr)
+                elif fseq == seq:
+                    if kind == "X":
+                        raise SyncError(payload.decode("utf-8", "replace"))
+                    return kind, payload
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise asyncio.TimeoutError
+            data = await self.port.read(left)
+            if not data:
+                raise SyncError("port closed")
+            self.frames.extend(self.reader.feed(data))
+
+    async def _ask(self, *words):
+        self.seq = (self.seq + 1) & 255
+        self.frames = []
+        await self.port.write(request(self.seq, *words))
+        return self.seq
+
+    async def _call(self, kind, *words):
+        # A request with a single reply, asked again if none comes
+        for attempt in range(self.retries + 1):
+            seq = await self._ask(kind, *words)
+            try:
+                reply, payload = await self._frame(seq)
+            except asyncio.TimeoutError:
+                continue
+            if reply == kind:
+                return payload
+        raise SyncError("no answer to " + kind)
+
+    async def run(self):
+        self.port = SerialPort(self.path)
+        try:
+            info = (await self._call("I")).decode().split("\t")
+            self.board_id = info[0]
+            folders = [name for name in info[2].split(",") if name in FOLDERS] if len(info) > 2 else []
+            for folder in folders:
+                await self._folder(folder, os.path.join(self.out, self.board_id, folder))
+        finally:
+            if not self.port.closed:
+                await self.port.write(request(self.seq + 1, "C"))
+                self.port.close()
+
+    async def _folder(self, folder, local):
+        os.makedirs(local, exist_ok=True)
+        for attempt in range(self.retries + 1):
+            have = local_dates(local)
+            listed = await self._call("L", folder, *have[-1:])
+            segments = []
+            for i in range(0, len(listed) - SEGMENT.size + 1, SEGMENT.size):
+                date, size, crc = SEGMENT.unpack_from(listed, i)
+                segments.append((date.decode(), size, crc))
+            start = None
+            for date, size, crc in segments:
+                if file_crc(os.path.join(local, date + EXT)) != (size, crc):
+                    start = date
+                    break
+            if start is None:
+                return  # Up to date
+            try:
+                await self._fetch(folder, local, start)
+                return
+            except (asyncio.TimeoutError, SyncError) as e:
+                if str(e) == "port closed":
+                    raise
+                self.resumed += 1
+                if self.verbose:
+                    print("%s: %s %s, resuming" % (self.path, folder, e or "timed out"), file=sys.stderr)
+        raise SyncError("gave up on " + folder)
+
+    async def _fetch(self, folder, local, date):
+        path = os.path.join(local, date + EXT)
+        size, crc = file_crc(path)
+        seq = await self._ask("S", folder, date, size, "%08x" % crc)
+        file = None
+        try:
+            while True:
+                kind, payload = await self._frame(seq)
+                if kind == "D":
+                    name, offset = DATA.unpack_from(payload)
+                    name = name.decode()
+                    path = os.path.join(local, name + EXT)
+                    if file is None or file.name != path:
+                        if file:
+                            file.close()
+                        file = open(path, "r+b" if os.path.exists(path) else "wb")
+                    if offset == 0:
+                        file.truncate(0)
+                    elif offset != file.seek(0, os.SEEK_END):
+                        raise SyncError("lost data in " + name)  # A dropped frame
+                    file.seek(offset)
+                    file.write(payload[DATA.size:])
+                    self.bytes += len(payload) - DATA.size
+                elif kind == "E":
+                    name, size, crc = SEGMENT.unpack(payload)
+                    name = name.decode()
+                    if file:
+                        file.close()
+                        file = None
+                    if file_crc(os.path.join(local, name + EXT)) != (size, crc):
+                        os.remove(os.path.join(local, name + EXT))
+                        raise SyncError("CRC mismatch in " + name)
+                    self.files += 1
+                elif kind == "Z":
+                    return DONE.unpack(payload)
+        finally:
+            if file:
+                file.close()
+
+
+async def sync_all(paths, args):
+    limit = asyncio.Semaphore(args.jobs)
+
+    async def one(path):
+        async with limit:
+            box = Box(path, args.out, args.timeout, args.retries, args.verbose)
+            start = time.monotonic()
+            try:
+                await box.run()
+                error = None
+            except (OSError, SyncError, asyncio.TimeoutError) as e:
+                error = str(e) or "timed out"
+            return box, error, time.monotonic() - start
+
+    return await asyncio.gather(*[one(path) for path in paths])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy log files off boxes over USB.")
+    parser.add_argument("ports", nargs="+", help="serial devices of the boxes")
+    parser.add_argument("--out", default="fleet", help="directory for the boxes' files (default fleet)")
+    parser.add_argument("--jobs", type=int, default=16, help="boxes synced at once (default 16)")
+    parser.add_argument("--timeout", type=float, default=5,
+                        help="seconds to wait for a frame before asking again (default 5)")
+    parser.add_argument("--retries", type=int, default=3, help="times to ask again (default 3)")
+    parser.add_argument("--verbose", action="store_true", help="print the boxes' console output")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(sync_all(args.ports, args))
+    failed = 0
+    for box, error, seconds in results:
+        line = "%s %s: %d files, %.1f KB in %.1f s" % (
+            box.path, box.board_id or "?", box.files, box.bytes / 1024, seconds)
+        if box.resumed:
+            line += ", resumed %d times" % box.resumed
+        if box.reader.bad:
+            line += ", %d bad frames" % box.reader.bad
+        if error:
+            line += ", failed: " + error
+            failed += 1
+        print(line)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
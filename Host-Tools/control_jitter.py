@@ -0,0 +1,140 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Compare lights and fan control jitter with and without core 1.
+
+The unmodified main.py runs twice in the simulator under the same heavy
+network load: a wifi outage builds up a backlog of hourly uploads, and
+every request to the cloud takes --latency seconds. The first run keeps
+the lights and fan in the main loop ("dual core": false), the second runs
+them on core 1 (lib/dualcore.py). Both record how late each control pass
+came against the control period in the loop timer's "jitter" stage, which
+is read back from the hourly diag records:
+
+    python control_jitter.py                          # 6 hours, 2 h outage
+    python control_jitter.py --latency 8 --max-ms 60  # fail if core 1 is late
+
+The simulated core 1 always wakes on time unless core 0 is writing flash
+(which pauses it, as on the rp2 port), so the figures show the effect of
+the split rather than the last millisecond of a real board; the same diag
+fields give the figures on hardware.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+from gbesim import Simulation
+
+STAGES = ("jitter", "upload", "loop")
+
+
+def parse_stages(entries):
+    # {name: [min, p50, p99, max, overruns, count]} for the stages of interest
+    # from "name=min/p50/p99/max/overruns/count" entries
+    stages = {}
+    for entry in entries:
+        name, _, values = entry.partition("=")
+        if name in STAGES:
+            stages[name] = [float(value) for value in values.split("/")]
+    return stages
+
+
+def collect(root, timer):
+    # Hourly diag figures plus the unfinished hour still in the loop timer
+    hours = []
+    diag = os.path.join(root, "diag")
+    for name in sorted(os.listdir(diag)) if os.path.isdir(diag) else []:
+        with open(os.path.join(diag, name)) as diag_file:
+            for line in diag_file:
+                hours.append(parse_stages(line.rstrip("\n").split("\t")[1:]))
+    if timer is not None:
+        hours.append(parse_stages(timer.report()))
+    return hours
+
+
+def summarise(hours, stage):
+    rows = [hour[stage] for hour in hours if stage in hour and hour[stage][5]]
+    if not rows:
+        return None
+    return {
+        "count": int(sum(row[5] for row in rows)),
+        "p50": max(row[1] for row in rows),
+        "p99": max(row[2] for row in rows),
+        "max": max(row[3] for row in rows),
+        "over": int(sum(row[4] for row in rows)),
+    }
+
+
+def run(dual, args, outages):
+    sim = Simulation(
+        duration=args.hours * 3600,
+        start=args.start,
+        outages=outages,
+        latency=args.latency,
+        device_settings={"control": {"dual core": dual, "period ms": args.period}},
+    )
+    result = sim.run()
+    timer = sim.sandbox.namespace.get("timer") if sim.sandbox else None
+    hours = collect(sim.root, timer)
+    shutil.rmtree(sim.root, ignore_errors=True)
+    if result["outcome"] != "completed":
+        print(result["error"] or result["outcome"])
+        return None
+    return {stage: summarise(hours, stage) for stage in STAGES}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Control jitter with and without core 1.")
+    parser.add_argument("--hours", type=float, default=6, help="simulated hours per run")
+    parser.add_argument("--start", default="2024-05-01T12:00:00", help="UTC start time")
+    parser.add_argument("--outage", default="1:2", metavar="START:HOURS",
+                        help="wifi outage that builds the upload backlog, in hours")
+    parser.add_argument("--latency", type=float, default=4.0,
+                        help="seconds each HTTP request takes")
+    parser.add_argument("--period", type=int, default=100, help="control period in ms")
+    parser.add_argument("--max-ms", type=float,
+                        help="fail if a core 1 control pass is later than this")
+    parser.add_argument("--json", action="store_true", help="print the figures as JSON")
+    args = parser.parse_args(argv)
+
+    date, clock = args.start.split("T")
+    args.start = tuple(int(x) for x in date.split("-")) + tuple(int(x) for x in clock.split(":"))
+    start, length = (float(part) for part in args.outage.split(":"))
+    outages = [(start * 3600, (start + length) * 3600)] if length else []
+
+    results = {}
+    for label, dual in (("main loop", False), ("core 1", True)):
+        figures = run(dual, args, outages)
+        if figures is None:
+            return 1
+        results[label] = figures
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("Control lateness against a %d ms period, %g s per HTTP request (ms)"
+              % (args.period, args.latency))
+        print("%-10s %9s %9s %9s %10s %6s %13s" % (
+            "control", "passes", "p50", "p99", "max", "over", "upload max"))
+        for label, figures in results.items():
+            jitter = figures["jitter"] or {"count": 0, "p50": 0, "p99": 0, "max": 0, "over": 0}
+            upload = figures["upload"] or {"max": 0}
+            print("%-10s %9d %9.1f %9.1f %10.1f %6d %13.1f" % (
+                label, jitter["count"], jitter["p50"], jitter["p99"], jitter["max"],
+                jitter["over"], upload["max"]))
+        print("p50 and p99 are the worst hour's; over counts passes later than the budget")
+
+    core1 = results["core 1"]["jitter"]
+    if args.max_ms is not None and (core1 is None or core1["max"] > args.max_ms):
+        print("\nCore 1 control was late by more than %g ms" % args.max_ms)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Cost and accuracy of the energy meter at different timer rates.
+
+The unmodified main.py runs in the simulator once with the energy meter
+off, where the hour's energy can only be taken from the hourly average
+watts, and then once for each --rates value with lib/energy.py reading the
+INA219 on a timer. A fan stall and an LED driver fault partway through
+make the load change within the hour. Each run reports the timer
+callbacks, the I2C reads, the time spent in the callback and its share of
+the CPU, and the energy counted against the energy the simulated panel
+and fan really used:
+
+    python energy_bench.py                     # 20 Hz and the off run
+    python energy_bench.py --rates 5,20,50 --json
+    python energy_bench.py --reset 2.2 --max-error 2
+
+--reset cuts the power that many hours into each run, so the meter has
+to carry on from the totals it saved to /energy.json; 2.2 hours lands
+two saves after an hour's end, before the storage library's next flush.
+With --max-error the exit status is 1 if a metered run's energy is
+further out than that many percent.
+
+The simulated callback time is the I2C bus time of its reads; on a box,
+the same figures are in the "energy=" diag record and the "energy"
+console command.
+"""
+
+import argparse
+import json
+import shutil
+import sys
+
+from gbesim import Simulation
+
+
+def hourly_watts(entries):
+    # Energy from the hourly log's average watts, as before the meter
+    total = 0.0
+    for entry in entries:
+        fields = entry.split("\t")
+        if len(fields) > 8 and fields[8]:
+            total += float(fields[8])
+    return total
+
+
+def run(rate, args):
+    sim = Simulation(
+        duration=args.hours * 3600,
+        start=args.start,
+        device_settings={"energy": {"enabled": rate is not None, "rate hz": rate or 20}},
+    )
+    sim.fault_at(args.hours * 1800 + 600, "fan", 900)
+    sim.fault_at(args.hours * 1800 + 1800, "green", 1800)
+    if args.reset is not None:
+        sim.reset_at(args.reset * 3600)
+    result = sim.run()
+    meter = sim.sandbox.namespace.get("meter") if sim.sandbox else None
+    entries = sim.log_entries()
+    shutil.rmtree(sim.root, ignore_errors=True)
+    if result["outcome"] != "completed":
+        print(result["error"] or result["outcome"])
+        return None
+    figures = {"actual_wh": result["energy_wh"], "wall_seconds": result["wall_seconds"]}
+    if meter is None:
+        # Only whole hours are logged; compare with what the panel used in them
+        figures["counted_wh"] = hourly_watts(entries)
+        figures["actual_wh"] = sim.world.energy_wh * len(entries) / args.hours
+        figures.update(callbacks=0, reads=0, mean_us=0, max_us=0, cpu_pct=0.0)
+    else:
+        figures["counted_wh"] = meter.total_wh
+        figures.update(
+            callbacks=meter.ticks,
+            reads=meter.reads,
+            mean_us=meter.busy_us // meter.ticks if meter.ticks else 0,
+            max_us=meter.busy_max,
+            cpu_pct=meter.cpu(),
+            late=meter.late,
+        )
+    actual = figures["actual_wh"]
+    figures["error_pct"] = 100 * (figures["counted_wh"] - actual) / actual if actual else 0.0
+    return figures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Energy meter cost and accuracy.")
+    parser.add_argument("--hours", type=float, default=4, help="simulated hours per run")
+    parser.add_argument("--start", default="2024-05-01T12:00:00", help="UTC start time")
+    parser.add_argument("--rates", default="20", help="comma separated timer rates in Hz")
+    parser.add_argument("--reset", type=float, help="cut the power this many hours in")
+    parser.add_argument("--max-error", type=float, help="fail if a metered run is further out, in %%")
+    parser.add_argument("--json", action="store_true", help="print the figures as JSON")
+    args = parser.parse_args(argv)
+
+    date, clock = args.start.split("T")
+    args.start = tuple(int(x) for x in date.split("-")) + tuple(int(x) for x in clock.split(":"))
+
+    results = {}
+    for rate in [None] + [float(r) for r in args.rates.split(",")]:
+        figures = run(rate, args)
+        if figures is None:
+            return 1
+        results["off" if rate is None else "%g Hz" % rate] = figures
+
+    failed = args.max_error is not None and any(
+        abs(figures["error_pct"]) > args.max_error
+        for label, figures in results.items() if label != "off")
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 1 if failed else 0
+    print("%-8s %9s %9s %8s %8s %7s %10s %10s %8s" % (
+        "meter", "callbacks", "reads", "mean us", "max us", "cpu %", "counted Wh", "actual Wh",
+        "error %"))
+    for label, figures in results.items():
+        print("%-8s %9d %9d %8d %8d %7.2f %10.3f %10.3f %8.2f" % (
+            label, figures["callbacks"], figures["reads"], figures["mean_us"],
+            figures["max_us"], figures["cpu_pct"], figures["counted_wh"],
+            figures["actual_wh"], figures["error_pct"]))
+    print("off counts the logged hours from their average watts, against a pro rata actual")
+    if failed:
+        print("Energy counted more than %g%% out" % args.max_error)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Load generator that plays back many boxes' upload pattern against a server.
+
+Each virtual box behaves like main.py:
+
+  * it calls phonehome.php once when it starts (boxes start over
+    --boot-spread seconds)
+  * when its clock passes the hour it queues the hour's record and uploads
+    it at its slot in the hour, on its next loop pass. The slot comes from
+    the server's reply ("upload" in lib/uplink.py), or else from a hash of
+    the board ID
+  * while its wifi is down records pile up, up to 48; at the next upload
+    the backlog is sent as fast as the server's rate and burst allow, a
+    few per loop pass, stopping at the first failure
+  * each request is a new HTTP/1.0 connection, as with urequests
+
+--legacy plays back the firmware before upload slots instead: each upload
+at a random time up to two minutes after the hour, and a backlog sent all
+at once, half a second apart.
+
+Box clocks are off by a normally distributed amount (--skew seconds) so
+the hour does not turn at the same instant everywhere. Outages hit each
+box at random (--outage-rate per box per hour, lasting up to
+--outage-max minutes), or the whole fleet at once (--fleet-outage
+START:MINUTES, e.g. the school network going down). --speed runs the
+fleet's clock faster than real time, which multiplies the request rate
+by the same factor.
+
+    python fleet_load.py http://127.0.0.1:8080 --boxes 2000 --hours 3 --speed 60
+    python fleet_load.py http://127.0.0.1:8080 --boxes 500 --fleet-outage 0.5:90
+    python fleet_load.py http://127.0.0.1:8080 --boxes 2000 --hours 3 --speed 60 --legacy
+
+At the end it prints request counts by result, latency percentiles, the
+most requests in flight at once and the busiest second.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "Control-Box_RPi-Pico-W-Filesystem", "lib"))
+
+import gbeformat  # noqa: E402  (the firmware's own upload format)
+import uplink  # noqa: E402  (and its upload slots)
+
+SOFTWARE_DATE = "2023-02-16"
+LOOP_SECONDS = 4.3  # One pass of the main loop
+BACKLOG = 48  # main.py keeps this many hourly records while offline
+GAP_SECONDS = 0.5  # Pause between backlog uploads before upload slots
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.results = {}
+        self.in_flight = 0
+        self.peak = 0
+        self.per_second = {}
+        self.per_minute = {}  # Requests started in each minute of fleet time
+        self.flushes = []  # Backlog sizes sent at once
+        self.offline = 0  # Uploads a box skipped because its wifi was down
+
+    def count(self, result):
+        self.results[result] = self.results.get(result, 0) + 1
+
+
+class Fleet:
+    def __init__(self, args):
+        self.args = args
+        url = urlsplit(args.url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.base = url.path.rstrip("/")
+        self.rng = random.Random(args.seed)
+        self.stats = Stats()
+        self.start = time.monotonic()
+        self.epoch = time.time()
+        start, _, minutes = (args.fleet_outage or "0:0").partition(":")
+        self.fleet_down = (float(start) * 3600, float(start) * 3600 + float(minutes) * 60)
+
+    # Fleet time: seconds since the run started, sped up by --speed
+    def now(self):
+        return (time.monotonic() - self.start) * self.args.speed
+
+    async def sleep_until(self, when):
+        wait = (when - self.now()) / self.args.speed
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def get(self, path):
+        # One urequests-style GET; returns a result label and the parsed reply
+        stats = self.stats
+        stats.in_flight += 1
+        stats.peak = max(stats.peak, stats.in_flight)
+        second = int(time.monotonic() - self.start)
+        stats.per_second[second] = stats.per_second.get(second, 0) + 1
+        minute = int(self.now() // 60)
+        stats.per_minute[minute] = stats.per_minute.get(minute, 0) + 1
+        started = time.monotonic()
+        writer = None
+        reply = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.args.timeout)
+            writer.write(("GET %s HTTP/1.0\r\nHost: %s\r\n\r\n" % (self.base + path, self.host)).encode())
+            response = await asyncio.wait_for(reader.read(), self.args.timeout)
+            head, _, body = response.partition(b"\r\n\r\n")
+            status = int(head.split(None, 2)[1]) if head else 0
+            if status == 200:
+                reply = json.loads(body)  # The box fails if the reply is not JSON
+                result = "ok"
+            else:
+                result = "http %d" % status
+        except asyncio.TimeoutError:
+            result = "timeout"
+        except (OSError, ValueError, IndexError) as e:
+            result = type(e).__name__
+        finally:
+            if writer is not None:
+                writer.close()
+            stats.in_flight -= 1
+        stats.latencies.append(time.monotonic() - started)
+        stats.count(result)
+        return result, reply
+
+    def record(self, board_id, when):
+        # The hourly record a box would send for the hour ending at when
+        t = time.gmtime(self.epoch + when)
+        rng = self.rng
+        lit = 7 <= t.tm_hour < 19
+        stat = {
+            "boa": board_id, "sof": SOFTWARE_DATE,
+            "yea": t.tm_year, "mon": t.tm_mon, "day": t.tm_mday, "hou": t.tm_hour, "min": t.tm_min,
+            "con": "07:00", "cof": "19:00", "cf0": 128, "cf1": 255,
+            "cre": 72, "cgr": 60, "cbl": 52, "cwh": 44, "ctz": -5,
+        }
+        avg = {
+            "red": 72 * lit, "gre": 60 * lit, "blu": 52 * lit, "whi": 44 * lit,
+            "vol": 24.0, "mam": 426 if lit else 50, "wat": 10.23 if lit else 1.2,
+            "fan": 255 if lit else 128, "rpm": rng.gauss(3000 if lit else 1500, 20),
+            "tem": rng.gauss(23, 1), "hum": rng.gauss(55, 3), "sst": rng.gauss(22, 1),
+            "ssm": rng.randint(600, 900),
+        }
+        return gbeformat.url_query(stat, avg)
+
+    def outages(self, rng):
+        # This box's own outages over the run, as (start, end) fleet times
+        out = []
+        hours = int(math.ceil(self.args.hours))
+        for hour in range(hours):
+            if rng.random() < self.args.outage_rate:
+                start = (hour + rng.random()) * 3600
+                out.append((start, start + rng.uniform(1, self.args.outage_max) * 60))
+        return out
+
+    async def box(self, index):
+        rng = random.Random(self.args.seed * 100003 + index)
+        board_id = "%016x" % rng.getrandbits(64)
+        skew = rng.gauss(0, self.args.skew)
+        own = self.outages(rng)
+        end = self.args.hours * 3600
+
+        def online(at):
+            if self.fleet_down[0] <= at < self.fleet_down[1]:
+                return False
+            return not any(start <= at < stop for start, stop in own)
+
+        # Upload slot and backlog pacing, as lib/uplink.py keeps them
+        plan = uplink.Uplink(board_id)
+        await self.sleep_until(rng.uniform(0, self.args.boot_spread))
+        if online(self.now()):
+            _, reply = await self.get("/phonehome.php?boa=%s&mac=28:cd:c1:%02x:%02x:%02x&sof=%s" % (
+                board_id, rng.randrange(256), rng.randrange(256), rng.randrange(256), SOFTWARE_DATE))
+            plan.assign(reply)
+
+        sched = []
+        tried = False
+        due = None
+        flush = 0
+        last = self.now()
+        while True:
+            # Next turn of the hour on this box's clock, seen on its next loop pass
+            hour_start = math.floor((self.now() + skew) / 3600) * 3600 - skew
+            hour_end = hour_start + 3600 + rng.uniform(0, LOOP_SECONDS)
+            if due is not None and not tried and due < hour_end:
+                await self.sleep_until(due)
+                due = None
+                if not online(self.now()):
+                    tried = True
+                    self.stats.offline += 1
+                    continue
+                now = self.now()
+                plan.tokens = min(plan.burst, plan.tokens + (now - last) * plan.rate)
+                last = now
+                while sched:
+                    if not self.args.legacy:
+                        if plan.tokens < 1:
+                            due = self.now() + LOOP_SECONDS  # The rest on the next pass
+                            break
+                        plan.tokens -= 1
+                    result, reply = await self.get("/log.php?" + sched[0])
+                    if result != "ok":
+                        tried = True
+                        break
+                    plan.assign(reply)
+                    sched.pop(0)
+                    flush += 1
+                    if self.args.legacy and sched:
+                        await self.sleep_until(self.now() + GAP_SECONDS)
+                if not sched or tried:
+                    if flush > 1:
+                        self.stats.flushes.append(flush)
+                    flush = 0
+                continue
+            if hour_end >= end:
+                return
+            await self.sleep_until(hour_end)
+            sched.append(self.record(board_id, self.now()))
+            del sched[:-BACKLOG]
+            if flush and not tried:
+                continue  # Still sending a backlog; the new record joins it
+            tried = False
+            if self.args.legacy:
+                due = self.now() + rng.randint(0, 120)
+            else:
+                due = max(self.now(), hour_start + 3600 + plan.slot)
+            due += rng.uniform(0, LOOP_SECONDS)
+
+    async def run(self):
+        await asyncio.gather(*(self.box(idx) for idx in range(self.args.boxes)))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(len(ordered) * pct / 100)) - 1)]
+
+
+def report(fleet, wall):
+    stats = fleet.stats
+    lat = stats.latencies
+    busiest = max(stats.per_second.items(), key=lambda item: item[1]) if stats.per_second else (0, 0)
+    figures = {
+        "boxes": fleet.args.boxes,
+        "fleet_hours": fleet.args.hours,
+        "wall_seconds": round(wall, 1),
+        "requests": len(lat),
+        "results": stats.results,
+        "latency_ms": {
+            name: round(percentile(lat, pct) * 1000, 1)
+            for name, pct in (("p50", 50), ("p90", 90), ("p99", 99), ("p99.9", 99.9), ("max", 100))
+        },
+        "peak_in_flight": stats.peak,
+        "busiest_second": {"at": busiest[0], "requests": busiest[1]},
+        "busiest_fleet_minute": max(stats.per_minute.values()) if stats.per_minute else 0,
+        "mean_rate": round(len(lat) / wall, 1) if wall else 0,
+        "skipped_offline": stats.offline,
+        "backlog_flushes": len(stats.flushes),
+        "largest_flush": max(stats.flushes) if stats.flushes else 0,
+    }
+    return figures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play back the upload pattern of many boxes.")
+    parser.add_argument("url", help="server base URL, e.g. http://127.0.0.1:8080")
+    parser.add_argument("--boxes", type=int, default=100)
+    parser.add_argument("--hours", type=float, default=2, help="fleet hours to run")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="run the fleet clock this many times faster than real time")
+    parser.add_argument("--skew", type=float, default=30, help="clock error spread, seconds")
+    parser.add_argument("--boot-spread", type=float, default=600,
+                        help="boxes start within this many seconds")
+    parser.add_argument("--outage-rate", type=float, default=0.02,
+                        help="chance per box per hour of a wifi outage")
+    parser.add_argument("--outage-max", type=float, default=180, help="longest outage, minutes")
+    parser.add_argument("--fleet-outage", metavar="START:MINUTES",
+                        help="every box offline from START hours for MINUTES")
+    parser.add_argument("--timeout", type=float, default=30, help="request timeout, seconds")
+    parser.add_argument("--legacy", action="store_true",
+                        help="uploads within two minutes of the hour, backlogs all at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the figures as JSON")
+    args = parser.parse_args(argv)
+
+    fleet = Fleet(args)
+    started = time.monotonic()
+    try:
+        asyncio.run(fleet.run())
+    except KeyboardInterrupt:
+        pass
+    figures = report(fleet, time.monotonic() - started)
+    if args.json:
+        print(json.dumps(figures, indent=2))
+        return 0
+    print("%d boxes, %g fleet hours in %.0f s" % (args.boxes, args.hours, figures["wall_seconds"]))
+    print("requests      %d (%s)" % (figures["requests"], ", ".join(
+        "%s %d" % item for item in sorted(figures["results"].items()))))
+    print("latency ms    " + "  ".join("%s %s" % item for item in figures["latency_ms"].items()))
+    print("in flight     peak %d" % figures["peak_in_flight"])
+    print("rate          mean %.1f/s, busiest second %d requests (%d s in), busiest fleet minute %d" % (
+        figures["mean_rate"], figures["busiest_second"]["requests"], figures["busiest_second"]["at"],
+        figures["busiest_fleet_minute"]))
+    print("backlogs      %d skipped offline, %d flushes, largest %d records" % (
+        figures["skipped_offline"], figures["backlog_flushes"], figures["largest_flush"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
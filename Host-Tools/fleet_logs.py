@@ -0,0 +1,333 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Per-box, per-day summaries of the hourly logs pulled from many boxes.
+
+Each box keeps one tab-separated file per day in its logs directory, with
+the header from gbeformat.hourlog_head() (plus columns for any extra
+chambers and sensors). Copy each box's files into a directory of its own
+and point this tool at the parent; the box is named after the directory
+(a "logs" directory in between is skipped):
+
+    fleet/box-a/logs/2024-05-01.txt
+    fleet/box-b/2024-05-01.txt
+
+    python fleet_logs.py fleet                     # CSV, one row per box and day
+    python fleet_logs.py fleet --summary           # plus one line per box
+    python fleet_logs.py fleet --jobs 8 --out fleet.csv
+
+Each record is the average of the hour that ends at its time, so an entry
+at 00:00 counts towards the day before. Files are parsed column by column
+into NumPy arrays and boxes are spread over a process pool. Per day the
+CSV has:
+
+    hours             hourly records present (24 for a full day)
+    light_h           hours of light, as a fraction of the set brightness
+    expected_light_h  hours the light schedule asks for in the hours present
+    photoperiod_pct   hours whose light on the box's own channels matched the
+                      schedule within --tolerance
+    energy_wh         LED panel energy from the hourly average watts, every
+                      chamber with a current sensor included, or from the
+                      "Watt hours" column where the box's energy meter
+                      logged one
+    fan_on_h          hours with the fan running
+    rpm_per_duty      fan RPM per unit of fan duty (0-255) while running
+    stall_h           hours a fan (any chamber's) was set to run but turned
+                      below --stall-rpm
+    temp_*, hum_mean, soil_mean
+                      sensor figures, missing readings (zero) left out
+
+The light schedule comes from config/gbe_settings.json in the box's
+directory if there is one, otherwise from --config (the firmware's own
+settings by default).
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIRMWARE = os.path.join(os.path.dirname(HERE), "Control-Box_RPi-Pico-W-Filesystem")
+sys.path.insert(0, os.path.join(FIRMWARE, "lib"))
+
+import gbeformat  # noqa: E402  (the firmware's own log format)
+
+HEAD = gbeformat.hourlog_head().split("\t")
+CHANNELS = ("Red", "Green", "Blue", "White")
+CONFIG_KEYS = ("red", "green", "blue", "white")
+MAX_DUTY = (200, 89, 94, 146)  # As in main.py
+
+COUNTS = ("hours", "fan_on_h", "stall_h")
+FIELDS = (
+    "box", "date", "hours", "light_h", "expected_light_h", "photoperiod_pct",
+    "energy_wh", "fan_on_h", "rpm_per_duty", "stall_h",
+    "temp_min", "temp_mean", "temp_max", "hum_mean", "soil_mean",
+)
+
+
+def box_name(path, root):
+    # First directory above the file that is not called "logs"
+    parts = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+    parts = [part for part in parts if part not in ("", ".", "logs")]
+    return parts[-1] if parts else os.path.basename(os.path.abspath(root))
+
+
+def find_logs(paths):
+    # {box: [log files]} from files and directories given on the command line
+    boxes = {}
+    for path in paths:
+        if os.path.isfile(path):
+            root = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+            boxes.setdefault(box_name(os.path.abspath(path), root), []).append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith(".txt") and name[:4].isdigit():
+                    full = os.path.join(dirpath, name)
+                    boxes.setdefault(box_name(full, path), []).append(full)
+    return boxes
+
+
+def read_log(path):
+    # (column names, dates, minutes past midnight, float array rows x columns)
+    with open(path, errors="replace") as logfile:
+        lines = logfile.read().splitlines()
+    names = HEAD
+    rows = []
+    for line in lines:
+        fields = line.split("\t")
+        if fields[0] == "Date":
+            names = fields
+        elif len(fields) == len(names) and len(fields[1]) == 5:
+            rows.append(fields)  # A line cut short by a power cut is skipped
+    if not rows:
+        return names[2:], np.array([], "datetime64[D]"), np.zeros(0, int), np.zeros((0, len(names) - 2))
+    table = np.array(rows)
+    dates = table[:, 0].astype("datetime64[D]")
+    times = np.char.split(table[:, 1], ":")
+    minutes = np.array([int(t[0]) * 60 + int(t[1]) for t in times])
+    values = np.char.strip(table[:, 2:])
+    values = np.where(values == "", "nan", values).astype(float)
+    return names[2:], dates, minutes, values
+
+
+def read_box(files):
+    # All of a box's records, columns aligned by name (missing ones are NaN)
+    parts = [read_log(path) for path in files]
+    names = []
+    for part in parts:
+        names += [name for name in part[0] if name not in names]
+    dates, minutes, blocks = [], [], []
+    for cols, day, mins, values in parts:
+        block = np.full((len(day), len(names)), np.nan)
+        for idx, name in enumerate(cols):
+            block[:, names.index(name)] = values[:, idx]
+        dates.append(day)
+        minutes.append(mins)
+        blocks.append(block)
+    return (names, np.concatenate(dates), np.concatenate(minutes),
+            np.vstack(blocks) if blocks else np.zeros((0, len(names))))
+
+
+def schedule(config):
+    # Lights on and off in minutes past midnight, and the set brightness
+    timer = config["lights"]["timer"]
+    on = [int(x) for x in timer["on"].split(":")]
+    off = [int(x) for x in timer["off"].split(":")]
+    duty = [min(top, config["lights"]["duty"][key]) for key, top in zip(CONFIG_KEYS, MAX_DUTY)]
+    return on[0] * 60 + on[1], off[0] * 60 + off[1], np.array(duty, float)
+
+
+def column(names, values, name):
+    if name in names:
+        return values[:, names.index(name)]
+    return np.full(len(values), np.nan)
+
+
+def present(data):
+    # Zero is what a missing sensor reads
+    return np.where(data == 0, np.nan, data)
+
+
+def group(func, data, index, days, fill=np.nan):
+    # func (np.fmin, np.fmax) of data per day, ignoring NaN
+    out = np.full(days, fill)
+    func.at(out, index, data)
+    return out
+
+
+def nan_mean(data, index, days):
+    ok = ~np.isnan(data)
+    total = np.bincount(index[ok], data[ok], minlength=days)
+    count = np.bincount(index[ok], minlength=days)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def analyse_box(task):
+    box, files, config, tolerance, stall_rpm = task
+    names, dates, minutes, values = read_box(files)
+    if not len(dates):
+        return []
+
+    # Each record closes the hour before its time
+    start = dates.astype("datetime64[m]") + minutes.astype("timedelta64[m]") - np.timedelta64(60, "m")
+    day = start.astype("datetime64[D]")
+    minute = (start - day).astype(int)
+    days, index = np.unique(day, return_inverse=True)
+    count = len(days)
+
+    # Light: how much of the hour the schedule wants lit, and how much was
+    on, off, duty = schedule(config)
+    expected = np.clip(np.minimum(minute + 60, off) - np.maximum(minute, on), 0, 60) / 60
+    lit = np.zeros(len(minute))
+    used = duty > 0
+    if used.any():
+        levels = np.stack([column(names, values, ch) for ch in CHANNELS], axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # Rows with no light columns
+            lit = np.clip(np.nanmean(levels[:, used] / duty[used], axis=1), 0, 1)
+        lit = np.nan_to_num(lit)
+    matched = np.abs(lit - expected) <= tolerance
+
+    watts = np.zeros(len(minute))
+    for idx, name in enumerate(names):
+        if name == "Watts" or name.endswith(" Watts"):
+            watts += np.nan_to_num(values[:, idx])
+    # Boxes with the energy meter log the hour's energy itself; it replaces
+    # the main chamber's average watts where it is there
+    metered = column(names, values, "Watt hours")
+    watts += np.where(np.isnan(metered), 0, metered - np.nan_to_num(column(names, values, "Watts")))
+
+    fan = np.nan_to_num(column(names, values, "Fan"))
+    rpm = np.nan_to_num(column(names, values, "Fan RPM"))
+    running = fan > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.where(running, rpm / fan, np.nan)
+    stalled = np.zeros(len(minute), bool)
+    for name in names:
+        if name == "Fan" or name.endswith(" Fan"):
+            duty = column(names, values, name)
+            speed = column(names, values, name + " RPM")
+            stalled |= (np.nan_to_num(duty) > 0) & (np.nan_to_num(speed) < stall_rpm)
+
+    temp = present(column(names, values, "Temperature"))
+    hum = present(column(names, values, "Humidity"))
+    soil = present(column(names, values, "Soil moisture"))
+
+    hours = np.bincount(index, minlength=count)
+    result = {
+        "hours": hours,
+        "light_h": np.bincount(index, lit, count),
+        "expected_light_h": np.bincount(index, expected, count),
+        "photoperiod_pct": 100 * np.bincount(index, matched, count) / hours,
+        "energy_wh": np.bincount(index, watts, count),
+        "fan_on_h": np.bincount(index, running, count),
+        "rpm_per_duty": nan_mean(ratio, index, count),
+        "stall_h": np.bincount(index, stalled, count),
+        "temp_min": group(np.fmin, temp, index, count),
+        "temp_mean": nan_mean(temp, index, count),
+        "temp_max": group(np.fmax, temp, index, count),
+        "hum_mean": nan_mean(hum, index, count),
+        "soil_mean": nan_mean(soil, index, count),
+    }
+    rows = []
+    for idx in range(count):
+        row = {"box": box, "date": str(days[idx])}
+        for field in FIELDS[2:]:
+            value = result[field][idx]
+            if field in COUNTS:
+                row[field] = int(value)
+            else:
+                row[field] = "" if np.isnan(value) else round(float(value), 2)
+        rows.append(row)
+    return rows
+
+
+def box_config(files, default):
+    # config/gbe_settings.json next to the box's logs, if it was copied too
+    folder = os.path.dirname(files[0])
+    for base in (folder, os.path.dirname(folder)):
+        path = os.path.join(base, "config", "gbe_settings.json")
+        if os.path.exists(path):
+            with open(path) as settings:
+                return json.load(settings)
+    return default
+
+
+def summarise(rows):
+    # One line per box over all its days
+    boxes = {}
+    for row in rows:
+        boxes.setdefault(row["box"], []).append(row)
+    lines = ["%-16s %5s %6s %8s %9s %9s %8s" % (
+        "box", "days", "hours", "photo %", "kWh", "rpm/duty", "stall h")]
+    for box, days in sorted(boxes.items()):
+        hours = sum(day["hours"] for day in days)
+        photo = sum(day["photoperiod_pct"] * day["hours"] for day in days) / max(1, hours)
+        ratios = [day["rpm_per_duty"] for day in days if day["rpm_per_duty"] != ""]
+        lines.append("%-16s %5d %6d %8.1f %9.2f %9s %8d" % (
+            box[:16], len(days), hours, photo,
+            sum(day["energy_wh"] for day in days) / 1000,
+            "%.1f" % (sum(ratios) / len(ratios)) if ratios else "-",
+            sum(day["stall_h"] for day in days)))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise hourly logs from many boxes.")
+    parser.add_argument("paths", nargs="+", help="log files or directories of boxes")
+    parser.add_argument("--config", default=os.path.join(FIRMWARE, "config", "gbe_settings.json"),
+                        help="light schedule for boxes without their own config")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="light fraction an hour may be off the schedule (default 0.1)")
+    parser.add_argument("--stall-rpm", type=float, default=300,
+                        help="fan RPM below which a running fan counts as stalled")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--out", help="write the CSV here instead of to stdout")
+    parser.add_argument("--summary", action="store_true", help="print one line per box")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as settings:
+        default = json.load(settings)
+    boxes = find_logs(args.paths)
+    if not boxes:
+        print("No log files found", file=sys.stderr)
+        return 1
+    tasks = [(box, files, box_config(files, default), args.tolerance, args.stall_rpm)
+             for box, files in sorted(boxes.items())]
+
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    writer = csv.DictWriter(out, FIELDS)
+    writer.writeheader()
+    rows = []
+    if args.jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(args.jobs, len(tasks))) as pool:
+            results = pool.map(analyse_box, tasks, chunksize=max(1, len(tasks) // (4 * args.jobs)))
+            for box_rows in results:
+                writer.writerows(box_rows)
+                rows += box_rows
+    else:
+        for task in tasks:
+            box_rows = analyse_box(task)
+            writer.writerows(box_rows)
+            rows += box_rows
+    if args.out:
+        out.close()
+    if args.summary:
+        print(summarise(rows), file=sys.stderr if not args.out else sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
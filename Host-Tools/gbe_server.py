@@ -0,0 +1,427 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Local stand-in for the GBE cloud's phonehome.php and log.php.
+
+Answers the two requests main.py makes, the same way the cloud does:
+
+    GET /phonehome.php?boa=<board id>&mac=<mac>&sof=<software date>
+        -> {"site_name": ..., "startup_message": ...}
+    GET /log.php?<gbeformat.url_query()>
+        -> the box's gbe_settings.json, which the box applies if valid
+
+    GET /alert.php?boa=<board id>&kin=<fan|led|tem>&sta=<1|0>&val=..&exp=..&dat=..&tim=..
+        -> {"ok": true}, for an alert raised (sta=1) or cleared (sta=0)
+
+The first two replies also carry "upload": {"slot": ..., "rate": ..., "burst": ...},
+the box's upload time in seconds after the hour and the pace for sending a
+backlog (see lib/uplink.py). Slots are handed out in the order boxes are
+first seen, each new one in one of the largest gaps left (golden ratio
+steps), so the fleet's uploads are spread evenly over the hour however many
+boxes there are. --no-slots leaves them out, and boxes fall back to a slot
+from a hash of their board ID.
+
+Every phonehome and hourly record is stored in SQLite (WAL mode). Records
+from all connections go through one writer that inserts them in batches,
+one transaction per batch, and a request is only answered once its batch
+has been committed, so a box never drops a record the server lost. A
+record uploaded again from a box's backlog is ignored.
+
+    python gbe_server.py --port 8080 --db gbe.sqlite
+    python gbe_server.py --configs configs/ --sites sites.json
+
+With --configs, configs/<board id>.json is returned to that box and
+gbe_settings.json from the firmware to the others; files are re-read when
+they change. --sites is a JSON object of board id -> {"site_name": ...,
+"startup_message": ...}. Point a box at the server with
+"cloud": {"url": "http://<host>:8080"} in its device_settings.json.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = os.path.join(
+    os.path.dirname(HERE), "Control-Box_RPi-Pico-W-Filesystem", "config", "gbe_settings.json"
+)
+
+# Fields of gbeformat.url_query(), in order
+LOG_FIELDS = (
+    "boa", "sof", "dat", "tim", "red", "gre", "blu", "whi", "vol", "mam", "wat",
+    "fan", "rpm", "tem", "hum", "sst", "ssm", "con", "cof", "cf0", "cf1",
+    "cre", "cgr", "cbl", "cwh", "ctz",
+)
+TEXT_FIELDS = ("boa", "sof", "dat", "tim", "con", "cof")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boxes (
+    boa TEXT PRIMARY KEY, mac TEXT, sof TEXT,
+    first_seen REAL, last_seen REAL, phonehomes INTEGER DEFAULT 0, uploads INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS logs (
+    %s,
+    extra TEXT, received REAL,
+    UNIQUE (boa, dat, tim)
+);
+CREATE INDEX IF NOT EXISTS logs_received ON logs (received);
+CREATE TABLE IF NOT EXISTS alerts (
+    boa TEXT, kin TEXT, sta INTEGER, val REAL, exp REAL, dat TEXT, tim TEXT, received REAL,
+    UNIQUE (boa, kin, sta, dat, tim)
+);
+""" % ",\n    ".join(
+    "%s %s" % (field, "TEXT" if field in TEXT_FIELDS else "REAL") for field in LOG_FIELDS
+)
+
+INSERT_LOG = "INSERT OR IGNORE INTO logs (%s, extra, received) VALUES (%s)" % (
+    ", ".join(LOG_FIELDS), ", ".join("?" * (len(LOG_FIELDS) + 2))
+)
+INSERT_ALERT = "INSERT OR IGNORE INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+UPSERT_BOX = """
+INSERT INTO boxes (boa, mac, sof, first_seen, last_seen, phonehomes, uploads)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (boa) DO UPDATE SET
+    mac = COALESCE(excluded.mac, mac), sof = COALESCE(excluded.sof, sof),
+    last_seen = excluded.last_seen,
+    phonehomes = phonehomes + excluded.phonehomes, uploads = uploads + excluded.uploads
+"""
+
+GOLDEN = 0.6180339887498949
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           503: "Service Unavailable"}
+
+
+def number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def log_row(query, now):
+    # Values for INSERT_LOG from a log.php query
+    row = []
+    for field in LOG_FIELDS:
+        value = query.get(field)
+        row.append(value if field in TEXT_FIELDS or value is None else number(value))
+    extra = {key: value for key, value in query.items() if key not in LOG_FIELDS}
+    row.append(json.dumps(extra) if extra else None)
+    row.append(now)
+    return row
+
+
+class Store:
+    """SQLite database written by one thread, in batches."""
+
+    def __init__(self, path, batch=500, flush_ms=20):
+        self.path = path
+        self.batch = batch
+        self.flush = flush_ms / 1000
+        self.queue = asyncio.Queue()
+        self.thread = ThreadPoolExecutor(max_workers=1)  # SQLite stays on one thread
+        self.db = None
+        self.rows = 0
+        self.batches = 0
+        self.largest = 0
+
+    def _open(self):
+        self.db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # Survives a server crash, not a power cut
+        self.db.executescript(SCHEMA)
+
+    def _known(self):
+        return [row[0] for row in self.db.execute("SELECT boa FROM boxes ORDER BY first_seen, boa")]
+
+    def _write(self, logs, boxes, alerts):
+        self.db.execute("BEGIN")
+        try:
+            if logs:
+                self.db.executemany(INSERT_LOG, logs)
+            if alerts:
+                self.db.executemany(INSERT_ALERT, alerts)
+            if boxes:
+                self.db.executemany(UPSERT_BOX, boxes)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.thread, self._open)
+        return asyncio.create_task(self._writer())
+
+    async def known(self):
+        # Board IDs already in the database, first seen first
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread, self._known)
+
+    async def put(self, *rows):
+        # Queue ("log", "box" or "alert", values) rows and wait until they are committed
+        done = asyncio.get_running_loop().create_future()
+        for kind, row in rows:
+            self.queue.put_nowait((kind, row, done))
+        await done
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.flush
+            while len(items) < self.batch:
+                if self.queue.empty():
+                    wait = deadline - loop.time()
+                    if wait <= 0:
+                        break
+                    try:
+                        items.append(await asyncio.wait_for(self.queue.get(), wait))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    items.append(self.queue.get_nowait())
+            logs = [row for kind, row, _ in items if kind == "log"]
+            boxes = [row for kind, row, _ in items if kind == "box"]
+            alerts = [row for kind, row, _ in items if kind == "alert"]
+            try:
+                await loop.run_in_executor(self.thread, self._write, logs, boxes, alerts)
+                error = None
+            except Exception as e:
+                error = e
+            for _, _, done in items:
+                if not done.done():
+                    if error is None:
+                        done.set_result(None)
+                    else:
+                        done.set_exception(error)
+            self.rows += len(items)
+            self.batches += 1
+            self.largest = max(self.largest, len(items))
+
+    def close(self):
+        if self.db is not None:
+            self.thread.submit(self.db.close).result()
+        self.thread.shutdown()
+
+
+class Configs:
+    """Config returned to each box, re-read when its file changes."""
+
+    def __init__(self, default, folder=None):
+        self.default = default
+        self.folder = folder
+        self.cache = {}  # path -> (mtime, body)
+
+    def _load(self, path):
+        mtime = os.stat(path).st_mtime
+        cached = self.cache.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as config_file:
+                body = json.dumps(json.load(config_file)).encode()
+            cached = self.cache[path] = (mtime, body)
+        return cached[1]
+
+    def body(self, board_id):
+        if self.folder and board_id:
+            path = os.path.join(self.folder, os.path.basename(board_id) + ".json")
+            if os.path.exists(path):
+                return self._load(path)
+        return self._load(self.default)
+
+
+class Slots:
+    """Upload slot and backlog rate for each box, in the order boxes are first seen."""
+
+    def __init__(self, known, rate=0.2, burst=3, window=3600):
+        self.index = {board_id: idx for idx, board_id in enumerate(known)}
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+
+    def upload(self, board_id):
+        idx = self.index.setdefault(board_id, len(self.index))
+        return {"slot": int(idx * GOLDEN % 1 * self.window), "rate": self.rate, "burst": self.burst}
+
+
+class Server:
+    def __init__(self, store, configs, sites, slots=None, quiet=False):
+        self.store = store
+        self.configs = configs
+        self.sites = sites
+        self.slots = slots
+        self.quiet = quiet
+        self.requests = 0
+        self.open = 0
+        self.peak = 0
+
+    async def handle(self, reader, writer):
+        self.open += 1
+        self.peak = max(self.peak, self.open)
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                parts = request.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self.respond(writer, 400, b"bad request", False)
+                    break
+                method, target, version = parts
+                length = int(headers.get("content-length", 0) or 0)
+                if length:
+                    await reader.readexactly(length)
+                keep = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                        or headers.get("connection", "").lower() == "keep-alive")
+                status, body = await self.route(method, target)
+                await self.respond(writer, status, body, keep)
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.open -= 1
+            writer.close()
+
+    async def respond(self, writer, status, body, keep):
+        ctype = "application/json" if body[:1] in (b"{", b"[") else "text/plain"
+        writer.write(
+            b"HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n"
+            % (status, REASONS[status].encode(), ctype.encode(), len(body),
+               b"keep-alive" if keep else b"close")
+            + body
+        )
+        await writer.drain()
+
+    async def route(self, method, target):
+        self.requests += 1
+        if method != "GET":
+            return 405, b"GET only"
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query, keep_blank_values=True))
+        now = time.time()
+        board_id = query.get("boa")
+        try:
+            if url.path.endswith("/phonehome.php"):
+                if not board_id:
+                    return 400, b"boa missing"
+                await self.store.put(
+                    ("box", (board_id, query.get("mac"), query.get("sof"), now, now, 1, 0)))
+                site = self.sites.get(board_id, {})
+                if not self.quiet:
+                    print("phonehome  %s %s" % (board_id, query.get("sof", "")))
+                reply = {
+                    "site_name": site.get("site_name", "GBE box " + board_id[-4:]),
+                    "startup_message": site.get("startup_message", "Connected to local GBE server"),
+                }
+                if self.slots:
+                    reply["upload"] = self.slots.upload(board_id)
+                return 200, json.dumps(reply).encode()
+            if url.path.endswith("/log.php"):
+                if not board_id or "dat" not in query or "tim" not in query:
+                    return 400, b"boa, dat and tim required"
+                await self.store.put(
+                    ("log", log_row(query, now)),
+                    ("box", (board_id, None, query.get("sof"), now, now, 0, 1)),
+                )
+                if not self.quiet:
+                    print("log        %s %s %s" % (board_id, query["dat"], query["tim"]))
+                body = self.configs.body(board_id)
+                if self.slots and body[:1] == b"{":
+                    # Spliced in rather than parsing and re-encoding the cached config
+                    upload = json.dumps({"upload": self.slots.upload(board_id)}).encode()
+                    body = upload[:-1] + (b", " + body[1:] if body.strip() != b"{}" else b"}")
+                return 200, body
+            if url.path.endswith("/alert.php"):
+                if not board_id or not query.get("kin") or "sta" not in query:
+                    return 400, b"boa, kin and sta required"
+                await self.store.put(("alert", (
+                    board_id, query["kin"], int(number(query["sta"]) or 0),
+                    number(query.get("val", "")), number(query.get("exp", "")),
+                    query.get("dat"), query.get("tim"), now,
+                )))
+                print("alert      %s %s %s val=%s exp=%s %s %s" % (
+                    board_id, query["kin"], "raised" if query["sta"] == "1" else "cleared",
+                    query.get("val", ""), query.get("exp", ""), query.get("dat", ""),
+                    query.get("tim", "")))
+                return 200, b'{"ok": true}'
+        except (sqlite3.Error, OSError) as e:
+            print("error      %s" % e)
+            return 503, b"storage error"
+        return 404, b"not found"
+
+
+async def report(server, store, every):
+    last = 0
+    while True:
+        await asyncio.sleep(every)
+        print("stats      %.0f req/s, %d open (peak %d), %d rows in %d batches (largest %d)" % (
+            (server.requests - last) / every, server.open, server.peak,
+            store.rows, store.batches, store.largest))
+        last = server.requests
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", default="gbe.sqlite", help="SQLite database file")
+    parser.add_argument("--config", default=DEFAULT_CONFIG,
+                        help="gbe_settings.json returned to boxes without their own")
+    parser.add_argument("--configs", help="folder of <board id>.json configs")
+    parser.add_argument("--sites", help="JSON of board id -> site_name, startup_message")
+    parser.add_argument("--no-slots", action="store_true",
+                        help="don't assign upload slots; boxes use their board ID hash")
+    parser.add_argument("--upload-rate", type=float, default=0.2,
+                        help="backlog requests per second per box")
+    parser.add_argument("--upload-burst", type=int, default=3,
+                        help="backlog requests a box may send at once")
+    parser.add_argument("--batch", type=int, default=500, help="most rows per transaction")
+    parser.add_argument("--flush-ms", type=float, default=20,
+                        help="longest wait for more rows before committing")
+    parser.add_argument("--stats", type=float, default=10, help="seconds between stats lines")
+    parser.add_argument("--quiet", action="store_true", help="don't print every request")
+    args = parser.parse_args()
+
+    sites = {}
+    if args.sites:
+        with open(args.sites) as sites_file:
+            sites = json.load(sites_file)
+    store = Store(args.db, args.batch, args.flush_ms)
+    writer = await store.start()
+    slots = None
+    if not args.no_slots:
+        slots = Slots(await store.known(), args.upload_rate, args.upload_burst)
+    server = Server(store, Configs(args.config, args.configs), sites, slots, args.quiet)
+    listener = await asyncio.start_server(server.handle, args.host, args.port, backlog=1024)
+    print("GBE server listening on %s:%d, database %s" % (args.host, args.port, args.db))
+    stats = asyncio.create_task(report(server, store, args.stats)) if args.stats else None
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        for task in (writer, stats):
+            if task:
+                task.cancel()
+        store.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,138 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Frames and serial ports for host tools that talk to a box over USB.
+
+A box's USB console carries its text output (status lines and the like)
+and, in between, binary frames (lib/frames.py):
+
+    SOH "G" <type> <seq> <length u16> <payload> <CRC32 u32 of type to payload>
+
+FrameReader picks the frames out of the byte stream and passes the text
+lines around them through. Requests to the box are text lines that start
+with SOH and end with the CRC32 of the rest in hex, made by request().
+SerialPort is an asyncio serial port on a POSIX terminal device, such as
+/dev/ttyACM0 or a pty from ``python -m gbesim --pty``, with no
+dependencies beyond the standard library.
+"""
+
+import asyncio
+import os
+import struct
+import termios
+import tty
+import zlib
+
+MAGIC = b"\x01G"
+HEAD = struct.Struct("<2sBBH")  # Magic, type, sequence, payload length
+CRC = struct.Struct("<I")
+SEGMENT = struct.Struct("<10sII")  # Date, size, CRC
+MAX_PAYLOAD = 4096
+
+
+def request(seq, *words):
+    # A request line for the box
+    text = " ".join([str(seq & 255)] + [str(word) for word in words])
+    return b"\x01" + ("%s %08x\n" % (text, zlib.crc32(text.encode()))).encode()
+
+
+class FrameReader:
+    """Split a box's console output into frames and text lines."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.bad = 0  # Frames with a wrong CRC or length
+
+    def feed(self, data):
+        # (type letter, seq, payload) for each frame and (None, None, line)
+        # for each text line completed by data
+        self.buf += data
+        out = []
+        buf = self.buf
+        while buf:
+            start = buf.find(MAGIC)
+            text_end = buf.find(b"\n")
+            if text_end >= 0 and (start < 0 or text_end < start):
+                out.append((None, None, bytes(buf[:text_end]).rstrip(b"\r").decode("utf-8", "replace")))
+                del buf[:text_end + 1]
+                continue
+            if start < 0:
+                if buf[-1:] == MAGIC[:1]:
+                    break  # Could be the start of a frame
+                if len(buf) > MAX_PAYLOAD:
+                    del buf[:]  # A runaway line with no end
+                break
+            if len(buf) < start + HEAD.size:
+                break
+            _, kind, seq, length = HEAD.unpack_from(buf, start)
+            if length > MAX_PAYLOAD:
+                self.bad += 1
+                del buf[:start + 1]
+                continue
+            end = start + HEAD.size + length + CRC.size
+            if len(buf) < end:
+                break
+            body = bytes(buf[start + 2:end - CRC.size])
+            if CRC.unpack_from(buf, end - CRC.size)[0] != zlib.crc32(body):
+                self.bad += 1
+                del buf[:start + 1]  # Look for the next frame from just after
+                continue
+            if start:
+                text = bytes(buf[:start]).strip()
+                if text:
+                    out.append((None, None, text.decode("utf-8", "replace")))
+            out.append((chr(kind), seq, body[HEAD.size - 2:]))
+            del buf[:end]
+        return out
+
+
+class SerialPort:
+    """A serial device read and written from asyncio, in raw mode."""
+
+    def __init__(self, path, baud=115200):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        speed = getattr(termios, "B%d" % baud, termios.B115200)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self.queue = asyncio.Queue()
+        self.closed = False
+        asyncio.get_running_loop().add_reader(self.fd, self._readable)
+
+    def _readable(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close()
+            return
+        self.queue.put_nowait(data)
+
+    async def read(self, timeout=None):
+        # The next bytes received, or b"" once the port has closed
+        if self.closed and self.queue.empty():
+            return b""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def write(self, data):
+        while data:
+            try:
+                n = os.write(self.fd, data)
+            except BlockingIOError:
+                await asyncio.sleep(0.01)
+                continue
+            data = data[n:]
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.queue.put_nowait(b"")
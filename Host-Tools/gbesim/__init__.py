@@ -0,0 +1,25 @@
+"""Host-side simulator for the GBE control box firmware.
+
+Runs the unmodified ``main.py`` and ``lib`` drivers under CPython against
+fake MicroPython modules, register-level models of the INA219, AHT10,
+Seesaw soil sensor and DS3231, and a virtual clock, so a simulated day
+finishes in a couple of minutes rather than a day::
+
+    from gbesim import Simulation
+    result = Simulation(duration=86400).run()
+"""
+
+from .clock import SimulationComplete, VirtualClock
+from .hal import MachineReset
+from .simulation import ALL_SENSORS, Simulation
+from .world import Cloud, World
+
+__all__ = [
+    "ALL_SENSORS",
+    "Cloud",
+    "MachineReset",
+    "Simulation",
+    "SimulationComplete",
+    "VirtualClock",
+    "World",
+]
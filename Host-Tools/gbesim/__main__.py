@@ -0,0 +1,125 @@
+"""Command line entry point: ``python -m gbesim --hours 24``."""
+
+import argparse
+import json
+import shutil
+import sys
+
+from .simulation import ALL_SENSORS, Simulation
+
+
+def parse_outage(text):
+    # START:HOURS, both in hours from the start of the simulation
+    start, length = (float(part) for part in text.split(":"))
+    return (start * 3600, (start + length) * 3600)
+
+
+def parse_typed(text):
+    # SECONDS:TEXT, a console command typed at that time
+    seconds, typed = text.split(":", 1)
+    return (float(seconds), typed.replace("\\n", "\n") + "\n")
+
+
+def parse_stuck(text):
+    # HOURS:BUS, when a device starts holding SDA low on that bus
+    hours, bus = text.split(":")
+    return (float(hours) * 3600, int(bus))
+
+
+def parse_fault(text):
+    # HOURS:KIND[:LENGTH], a hardware fault starting that many hours in
+    parts = text.split(":")
+    length = float(parts[2]) * 3600 if len(parts) > 2 else None
+    return (float(parts[0]) * 3600, parts[1], length)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="gbesim", description="Run main.py in simulated time.")
+    parser.add_argument("--hours", type=float, default=24, help="simulated hours to run (default 24)")
+    parser.add_argument("--start", default="2024-05-01T04:00:00",
+                        help="UTC start time, YYYY-MM-DDTHH:MM:SS")
+    parser.add_argument("--no-wifi", action="store_true", help="run without wifi settings")
+    parser.add_argument("--outage", type=parse_outage, action="append", default=[],
+                        metavar="START:HOURS", help="wifi outage window, in hours")
+    parser.add_argument("--sensors", default=",".join(ALL_SENSORS),
+                        help="comma-separated fitted sensors (default: all)")
+    parser.add_argument("--type", type=parse_typed, action="append", default=[],
+                        metavar="SECONDS:TEXT", help="type a console command at that time")
+    parser.add_argument("--reset", type=float, action="append", default=[],
+                        metavar="HOURS", help="cut the power this many hours in")
+    parser.add_argument("--devices", metavar="FILE",
+                        help="device_settings.json to install; its extra devices are fitted")
+    parser.add_argument("--stuck", type=parse_stuck, action="append", default=[],
+                        metavar="HOURS:BUS", help="a device holds SDA low on that I2C bus")
+    parser.add_argument("--fault", type=parse_fault, action="append", default=[],
+                        metavar="HOURS:KIND[:LENGTH]",
+                        help="fan stall, LED channel failure (red, green, blue, white) "
+                             "or heat, for LENGTH hours or to the end")
+    parser.add_argument("--latency", type=float, default=0.15,
+                        help="seconds each HTTP request to the cloud takes")
+    parser.add_argument("--slot", type=int, metavar="SECONDS",
+                        help="upload slot the cloud assigns, seconds after the hour")
+    parser.add_argument("--crystal-ppm", type=float, default=0,
+                        help="error of the Pico's crystal (ticks and RTC), ppm")
+    parser.add_argument("--ds3231-ppm", type=float, default=0,
+                        help="error of the DS3231 battery clock, ppm")
+    parser.add_argument("--pty", metavar="LINK", nargs="?", const="",
+                        help="put the USB console on a pty (and symlink it to LINK)")
+    parser.add_argument("--speed", type=float,
+                        help="run at most this many times faster than real time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--root", help="keep the simulated filesystem in this directory")
+    parser.add_argument("--echo", action="store_true", help="print the firmware console")
+    parser.add_argument("--tail", type=int, default=5, help="console lines to show at the end")
+    args = parser.parse_args(argv)
+
+    date, clock = args.start.split("T")
+    start = tuple(int(x) for x in date.split("-")) + tuple(int(x) for x in clock.split(":"))
+    sensors = [name for name in args.sensors.split(",") if name]
+    device_settings = None
+    if args.devices:
+        with open(args.devices) as dev_file:
+            device_settings = json.load(dev_file)
+
+    sim = Simulation(
+        duration=args.hours * 3600,
+        start=start,
+        wifi=not args.no_wifi,
+        outages=args.outage,
+        sensors=sensors,
+        seed=args.seed,
+        root=args.root,
+        echo=args.echo,
+        device_settings=device_settings,
+        latency=args.latency,
+        upload={"slot": args.slot} if args.slot is not None else None,
+        crystal_ppm=args.crystal_ppm,
+        ds3231_ppm=args.ds3231_ppm,
+    )
+    for seconds, text in args.type:
+        sim.type_at(seconds, text)
+    for seconds, bus in args.stuck:
+        sim.stick_bus_at(seconds, bus)
+    for seconds, kind, length in args.fault:
+        sim.fault_at(seconds, kind, length)
+    for hours in args.reset:
+        sim.reset_at(hours * 3600)
+    if args.pty is not None:
+        print("USB console on " + sim.attach_pty(args.pty or None), file=sys.stderr)
+    if args.speed:
+        sim.pace(args.speed)
+    result = sim.run()
+    if not args.echo and args.tail:
+        for line in list(sim.console.lines)[-args.tail:]:
+            print(line)
+    error = result.pop("error")
+    print(json.dumps(result, indent=2))
+    if error:
+        print(error, file=sys.stderr)
+    if args.root is None:
+        shutil.rmtree(sim.root, ignore_errors=True)
+    return 0 if result["outcome"] == "completed" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Virtual clock driving a simulation.
+
+Simulated time only moves when the firmware sleeps or spends time on a bus,
+so a day of control-box operation runs as fast as the host can execute the
+firmware's Python code. Periodic ``machine.Timer`` callbacks run on core 0
+at their due times on the way, as soft timer callbacks do between bytecodes.
+"""
+
+import calendar
+
+TICKS_PERIOD = 1 << 30  # MicroPython ticks wrap at 2**30 on the rp2 port
+LISTENER_STEP = 0.05  # Listeners see time in steps of at least this many seconds
+
+
+class SimulationComplete(BaseException):
+    """Raised from inside the firmware once the requested duration has run.
+
+    Derived from BaseException so the firmware's ``except Exception``
+    handlers let it through.
+    """
+
+
+class VirtualClock:
+    def __init__(self, start, duration=None):
+        # ``start`` is a UTC datetime tuple (year, month, day, hour, min, sec)
+        self.start = float(calendar.timegm(tuple(start) + (0, 0, 0)))
+        self.now = self.start
+        self.deadline = None if duration is None else self.start + duration
+        self.listeners = []
+        self.pending = 0.0
+        self.sleeps = 0
+        self.core = None  # Second core once the firmware starts a thread
+        self.timers = []  # machine.Timer objects, each with .due, .period and .fire()
+        self.firing = False
+        self.ppm = 0.0  # Error of the Pico's crystal, which runs ticks and the RTC
+
+    @property
+    def crystal(self):
+        # Seconds counted by the Pico's crystal, from the same start
+        return self.start + (self.now - self.start) * (1 + self.ppm * 1e-6)
+
+    @property
+    def elapsed(self):
+        return self.now - self.start
+
+    def advance(self, seconds, hold=False):
+        # ``hold`` keeps core 1 paused for the whole stretch, as while
+        # core 0 writes to flash
+        core = self.core
+        if core is not None and not hold and core.running_here():
+            core.sleep(seconds)
+            return
+        # Most steps are short sleeps with no timer or core 1 wake-up on the
+        # way, such as the status LED's breathing
+        end = self.now + seconds
+        if core is None or hold or core.wake is None or end < core.wake:
+            clear = True
+            if not self.firing:
+                for timer in self.timers:
+                    if timer.due <= end:
+                        clear = False
+                        break
+            if clear:
+                self._advance(seconds)
+                return
+        # Stop at each timer's due time on the way and run its callback;
+        # time a callback spends is not interrupted by another
+        while self.timers and not self.firing:
+            timer = min(self.timers, key=lambda t: t.due)
+            if self.now + seconds < timer.due:
+                break
+            step = max(0.0, timer.due - self.now)
+            self._run(step, hold)
+            seconds -= step
+            self.firing = True
+            try:
+                timer.fire()
+            finally:
+                self.firing = False
+        self._run(seconds, hold)
+
+    def _run(self, seconds, hold):
+        core = self.core
+        if core is not None and not hold:
+            # Stop at each of core 1's wake-ups on the way and let it run
+            while core.wake is not None and self.now + seconds >= core.wake:
+                step = max(0.0, core.wake - self.now)
+                self._advance(step)
+                seconds -= step
+                core.resume()
+        self._advance(seconds)
+
+    def _advance(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+            self.pending += seconds
+            if self.pending >= LISTENER_STEP:
+                pending, self.pending = self.pending, 0.0
+                for listener in list(self.listeners):
+                    listener(pending)
+        if self.deadline is not None and self.now >= self.deadline:
+            raise SimulationComplete()
+
+    def sleep(self, seconds):
+        self.sleeps += 1
+        self.advance(seconds)
+
+    def ticks_us(self):
+        return int((self.crystal - self.start) * 1000000) % TICKS_PERIOD
+
+    def ticks_ms(self):
+        return int((self.crystal - self.start) * 1000) % TICKS_PERIOD
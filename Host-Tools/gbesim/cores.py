@@ -0,0 +1,121 @@
+"""The RP2040's second core, for firmware that uses ``_thread``.
+
+The function passed to ``_thread.start_new_thread`` runs in a host thread,
+but only one side runs at a time. Core 1 runs until it sleeps (or spends
+time any other way) and then waits until the virtual clock reaches its
+wake-up time. When core 0 moves the clock past that time, the clock stops
+there, core 1 runs, and core 0 carries on. Core 1 therefore always wakes
+exactly on time; what the simulation shows is how the two cores share the
+lock, not contention for the bus or flash.
+"""
+
+import threading
+import traceback
+
+
+class Stopped(BaseException):
+    """Raised on core 1 when the Pico is reset or the simulation ends."""
+
+
+class SecondCore:
+    def __init__(self, clock, console):
+        self.clock = clock
+        self.console = console
+        self.wake = None  # Virtual time core 1 is sleeping until
+        self.thread = None
+        self.ident = None  # Host thread ID of core 1, checked on every clock step
+        self.stopping = False
+        # Each side waits on its own lock until the other side releases it
+        self.go = {"core0": threading.Lock(), "core1": threading.Lock()}
+        for lock in self.go.values():
+            lock.acquire()
+        self.passes = 0
+
+    def start(self, func, args, kwargs=None):
+        if self.thread is not None:
+            raise OSError(16, "EBUSY")  # The rp2 port has one spare core
+        self.thread = threading.Thread(target=self._main, args=(func, args, kwargs or {}),
+                                       daemon=True)
+        self.clock.core = self
+        self.thread.start()
+        self._switch("core1")
+
+    def _main(self, func, args, kwargs):
+        self.go["core1"].acquire()
+        self.ident = threading.get_ident()
+        try:
+            func(*args, **kwargs)
+        except Stopped:
+            pass
+        except BaseException:
+            self.console.write("Unhandled exception in thread started by %r\n" % (func,))
+            self.console.write(traceback.format_exc())
+        finally:
+            self.wake = None
+            self.ident = None
+            self.thread = None
+            self.go["core0"].release()
+
+    def _switch(self, to):
+        # Hand over to the other side and wait until it hands back
+        self.go[to].release()
+        self.go["core0" if to == "core1" else "core1"].acquire()
+
+    def running_here(self):
+        return self.ident is not None and threading.get_ident() == self.ident
+
+    def sleep(self, seconds):
+        # Core 1 busy or asleep for this long; core 0 runs meanwhile
+        self.wake = self.clock.now + max(seconds, 1e-6)
+        self._switch("core0")
+        if self.stopping:
+            raise Stopped()
+
+    def resume(self):
+        # Called on core 0 with the clock at core 1's wake-up time
+        self.wake = None
+        self.passes += 1
+        self._switch("core1")
+
+    def stop(self):
+        # Unwind core 1, e.g. when the Pico resets
+        if self.thread is not None and not self.running_here():
+            self.stopping = True
+            self.wake = None
+            self._switch("core1")
+        if self.clock.core is self:
+            self.clock.core = None
+
+    def lock(self):
+        return Lock(self.clock)
+
+
+class Lock:
+    """``_thread`` lock; a side that finds it held lets the other side run."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.held = False
+
+    def acquire(self, waitflag=1, timeout=-1):
+        while self.held:
+            if not waitflag:
+                return False
+            self.clock.advance(1e-6)
+        self.held = True
+        return True
+
+    def release(self):
+        if not self.held:
+            raise RuntimeError("release unlocked lock")
+        self.held = False
+
+    def locked(self):
+        return self.held
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,250 @@
+"""Register-level models of the I2C devices used by the control box.
+
+Each model answers raw ``write(data)`` / ``read(n)`` transactions the way the
+real part does, so the unmodified drivers in the firmware's ``lib`` directory
+can talk to them. Measured values come from the shared :class:`World`.
+"""
+
+import calendar
+import struct
+import time
+
+
+def bcd(value):
+    return (value // 10) << 4 | (value % 10)
+
+
+def unbcd(value):
+    return (value >> 4) * 10 + (value & 0x0F)
+
+
+class Device:
+    address = None
+
+    def __init__(self, world, address=None):
+        self.world = world
+        if address is not None:
+            self.address = address
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def read(self, n):
+        raise NotImplementedError
+
+
+class INA219(Device):
+    """Current sensor on the 24 V LED supply (shunt 0.1 ohm)."""
+
+    address = 0x40
+
+    def __init__(self, world, address=None, shunt_ohms=0.1):
+        super().__init__(world, address)
+        self.shunt_ohms = shunt_ohms
+        self.regs = [0x399F, 0, 0, 0, 0, 0]
+        self.pointer = 0
+
+    def _measure(self):
+        volts = self.world.supply_volts
+        amps = self.world.led_current()
+        cal = self.regs[5]
+        shunt = int(round(amps * self.shunt_ohms / 0.00001))
+        gain_volts = (0.04, 0.08, 0.16, 0.32)[(self.regs[0] >> 11) & 3]
+        overflow = amps * self.shunt_ohms > gain_volts
+        bus = int(volts / 0.004) << 3 | 0x02 | overflow  # CNVR set, OVF if over range
+        if cal:
+            current_lsb = 0.04096 / (cal * self.shunt_ohms)
+            current = int(amps / current_lsb)
+            power = int(amps * volts / (current_lsb * 20))
+        else:
+            current = power = 0
+        self.regs[1] = shunt & 0xFFFF
+        self.regs[2] = bus & 0xFFFF
+        self.regs[3] = min(power, 0xFFFF)
+        self.regs[4] = current & 0xFFFF
+
+    def write(self, data):
+        self.pointer = data[0]
+        if len(data) >= 3:
+            value = data[1] << 8 | data[2]
+            if self.pointer == 0 and value & 0x8000:
+                self.regs = [0x399F, 0, 0, 0, 0, 0]
+            elif self.pointer in (0, 5):
+                self.regs[self.pointer] = value
+
+    def read(self, n):
+        self._measure()
+        value = self.regs[self.pointer] if self.pointer < 6 else 0
+        return bytes([value >> 8 & 0xFF, value & 0xFF] + [0] * max(0, n - 2))[:n]
+
+
+class AHT10(Device):
+    """Temperature and humidity sensor on the external connector."""
+
+    address = 0x38
+
+    def __init__(self, world, address=None):
+        super().__init__(world, address)
+        self.calibrated = False
+        self.measured_at = None
+
+    def write(self, data):
+        if data[0] == 0xE1:
+            self.calibrated = True
+        elif data[0] == 0xAC:
+            self.measured_at = self.world.clock.now
+        elif data[0] == 0xBA:
+            self.calibrated = False
+
+    def read(self, n):
+        busy = (
+            self.measured_at is not None
+            and self.world.clock.now - self.measured_at < 0.075
+        )
+        status = (0x80 if busy else 0) | (0x08 if self.calibrated else 0)
+        hum = int(self.world.humidity() / 100 * 1048576) & 0xFFFFF
+        tem = int((self.world.temperature() + 50) / 200 * 1048576) & 0xFFFFF
+        raw = bytes([
+            status,
+            hum >> 12 & 0xFF,
+            hum >> 4 & 0xFF,
+            (hum & 0x0F) << 4 | tem >> 16 & 0x0F,
+            tem >> 8 & 0xFF,
+            tem & 0xFF,
+        ])
+        return (raw + bytes(max(0, n - 6)))[:n]
+
+
+class SoilSensor(Device):
+    """Adafruit STEMMA soil sensor (Seesaw firmware)."""
+
+    address = 0x36
+
+    def __init__(self, world, address=None):
+        super().__init__(world, address)
+        self.register = (0, 0)
+
+    def write(self, data):
+        if len(data) >= 2:
+            self.register = (data[0], data[1])
+
+    def read(self, n):
+        base, reg = self.register
+        if (base, reg) == (0x00, 0x01):
+            out = bytes([0x55])
+        elif (base, reg) == (0x00, 0x04):
+            out = struct.pack(">I", int(self.world.temperature() * 65536))
+        elif (base, reg) == (0x0F, 0x10):
+            out = struct.pack(">H", int(self.world.soil_moisture()))
+        else:
+            out = b""
+        return (out + bytes(n))[:n]
+
+
+class DS3231(Device):
+    """Battery-backed real time clock. Keeps its own offset from true time.
+
+    ``ppm`` is how fast its oscillator runs; the aging offset register
+    (0x10) trims it by 0.1 ppm per step, positive slowing it down. Writing
+    the seconds register restarts the second, as on the chip.
+    """
+
+    address = 0x68
+
+    def __init__(self, world, address=None, offset=0.0, ppm=0.0):
+        super().__init__(world, address)
+        self.offset = offset  # seconds ahead of true UTC when last set
+        self.ppm = ppm
+        self.regs = bytearray(0x13)
+        self.pointer = 0
+        self.anchor = world.clock.now  # When the offset was last worked out
+
+    def _rate(self):
+        aging = self.regs[0x10] - 256 if self.regs[0x10] > 127 else self.regs[0x10]
+        return (self.ppm - 0.1 * aging) * 1e-6
+
+    def seconds(self):
+        # Its own time, as a true UTC timestamp plus its error
+        now = self.world.clock.now
+        return now + self.offset + (now - self.anchor) * self._rate()
+
+    def _time_regs(self):
+        t = time.gmtime(int(self.seconds()))
+        return [
+            bcd(t.tm_sec), bcd(t.tm_min), bcd(t.tm_hour),
+            (t.tm_wday + 1) % 7 + 1, bcd(t.tm_mday), bcd(t.tm_mon),
+            bcd(t.tm_year % 100),
+        ]
+
+    def write(self, data):
+        self.pointer = data[0]
+        if len(data) == 1:
+            return
+        # Keep the drift so far before the rate or the time changes
+        now = self.world.clock.now
+        self.offset = self.seconds() - now
+        self.anchor = now
+        regs = self._time_regs()
+        touched = False
+        for value in data[1:]:
+            if self.pointer < 7:
+                regs[self.pointer] = value
+                touched = True
+            elif self.pointer < len(self.regs):
+                self.regs[self.pointer] = value
+            self.pointer = (self.pointer + 1) % len(self.regs)
+        if touched:
+            wall = calendar.timegm((
+                2000 + unbcd(regs[6]), unbcd(regs[5]) or 1, unbcd(regs[4]) or 1,
+                unbcd(regs[2] & 0x3F), unbcd(regs[1]), unbcd(regs[0]), 0, 0, 0,
+            ))
+            self.offset = wall - now
+
+    def read(self, n):
+        regs = self._time_regs() + list(self.regs[7:])
+        regs[0x11] = int(self.world.temperature()) & 0xFF
+        out = bytearray()
+        for _ in range(n):
+            out.append(regs[self.pointer])
+            self.pointer = (self.pointer + 1) % len(regs)
+        return bytes(out)
+
+
+class Recorder(Device):
+    """Passes transactions through to a model, keeping every read response."""
+
+    def __init__(self, device):
+        super().__init__(device.world, device.address)
+        self.device = device
+        self.reads = []
+
+    def write(self, data):
+        self.device.write(data)
+
+    def read(self, n):
+        data = self.device.read(n)
+        self.reads.append(data.hex())
+        return data
+
+
+class Replay(Device):
+    """Answers reads from a recording made with :class:`Recorder`.
+
+    Writes are accepted and ignored; reads return the recorded responses in
+    order, wrapping around when the recording runs out.
+    """
+
+    def __init__(self, world, address, reads):
+        super().__init__(world, address)
+        self.reads = [bytes.fromhex(data) for data in reads]
+        self.next = 0
+
+    def write(self, data):
+        pass
+
+    def read(self, n):
+        if not self.reads:
+            return bytes(n)
+        data = self.reads[self.next % len(self.reads)]
+        self.next += 1
+        return (data + bytes(n))[:n]
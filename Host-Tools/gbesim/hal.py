@@ -0,0 +1,707 @@
+"""Fake MicroPython modules backed by a simulated :class:`World`.
+
+``build_modules`` returns a ``{name: module}`` mapping that the sandbox
+serves in place of ``machine``, ``network``, ``neopixel``, ``urequests``,
+``ntptime``, ``time``, ``_thread``, ``rp2`` and the other modules the firmware imports.
+"""
+
+import binascii
+import calendar
+import errno
+import json
+import socket
+import struct
+import sys
+import time as _time
+import types
+
+from .clock import TICKS_PERIOD
+from .cores import SecondCore
+
+RTC_DEFAULT = calendar.timegm((2021, 1, 1, 0, 0, 0, 0, 0, 0))
+
+# Pico W heap with the network stack up, and what main.py keeps live
+HEAP_SIZE = 166016
+HEAP_LIVE = 61440
+
+
+class MachineReset(BaseException):
+    """Raised by ``machine.reset()``; the runner reboots the firmware."""
+
+
+def _module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    return mod
+
+
+def _tuple(secs):
+    t = _time.gmtime(int(secs))
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec,
+            t.tm_wday, t.tm_yday)
+
+
+class Hal:
+    def __init__(self, world, console):
+        self.world = world
+        self.clock = world.clock
+        self.console = console
+        # The Pico's RTC starts at 2021-01-01 after power-up
+        self.rtc_offset = RTC_DEFAULT - self.clock.crystal
+        self.i2c_transactions = 0
+        self.i2c_bytes = 0
+        self.i2c_timeouts = 0
+        self.neopixel_writes = 0
+        self.timer_callbacks = 0
+        self.http_bytes = 0
+        self.led = (0, 0, 0)
+        self.gc_collects = 0
+        self.gc_automatic = 0
+        self.gc_threshold = -1
+        self.garbage_base = 0
+        self.core = SecondCore(self.clock, console)
+
+    # ------------------------------------------------------------- time
+    def rtc_seconds(self):
+        # The RTC counts the crystal's seconds, from when it was last set
+        return self.clock.crystal + self.rtc_offset
+
+    def time_module(self):
+        clock = self.clock
+        half = TICKS_PERIOD // 2
+
+        def ticks_diff(a, b):
+            return ((a - b + half) % TICKS_PERIOD) - half
+
+        def ticks_add(a, delta):
+            return (a + delta) % TICKS_PERIOD
+
+        return _module(
+            "time",
+            time=lambda: int(self.rtc_seconds()),
+            time_ns=lambda: int(self.rtc_seconds() * 1e9),
+            localtime=lambda secs=None: _tuple(self.rtc_seconds() if secs is None else secs),
+            gmtime=lambda secs=None: _tuple(self.rtc_seconds() if secs is None else secs),
+            mktime=lambda t: calendar.timegm(tuple(t[:6]) + (0, 0, 0)),
+            sleep=clock.sleep,
+            sleep_ms=lambda ms: clock.sleep(ms / 1000),
+            sleep_us=lambda us: clock.sleep(us / 1000000),
+            ticks_ms=clock.ticks_ms,
+            ticks_us=clock.ticks_us,
+            ticks_cpu=clock.ticks_us,
+            ticks_diff=ticks_diff,
+            ticks_add=ticks_add,
+        )
+
+    # ---------------------------------------------------------- machine
+    def machine_module(self):
+        hal = self
+        world = self.world
+
+        class Pin:
+            IN = 0
+            OUT = 1
+            OPEN_DRAIN = 2
+            PULL_UP = 1
+            PULL_DOWN = 2
+            IRQ_FALLING = 4
+            IRQ_RISING = 8
+
+            def __init__(self, id, mode=-1, pull=-1, value=None):
+                self.id = id.id if isinstance(id, Pin) else id
+                self._value = 1 if value is None else value
+
+            def init(self, mode=-1, pull=-1, value=None):
+                if value is not None:
+                    self._value = value
+
+            def value(self, v=None):
+                line = world.i2c_lines.get(self.id)
+                if v is None:
+                    if line is not None:
+                        return world.line_level(*line)
+                    return self._value
+                if line is not None and self._value and not v:
+                    world.clock_edge(*line)
+                self._value = v
+
+            def on(self):
+                self.value(1)
+
+            def off(self):
+                self.value(0)
+
+            def irq(self, handler=None, trigger=IRQ_FALLING):
+                world.irqs[self.id] = handler
+
+        class PWM:
+            def __init__(self, pin, freq=None, duty_u16=None):
+                self.pin = pin.id
+                self._freq = freq or 1000
+                if duty_u16 is not None:
+                    self.duty_u16(duty_u16)
+
+            def freq(self, f=None):
+                if f is None:
+                    return self._freq
+                self._freq = f
+
+            def duty_u16(self, value=None):
+                if value is None:
+                    return world.duty.get(self.pin, 0)
+                world.duty[self.pin] = int(value) & 0xFFFF
+
+            def deinit(self):
+                world.duty[self.pin] = 0
+
+        class I2C:
+            def __init__(self, id, scl=None, sda=None, freq=400000, timeout=50000):
+                self.id = id
+                self.freq = freq
+                self.timeout = timeout
+                self.devices = world.buses.setdefault(id, {})
+                for pin, line in ((sda, "sda"), (scl, "scl")):
+                    if pin is not None:
+                        world.i2c_lines[getattr(pin, "id", pin)] = (id, line)
+
+            def _device(self, addr, nbytes):
+                if self.id in world.stuck:
+                    # SDA held low: the controller waits out its timeout
+                    hal.i2c_timeouts += 1
+                    hal.clock.advance(self.timeout / 1000000)
+                    raise OSError(errno.ETIMEDOUT, "ETIMEDOUT")
+                hal.i2c_transactions += 1
+                hal.i2c_bytes += nbytes
+                # Start, address byte, data bytes (9 clocks each), stop
+                hal.clock.advance((nbytes + 1) * 9 / self.freq + 0.00002)
+                device = self.devices.get(addr)
+                if device is None:
+                    raise OSError(errno.EIO, "EIO")
+                return device
+
+            def scan(self):
+                hal.clock.advance(len(range(0x08, 0x78)) * 10 / self.freq)
+                return sorted(self.devices)
+
+            def writeto(self, addr, buf, stop=True):
+                device = self._device(addr, len(buf))
+                if buf:  # An empty write only checks for an acknowledge
+                    device.write(bytes(buf))
+                return len(buf)
+
+            def readfrom(self, addr, nbytes, stop=True):
+                return self._device(addr, nbytes).read(nbytes)
+
+            def readfrom_into(self, addr, buf, stop=True):
+                data = self._device(addr, len(buf)).read(len(buf))
+                buf[:] = data
+
+            def writeto_mem(self, addr, memaddr, buf):
+                self._device(addr, len(buf) + 1).write(bytes([memaddr]) + bytes(buf))
+
+            def readfrom_mem(self, addr, memaddr, nbytes):
+                # Register pointer write and read with a repeated start
+                device = self._device(addr, nbytes + 1)
+                device.write(bytes([memaddr]))
+                return device.read(nbytes)
+
+            def readfrom_mem_into(self, addr, memaddr, buf):
+                buf[:] = self.readfrom_mem(addr, memaddr, len(buf))
+
+        class Timer:
+            # Soft timer: the callback runs on core 0 at each due time
+            ONE_SHOT = 0
+            PERIODIC = 1
+
+            def __init__(self, id=-1, mode=PERIODIC, period=-1, freq=None, callback=None):
+                self.due = None
+                if callback is not None:
+                    self.init(mode=mode, period=period, freq=freq, callback=callback)
+
+            def init(self, mode=PERIODIC, period=-1, freq=None, callback=None):
+                self.deinit()
+                self.mode = mode
+                self.period = 1 / freq if freq else period / 1000
+                self.callback = callback
+                self.due = hal.clock.now + self.period
+                hal.clock.timers.append(self)
+
+            def fire(self):
+                if self.mode == Timer.PERIODIC:
+                    self.due += self.period
+                else:
+                    self.deinit()
+                hal.timer_callbacks += 1
+                self.callback(self)
+
+            def deinit(self):
+                if self in hal.clock.timers:
+                    hal.clock.timers.remove(self)
+
+        class RTC:
+            def datetime(self, dt=None):
+                if dt is None:
+                    t = _tuple(hal.rtc_seconds())
+                    return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+                secs = calendar.timegm((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0, 0))
+                hal.rtc_offset = secs - hal.clock.crystal  # Counts from 0 again
+
+        def reset():
+            raise MachineReset()
+
+        return _module(
+            "machine",
+            Pin=Pin,
+            PWM=PWM,
+            I2C=I2C,
+            SoftI2C=I2C,
+            Timer=Timer,
+            RTC=RTC,
+            unique_id=lambda: bytes.fromhex("e6614c311b4f7a2c"),
+            reset=reset,
+            soft_reset=reset,
+            freq=lambda hz=None: 125000000,
+            idle=lambda: None,
+            lightsleep=lambda ms=0: self.clock.sleep(ms / 1000),
+            disable_irq=lambda: 0,
+            enable_irq=lambda state=0: None,
+        )
+
+    # ---------------------------------------------------------- network
+    def network_module(self):
+        world = self.world
+
+        class WLAN:
+            # Every WLAN object for an interface shares the same radio state
+            _state = {}
+
+            def __init__(self, interface=0):
+                self.state = WLAN._state.setdefault(interface, {"active": False, "ssid": None})
+
+            def active(self, state=None):
+                if state is None:
+                    return self.state["active"]
+                self.state["active"] = bool(state)
+
+            def connect(self, ssid=None, key=None):
+                self.state["ssid"] = ssid
+
+            def disconnect(self):
+                self.state["ssid"] = None
+
+            def isconnected(self):
+                return self.state["active"] and self.state["ssid"] is not None and world.online()
+
+            def status(self):
+                return 3 if self.isconnected() else 0
+
+            def config(self, param):
+                if param == "mac":
+                    return bytes.fromhex("28cdc1000001")
+                raise ValueError(param)
+
+            def ifconfig(self):
+                if self.isconnected():
+                    return ("192.168.4.23", "255.255.255.0", "192.168.4.1", "192.168.4.1")
+                return ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+        return _module("network", WLAN=WLAN, STA_IF=0, AP_IF=1)
+
+    # --------------------------------------------------------- neopixel
+    def neopixel_module(self):
+        hal = self
+
+        class NeoPixel:
+            def __init__(self, pin, n, bpp=3, timing=1):
+                self.n = n
+                self.buf = [(0, 0, 0)] * n
+
+            def __setitem__(self, idx, value):
+                self.buf[idx] = tuple(value)
+
+            def __getitem__(self, idx):
+                return self.buf[idx]
+
+            def __len__(self):
+                return self.n
+
+            def fill(self, value):
+                self.buf = [tuple(value)] * self.n
+
+            def write(self):
+                # 24 bits at 800 kHz per pixel plus the 50 us latch
+                hal.neopixel_writes += 1
+                hal.led = self.buf[0]
+                hal.clock.advance(self.n * 30e-6 + 50e-6)
+
+        return _module("neopixel", NeoPixel=NeoPixel)
+
+    # -------------------------------------------------------------- rp2
+    def rp2_module(self):
+        hal = self
+
+        def asm_pio(**settings):
+            # The program is not assembled; the state machine below stands
+            # in for the WS2812 program used by lib/pioled.py
+            def wrap(func):
+                func.settings = settings
+                return func
+            return wrap
+
+        class PIO:
+            OUT_LOW = 0
+            OUT_HIGH = 1
+            IN_LOW = 0
+            IN_HIGH = 1
+            SHIFT_LEFT = 0
+            SHIFT_RIGHT = 1
+            JOIN_NONE = 0
+            JOIN_TX = 1
+            JOIN_RX = 2
+            IRQ_SM0 = 0x100
+
+        class StateMachine:
+            def __init__(self, id, program=None, freq=125000000, **kwargs):
+                self.id = id
+                self.program = program
+                self.freq = freq
+                self.running = False
+
+            def active(self, value=None):
+                if value is None:
+                    return self.running
+                self.running = bool(value)
+
+            def put(self, value, shift=0):
+                # Words go into the TX FIFO; the CPU does not wait for the bits
+                count = 1 if isinstance(value, int) else len(value)
+                if self.running and count:
+                    word = value if count == 1 and isinstance(value, int) else value[0]
+                    word = (word << shift) & 0xFFFFFFFF  # As pushed; GRB from the top
+                    hal.neopixel_writes += 1
+                    hal.led = ((word >> 16) & 0xFF, (word >> 24) & 0xFF, (word >> 8) & 0xFF)
+                hal.clock.advance(count * 1e-6)
+
+            def tx_fifo(self):
+                return 0
+
+        return _module("rp2", asm_pio=asm_pio, PIO=PIO, StateMachine=StateMachine)
+
+    # ----------------------------------------------------------- socket
+    def socket_module(self):
+        # UDP sockets reach a simulated time server on port 123; anything
+        # else (e.g. MQTT over TCP) goes to the host's own network
+        world = self.world
+        clock = self.clock
+        ntp_delta = 2208988800
+
+        def ntp_stamp(secs):
+            whole = int(secs)
+            return struct.pack("!II", whole + ntp_delta, int((secs - whole) * 4294967296))
+
+        class UDPSocket:
+            def __init__(self):
+                self.reply = None  # (time it arrives, packet)
+                self.timeout = None
+
+            def setblocking(self, flag):
+                self.timeout = None if flag else 0
+
+            def settimeout(self, value):
+                self.timeout = value
+
+            def sendto(self, data, addr):
+                clock.advance(0.0005)
+                if not world.online() or addr[1] != 123 or len(data) < 48:
+                    return len(data)
+                world.ntp_queries += 1
+                rtt = world.ntp_rtt * (1 + 0.5 * world.random.random())
+                out = rtt * world.random.uniform(0.3, 0.7)  # Paths differ a little
+                received = clock.now + out
+                packet = (bytes([0x24, 2, data[2], 0xEC]) + bytes(8) + b"SIM\0"
+                          + ntp_stamp(received - 10) + data[40:48]
+                          + ntp_stamp(received) + ntp_stamp(received + 0.0001))
+                self.reply = (clock.now + rtt, packet)
+                return len(data)
+
+            def ready_at(self):
+                return self.reply[0] if self.reply else None
+
+            def recv(self, n):
+                if self.reply is None or self.reply[0] > clock.now:
+                    wait = self.timeout
+                    if wait == 0:
+                        raise OSError(errno.EAGAIN, "EAGAIN")
+                    if self.reply is not None and (wait is None or self.reply[0] <= clock.now + wait):
+                        clock.sleep(self.reply[0] - clock.now)
+                    else:
+                        clock.sleep(wait or 0)
+                        raise OSError(errno.ETIMEDOUT, "ETIMEDOUT")
+                packet = self.reply[1]
+                self.reply = None
+                return packet[:n]
+
+            def recvfrom(self, n):
+                return self.recv(n), ("203.0.113.123", 123)
+
+            def close(self):
+                self.reply = None
+
+        def make_socket(af=socket.AF_INET, kind=socket.SOCK_STREAM, proto=0):
+            if kind == socket.SOCK_DGRAM:
+                return UDPSocket()
+            return socket.socket(af, kind, proto)
+
+        def getaddrinfo(host, port, *args):
+            if port == 123:
+                clock.advance(0.02)  # DNS lookup
+                if not world.online():
+                    raise OSError(-2, "EAI_NONAME")
+                return [(socket.AF_INET, socket.SOCK_DGRAM, 0, "", ("203.0.113.123", 123))]
+            return socket.getaddrinfo(host, port, *args)
+
+        return _module("socket", socket=make_socket, getaddrinfo=getaddrinfo,
+                       AF_INET=socket.AF_INET, SOCK_STREAM=socket.SOCK_STREAM,
+                       SOCK_DGRAM=socket.SOCK_DGRAM, SOL_SOCKET=socket.SOL_SOCKET,
+                       SO_REUSEADDR=socket.SO_REUSEADDR)
+
+    # -------------------------------------------------------- urequests
+    def urequests_module(self):
+        hal = self
+        world = self.world
+
+        class Response:
+            def __init__(self, text, status_code=200):
+                self.text = text
+                self.content = text.encode()
+                self.status_code = status_code
+
+            def json(self):
+                return json.loads(self.text)
+
+            def close(self):
+                pass
+
+        def get(url, **kwargs):
+            hal.clock.advance(world.latency)
+            if not world.online():
+                raise OSError(errno.EHOSTUNREACH, "EHOSTUNREACH")
+            text = world.cloud.get(url, hal.clock.now)
+            hal.http_bytes += len(url) + len(text)
+            return Response(text)
+
+        return _module("urequests", get=get, Response=Response)
+
+    def ntptime_module(self):
+        hal = self
+        world = self.world
+
+        def settime():
+            hal.clock.advance(0.05)
+            if not world.online():
+                raise OSError(errno.ETIMEDOUT, "ETIMEDOUT")
+            hal.rtc_offset = int(hal.clock.now) - hal.clock.crystal  # Whole seconds only
+
+        def ntp_time():
+            if not world.online():
+                raise OSError(errno.ETIMEDOUT, "ETIMEDOUT")
+            return int(hal.clock.now)
+
+        return _module("ntptime", settime=settime, time=ntp_time, host="pool.ntp.org")
+
+    # --------------------------------------------------------------- gc
+    def allocated(self):
+        # CPython cannot see the firmware's allocations, so garbage is
+        # modelled from what it does: strings printed to the console, I2C
+        # buffers and HTTP requests and replies
+        return (3 * self.console.bytes_out + 40 * self.i2c_transactions
+                + 2 * self.http_bytes)
+
+    def garbage(self):
+        garbage = self.allocated() - self.garbage_base
+        limit = HEAP_SIZE - HEAP_LIVE
+        if self.gc_threshold > 0:
+            limit = min(limit, self.gc_threshold)
+        if garbage > limit:
+            # The heap filled up (or passed the threshold) since the last
+            # look, so MicroPython collected by itself along the way
+            self.gc_automatic += 1
+            self.clock.advance(self.collect_seconds())
+            self.garbage_base += garbage - garbage % limit
+            garbage %= limit
+        return garbage
+
+    def collect_seconds(self):
+        # Mark and sweep of the whole heap, a few ms on the RP2040
+        return 0.001 + HEAP_SIZE * 2e-8
+
+    def gc_module(self):
+        hal = self
+
+        def collect():
+            hal.gc_collects += 1
+            hal.clock.advance(hal.collect_seconds())
+            hal.garbage_base = hal.allocated()
+
+        def threshold(amount=None):
+            if amount is None:
+                return hal.gc_threshold
+            hal.gc_threshold = amount
+
+        return _module(
+            "gc",
+            collect=collect,
+            mem_alloc=lambda: HEAP_LIVE + hal.garbage(),
+            mem_free=lambda: HEAP_SIZE - HEAP_LIVE - hal.garbage(),
+            threshold=threshold,
+            enable=lambda: None,
+            disable=lambda: None,
+            isenabled=lambda: True,
+        )
+
+    # ------------------------------------------------------- micropython
+    def micropython_module(self):
+        return _module(
+            "micropython",
+            const=lambda value: value,
+            schedule=lambda func, arg: func(arg),
+            alloc_emergency_exception_buf=lambda size: None,
+            mem_info=lambda verbose=None: None,
+            opt_level=lambda level=None: 0,
+            native=lambda func: func,
+            viper=lambda func: func,
+        )
+
+    def sys_module(self):
+        console = self.console
+
+        def print_exception(exc, file=None):
+            console.write("Traceback: %r\n" % (exc,))
+
+        def exit(code=0):
+            raise SystemExit(code)
+
+        return _module(
+            "sys",
+            stdin=console.stdin,
+            stdout=console,
+            stderr=console,
+            exit=exit,
+            print_exception=print_exception,
+            exc_info=sys.exc_info,
+            platform="rp2",
+            implementation=types.SimpleNamespace(name="micropython", version=(1, 20, 0)),
+            version="3.4.0; MicroPython v1.20.0 (simulated)",
+            byteorder="little",
+            maxsize=2 ** 31 - 1,
+            path=["", "/lib"],
+            argv=[],
+            modules={},
+        )
+
+    def select_module(self):
+        stdin = self.console.stdin
+
+        class Poll:
+            def __init__(self):
+                self.objects = {}
+
+            def register(self, obj, eventmask=1):
+                self.objects[id(obj)] = (obj, eventmask)
+
+            def unregister(self, obj):
+                self.objects.pop(id(obj), None)
+
+            def modify(self, obj, eventmask):
+                self.objects[id(obj)] = (obj, eventmask)
+
+            def poll(self, timeout=-1):
+                # The console and time server sockets can become readable
+                ready = [(obj, 1) for obj, mask in self.objects.values()
+                         if mask & 1 and (obj is stdin or obj is stdin.buffer) and stdin.any()]
+                if ready:
+                    return ready
+                now = self.clock.now
+                arrivals = [(obj.ready_at(), obj) for obj, mask in self.objects.values()
+                            if mask & 1 and hasattr(obj, "ready_at") and obj.ready_at() is not None]
+                for at, obj in sorted(arrivals, key=lambda item: item[0]):
+                    if at <= now:
+                        return [(obj, 1)]
+                    if timeout is None or timeout < 0 or at <= now + timeout / 1000:
+                        self.clock.sleep(at - now)
+                        return [(obj, 1)]
+                if timeout and timeout > 0:
+                    self.clock.sleep(timeout / 1000)
+                return ready
+
+            ipoll = poll
+
+        Poll.clock = self.clock
+        return _module("select", poll=Poll, POLLIN=1, POLLOUT=4, POLLERR=8, POLLHUP=16)
+
+    def random_module(self):
+        rng = self.world.random
+        return _module(
+            "random",
+            seed=rng.seed,
+            random=rng.random,
+            randint=rng.randint,
+            randrange=rng.randrange,
+            getrandbits=rng.getrandbits,
+            uniform=rng.uniform,
+            choice=rng.choice,
+        )
+
+    # ---------------------------------------------------------- _thread
+    def thread_module(self):
+        core = self.core
+
+        def start_new_thread(func, args, kwargs=None):
+            core.start(func, args, kwargs)
+            return 1
+
+        def exit():
+            raise SystemExit()
+
+        return _module(
+            "_thread",
+            start_new_thread=start_new_thread,
+            allocate_lock=core.lock,
+            get_ident=lambda: 1 if core.running_here() else 0,
+            stack_size=lambda size=0: 4096,
+            exit=exit,
+        )
+
+    def build_modules(self):
+        time_mod = self.time_module()
+        random_mod = self.random_module()
+        select_mod = self.select_module()
+        socket_mod = self.socket_module()
+        modules = {
+            "time": time_mod,
+            "utime": time_mod,
+            "machine": self.machine_module(),
+            "network": self.network_module(),
+            "neopixel": self.neopixel_module(),
+            "urequests": self.urequests_module(),
+            "requests": self.urequests_module(),
+            "ntptime": self.ntptime_module(),
+            "micropython": self.micropython_module(),
+            "gc": self.gc_module(),
+            "sys": self.sys_module(),
+            "random": random_mod,
+            "urandom": random_mod,
+            "binascii": binascii,
+            "ubinascii": binascii,
+            "struct": struct,
+            "ustruct": struct,
+            "json": json,
+            "ujson": json,
+            "select": select_mod,
+            "uselect": select_mod,
+            "_thread": self.thread_module(),
+            "rp2": self.rp2_module(),
+            "socket": socket_mod,
+            "usocket": socket_mod,
+        }
+        return modules
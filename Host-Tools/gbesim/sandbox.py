@@ -0,0 +1,323 @@
+"""Runs the firmware's Python files inside a private namespace.
+
+The firmware and every module it loads from ``/lib`` get their own
+``__builtins__`` whose ``__import__``, ``open`` and ``print`` are redirected
+to the fake MicroPython modules, a sandboxed copy of the Pico filesystem and
+a captured console. Nothing is patched in the host interpreter itself.
+"""
+
+import builtins
+import collections
+import errno
+import os
+import re
+import shutil
+import types
+import warnings
+
+# Modules that exist on the host but behave differently from (or don't
+# exist in) MicroPython. Importing them from firmware raises ImportError
+# unless the simulation provides a fake.
+HOST_ONLY = {
+    "rp2", "_thread", "uasyncio", "asyncio", "select", "uselect",
+    "bluetooth", "framebuf", "uctypes", "cryptolib",
+}
+
+STATUS_LINE = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d ")
+
+
+class ConsoleInput:
+    """Characters typed into the USB console by the host.
+
+    ``read`` returns text like MicroPython's ``sys.stdin``; the same data is
+    available as bytes through ``buffer``.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.buffer = _BinaryInput(self)
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.data += data
+
+    def any(self):
+        return len(self.data)
+
+    def take(self, n=-1):
+        if n < 0 or n > len(self.data):
+            n = len(self.data)
+        out = bytes(self.data[:n])
+        del self.data[:n]
+        return out
+
+    def read(self, n=-1):
+        return self.take(n).decode("latin-1")
+
+    def readline(self):
+        idx = self.data.find(b"\n")
+        return self.read(len(self.data) if idx < 0 else idx + 1)
+
+
+class _BinaryInput:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, n=-1):
+        return self.stream.take(n)
+
+    def readinto(self, buf):
+        data = self.stream.take(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+
+class ConsoleOutput:
+    """Binary side of the USB console (``sys.stdout.buffer``)."""
+
+    def __init__(self, console):
+        self.console = console
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+        self.console.bytes_out += len(data)
+        if self.console.sink:
+            self.console.sink(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class Console:
+    """Captures what the firmware prints to the USB serial console."""
+
+    def __init__(self, echo=False, keep=200):
+        self.echo = echo
+        self.lines = collections.deque(maxlen=keep)
+        self.line_count = 0
+        self.status_lines = 0
+        self.bytes_out = 0
+        self._partial = ""
+        self.sink = None  # func(bytes) that gets text and binary output in order
+        self.stdin = ConsoleInput()
+        self.buffer = ConsoleOutput(self)
+
+    def write(self, text):
+        self.bytes_out += len(text)
+        if self.sink:
+            self.sink(text.encode())
+        if self.echo:
+            print(text, end="")
+        text = self._partial + text
+        parts = text.split("\n")
+        self._partial = parts.pop()
+        for line in parts:
+            self.line_count += 1
+            if STATUS_LINE.match(line):
+                self.status_lines += 1
+            self.lines.append(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+# Flash timing: a 256-byte page program and a 4 KB sector erase
+PAGE_SECONDS = 0.0005
+ERASE_SECONDS = 0.045
+
+
+class FileSystem:
+    """The Pico's littlefs volume, kept in a directory on the host.
+
+    Given a clock, writes take flash programming and erase time, during
+    which the second core is paused as on the rp2 port.
+    """
+
+    def __init__(self, root, clock=None):
+        self.root = os.path.abspath(root)
+        self.cwd = "/"
+        self.bytes_written = 0
+        self.write_opens = 0  # Files opened for writing: a metadata commit each on littlefs
+        self.clock = clock
+
+    def wrote(self, nbytes):
+        erased = self.bytes_written // 4096
+        self.bytes_written += nbytes
+        if self.clock is not None and nbytes:
+            seconds = -(-nbytes // 256) * PAGE_SECONDS
+            seconds += (self.bytes_written // 4096 - erased) * ERASE_SECONDS
+            self.clock.advance(seconds, hold=True)
+
+    def host_path(self, path):
+        if not path.startswith("/"):
+            path = self.cwd.rstrip("/") + "/" + path
+        full = os.path.normpath(os.path.join(self.root, path.lstrip("/")))
+        if full != self.root and not full.startswith(self.root + os.sep):
+            raise OSError(errno.ENOENT, path)
+        return full
+
+    def open(self, path, mode="r", *args, **kwargs):
+        handle = builtins.open(self.host_path(path), mode, *args, **kwargs)
+        if any(flag in mode for flag in "wax+"):
+            self.write_opens += 1
+            return _CountingFile(handle, self)
+        return handle
+
+    def os_module(self):
+        fs = self
+
+        def listdir(path="."):
+            return sorted(os.listdir(fs.host_path(path)))
+
+        def ilistdir(path="."):
+            for name in listdir(path):
+                full = os.path.join(fs.host_path(path), name)
+                kind = 0x4000 if os.path.isdir(full) else 0x8000
+                yield (name, kind, 0, os.path.getsize(full))
+
+        def stat(path):
+            st = os.stat(fs.host_path(path))
+            mode = 0x4000 if os.path.isdir(fs.host_path(path)) else 0x8000
+            return (mode, 0, 0, 0, 0, 0, st.st_size, int(st.st_mtime),
+                    int(st.st_mtime), int(st.st_mtime))
+
+        def chdir(path):
+            if not os.path.isdir(fs.host_path(path)):
+                raise OSError(errno.ENOENT, path)
+            fs.cwd = fs.host_path(path)[len(fs.root):] or "/"
+
+        def statvfs(path="/"):
+            # 2 MB Pico W flash filesystem: 4 KB blocks, 212 blocks for files
+            used = 0
+            for dirpath, _, files in os.walk(fs.root):
+                for name in files:
+                    used += -(-os.path.getsize(os.path.join(dirpath, name)) // 4096)
+            total = 212
+            free = max(0, total - used)
+            return (4096, 4096, total, free, free, 0, 0, 0, 0, 255)
+
+        return types.SimpleNamespace(
+            __name__="os",
+            sep="/",
+            listdir=listdir,
+            ilistdir=ilistdir,
+            stat=stat,
+            remove=lambda path: os.remove(fs.host_path(path)),
+            unlink=lambda path: os.remove(fs.host_path(path)),
+            rename=lambda old, new: os.replace(fs.host_path(old), fs.host_path(new)),
+            mkdir=lambda path: os.mkdir(fs.host_path(path)),
+            rmdir=lambda path: os.rmdir(fs.host_path(path)),
+            chdir=chdir,
+            getcwd=lambda: fs.cwd,
+            statvfs=statvfs,
+            sync=lambda: None,
+            urandom=os.urandom,
+            uname=lambda: ("rp2", "rp2", "1.20.0", "v1.20.0", "Raspberry Pi Pico W with RP2040"),
+            dupterm=lambda stream=None, index=0: None,
+        )
+
+
+class _CountingFile:
+    def __init__(self, handle, fs):
+        self._handle = handle
+        self._fs = fs
+
+    def write(self, data):
+        self._fs.wrote(len(data))
+        return self._handle.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+    def __iter__(self):
+        return iter(self._handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._handle.close()
+
+
+class Sandbox:
+    """One boot of the firmware: fresh RAM, persistent flash."""
+
+    def __init__(self, root, fs, fakes, console):
+        self.root = root
+        self.fs = fs
+        self.console = console
+        self.modules = dict(fakes)
+        os_mod = self.fs.os_module()
+        self.modules["os"] = os_mod
+        self.modules["uos"] = os_mod
+        self.builtins = dict(builtins.__dict__)
+        self.builtins.update(
+            __import__=self._import,
+            open=self.fs.open,
+            print=self._print,
+            const=lambda value: value,
+        )
+
+    def _print(self, *args, sep=" ", end="\n", file=None):
+        stream = self.console if file is None else file
+        stream.write(sep.join(str(arg) for arg in args) + end)
+
+    def _lib_path(self, name):
+        path = os.path.join(self.root, "lib", name + ".py")
+        return path if os.path.exists(path) else None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        top = name.split(".")[0]
+        if top in self.modules:
+            return self.modules[top]
+        path = self._lib_path(top)
+        if path is not None:
+            return self._load(top, path)
+        if top in HOST_ONLY:
+            raise ImportError("no module named '%s'" % name)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def _compile(self, path):
+        # MicroPython accepts things CPython warns about, e.g. ``is 0``
+        with builtins.open(path) as source:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", SyntaxWarning)
+                return compile(source.read(), path, "exec")
+
+    def _load(self, name, path):
+        mod = types.ModuleType(name)
+        mod.__file__ = "/lib/" + name + ".py"
+        mod.__dict__["__builtins__"] = self.builtins
+        self.modules[name] = mod
+        try:
+            exec(self._compile(path), mod.__dict__)
+        except BaseException:
+            del self.modules[name]
+            raise
+        return mod
+
+    def run(self, filename="main.py"):
+        path = os.path.join(self.root, filename)
+        namespace = {
+            "__name__": "__main__",
+            "__file__": "/" + filename,
+            "__builtins__": self.builtins,
+        }
+        self.namespace = namespace
+        exec(self._compile(path), namespace)
+
+
+def make_root(firmware_dir, root):
+    """Copy the firmware filesystem into ``root`` the way it sits on a Pico."""
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    shutil.copytree(
+        firmware_dir, root,
+        ignore=shutil.ignore_patterns("__pycache__", "*.pyc"),
+    )
+    os.makedirs(os.path.join(root, "logs"), exist_ok=True)
+    return root
@@ -0,0 +1,235 @@
+"""Top-level driver: build a world, boot the firmware, run it, summarise."""
+
+import glob
+import json
+import os
+import tempfile
+import time
+import traceback
+
+from . import devices
+from .clock import SimulationComplete, VirtualClock
+from .hal import Hal, MachineReset
+from .sandbox import Console, FileSystem, Sandbox, make_root
+from .usbserial import Pacer, PtyConsole
+from .world import Cloud, World
+
+FIRMWARE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "Control-Box_RPi-Pico-W-Filesystem",
+)
+
+ALL_SENSORS = ("ina219", "aht10", "soil", "ds3231")
+
+
+class Simulation:
+    """Run ``main.py`` for ``duration`` simulated seconds.
+
+    ``start`` is the true UTC start time as ``(year, month, day, hour, min,
+    sec)``. ``sensors`` selects which I2C devices are fitted. ``outages`` are
+    ``(start, end)`` offsets in seconds during which wifi is down and
+    ``latency`` the seconds each HTTP request takes. ``upload`` is the
+    upload slot and rate the cloud assigns, if any. ``crystal_ppm`` is the
+    error of the Pico's crystal, which runs its ticks and RTC, and
+    ``ds3231_ppm`` that of the battery clock.
+    ``device_settings`` is written to ``/config/device_settings.json`` and
+    the extra chambers and sensors in its "devices" section are fitted.
+    """
+
+    def __init__(self, duration=86400, start=(2024, 5, 1, 4, 0, 0), wifi=True,
+                 outages=(), sensors=ALL_SENSORS, seed=0, root=None,
+                 firmware_dir=FIRMWARE_DIR, echo=False, max_boots=10, device_settings=None,
+                 latency=0.15, upload=None, crystal_ppm=0.0, ds3231_ppm=0.0):
+        self.clock = VirtualClock(start, duration)
+        self.clock.ppm = crystal_ppm
+        with open(os.path.join(firmware_dir, "config", "gbe_settings.json")) as settings:
+            self.config = json.load(settings)
+        self.cloud = Cloud(self.config, upload=upload)
+        self.world = World(self.clock, self.cloud, wifi, outages, seed, latency)
+        self.root = make_root(firmware_dir, root or tempfile.mkdtemp(prefix="gbesim-"))
+        self.fs = FileSystem(self.root, self.clock)
+        self.console = Console(echo)
+        self.max_boots = max_boots
+        self.typed = []  # (seconds from start, text) still to be typed
+        self.resets = []  # seconds from start of power cuts still to come
+        self.faults = []  # (seconds from start, bus id) of stuck buses to come
+        self.injected = []  # (seconds from start, fault, True to start or False to end)
+        self.boots = 0
+        self.outcome = None
+        self.error = None
+        self.wall = 0.0
+        self.hal = None
+        self.sandbox = None
+        self.pty = None
+
+        if wifi:
+            with open(os.path.join(self.root, "config", "wifi_settings.json"), "w") as wifi_file:
+                json.dump({"NETWORK_NAME": "sim", "NETWORK_PASSWORD": "sim"}, wifi_file)
+
+        # The battery clock holds local time, as the firmware leaves it
+        tz = self.config["time zone"]["GMT offset"] * 3600
+        fitted = {
+            "ina219": (0, devices.INA219),
+            "aht10": (1, devices.AHT10),
+            "soil": (1, devices.SoilSensor),
+            "ds3231": (0, devices.DS3231),
+        }
+        for name in sensors:
+            bus, model = fitted[name]
+            device = model(self.world)
+            if name == "ds3231":
+                device.offset = tz
+                device.ppm = ds3231_ppm
+            self.world.add_device(bus, device)
+
+        if device_settings is not None:
+            with open(os.path.join(self.root, "config", "device_settings.json"), "w") as dev_file:
+                json.dump(device_settings, dev_file)
+            self.fit_devices(device_settings.get("devices", {}))
+
+    def fit_devices(self, devices_config):
+        models = {"soil": devices.SoilSensor, "aht10": devices.AHT10, "ina219": devices.INA219}
+        for entry in devices_config.get("sensors", []):
+            model = models.get(entry.get("type"))
+            if model is not None:
+                self.world.add_device(entry.get("bus", 1), model(self.world, entry.get("address")))
+        for entry in devices_config.get("chambers", []):
+            if entry.get("tach") is not None:
+                self.world.add_fan(entry["pins"][4], entry["tach"])
+    def type_at(self, seconds, text):
+        """Type ``text`` into the USB console ``seconds`` after the start."""
+        if not self.typed:
+            self.clock.listeners.append(self._type)
+        self.typed.append((seconds, text))
+        self.typed.sort()
+
+    def _type(self, _seconds):
+        while self.typed and self.typed[0][0] <= self.clock.elapsed:
+            self.console.stdin.feed(self.typed.pop(0)[1])
+
+    def attach_pty(self, link=None):
+        """Put the USB console on a pty for host tools; returns its device name."""
+        self.pty = PtyConsole(self.console, link)
+        self.clock.listeners.append(self.pty.poll)
+        return self.pty.name
+
+    def pace(self, speed):
+        """Run at most ``speed`` times faster than real time."""
+        self.clock.listeners.append(Pacer(self.clock, speed))
+
+    def reset_at(self, seconds):
+        """Cut the power ``seconds`` after the start; flash and the world persist."""
+        if not self.resets:
+            self.clock.listeners.append(self._reset)
+        self.resets.append(seconds)
+        self.resets.sort()
+
+    def _reset(self, _seconds):
+        if self.resets and self.resets[0] <= self.clock.elapsed:
+            self.resets.pop(0)
+            raise MachineReset()
+
+    def stick_bus_at(self, seconds, bus):
+        """Have a device hold SDA low on ``bus`` ``seconds`` after the start."""
+        if not self.faults:
+            self.clock.listeners.append(self._fault)
+        self.faults.append((seconds, bus))
+        self.faults.sort()
+
+    def _fault(self, _seconds):
+        while self.faults and self.faults[0][0] <= self.clock.elapsed:
+            self.world.stick_bus(self.faults.pop(0)[1])
+
+    def fault_at(self, seconds, kind, length=None):
+        """Start hardware fault ``kind`` (see ``World.FAULTS``) ``seconds`` after
+        the start, for ``length`` seconds or to the end."""
+        if kind not in World.FAULTS:
+            raise ValueError("unknown fault %r, one of %s" % (kind, ", ".join(World.FAULTS)))
+        if not self.injected:
+            self.clock.listeners.append(self._inject)
+        self.injected.append((seconds, kind, True))
+        if length is not None:
+            self.injected.append((seconds + length, kind, False))
+        self.injected.sort()
+
+    def _inject(self, _seconds):
+        while self.injected and self.injected[0][0] <= self.clock.elapsed:
+            _, kind, start = self.injected.pop(0)
+            if start:
+                self.world.faults.add(kind)
+            else:
+                self.world.faults.discard(kind)
+
+    def boot(self):
+        """Power up the Pico: RAM and peripherals reset, flash and the world persist."""
+        self.boots += 1
+        if self.hal:
+            self.hal.core.stop()  # Core 1 stops with the rest of the chip
+        self.world.duty.clear()
+        self.world.irqs.clear()
+        self.clock.timers.clear()
+        self.hal = Hal(self.world, self.console)
+        self.sandbox = Sandbox(self.root, self.fs, self.hal.build_modules(), self.console)
+        return self.sandbox
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            while True:
+                try:
+                    self.boot().run()
+                    self.outcome = "firmware exited"
+                except MachineReset:
+                    if self.boots < self.max_boots:
+                        continue
+                    self.outcome = "too many resets"
+                break
+        except SimulationComplete:
+            self.outcome = "completed"
+        except SystemExit:
+            self.outcome = "firmware exited"
+        except Exception:
+            self.outcome = "crashed"
+            self.error = traceback.format_exc()
+        if self.hal:
+            self.hal.core.stop()
+        if self.pty:
+            self.pty.close()
+        self.wall = time.perf_counter() - started
+        return self.summary()
+
+    def log_entries(self):
+        entries = []
+        for path in sorted(glob.glob(os.path.join(self.root, "logs", "*.txt"))):
+            with open(path) as logfile:
+                entries.extend(line.rstrip("\n") for line in logfile
+                               if not line.startswith("Date\t"))
+        return entries
+
+    def summary(self):
+        simulated = self.clock.elapsed
+        return {
+            "outcome": self.outcome,
+            "simulated_seconds": round(simulated, 1),
+            "wall_seconds": round(self.wall, 3),
+            "speedup": round(simulated / self.wall, 1) if self.wall else None,
+            "boots": self.boots,
+            "loops": self.console.status_lines,
+            "log_entries": len(self.log_entries()),
+            "log_uploads": self.cloud.count("/log.php"),
+            "alerts": self.cloud.count("/alert.php"),
+            "phonehome": self.cloud.count("/phonehome.php"),
+            "i2c_transactions": self.hal.i2c_transactions if self.hal else 0,
+            "i2c_timeouts": self.hal.i2c_timeouts if self.hal else 0,
+            "i2c_recoveries": self.world.recovered,
+            "neopixel_writes": self.hal.neopixel_writes if self.hal else 0,
+            "timer_callbacks": self.hal.timer_callbacks if self.hal else 0,
+            "energy_wh": round(self.world.energy_wh, 3),
+            "core1_passes": self.hal.core.passes if self.hal else 0,
+            "gc_collections": self.hal.gc_collects if self.hal else 0,
+            "gc_automatic": self.hal.gc_automatic if self.hal else 0,
+            "flash_bytes_written": self.fs.bytes_written,
+            "flash_write_opens": self.fs.write_opens,
+            "root": self.root,
+            "error": self.error,
+        }
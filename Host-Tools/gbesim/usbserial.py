@@ -0,0 +1,76 @@
+"""The box's USB console as a pseudo-terminal on the host.
+
+Host tools that talk to a box over its USB serial port (``box_sync.py``
+and the like) can be pointed at a simulated box instead: everything the
+firmware prints or writes to ``sys.stdout.buffer`` goes to the pty, in
+order, and what the tool writes arrives on the firmware's ``sys.stdin``.
+Like a USB port with nobody reading, output the tool does not read is
+dropped rather than holding up the simulation.
+"""
+
+import os
+import time
+import tty
+
+
+class PtyConsole:
+    """Connect ``console`` (``sandbox.Console``) to a new pty.
+
+    ``name`` is the terminal device a tool opens; ``link``, if given, is
+    made a symlink to it so the path stays the same from run to run.
+    """
+
+    def __init__(self, console, link=None):
+        self.console = console
+        self.master, self.slave = os.openpty()  # The slave stays open so tools can come and go
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.name = os.ttyname(self.slave)
+        self.link = link
+        if link:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(self.name, link)
+        self.bytes_in = 0
+        self.dropped = 0
+        console.sink = self.write
+
+    def write(self, data):
+        while data:
+            try:
+                n = os.write(self.master, data)
+            except (BlockingIOError, OSError):
+                self.dropped += len(data)
+                return
+            data = data[n:]
+
+    def poll(self, _seconds):
+        # Clock listener: bring in what the tool has written
+        try:
+            data = os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        if data:
+            self.bytes_in += len(data)
+            self.console.stdin.feed(data)
+
+    def close(self):
+        self.console.sink = None
+        os.close(self.master)
+        os.close(self.slave)
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+
+class Pacer:
+    """Clock listener that keeps simulated time at most ``speed`` times real time."""
+
+    def __init__(self, clock, speed):
+        self.clock = clock
+        self.speed = speed
+        self.started = time.perf_counter()
+
+    def __call__(self, _seconds):
+        ahead = self.clock.elapsed / self.speed - (time.perf_counter() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
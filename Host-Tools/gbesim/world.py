@@ -0,0 +1,161 @@
+"""Physical and network surroundings of a simulated control box."""
+
+import json
+import math
+import random
+
+
+class Cloud:
+    """Stand-in for the growingbeyond.earth endpoints used by main.py.
+
+    ``upload``, if given, is sent with every reply as the box's upload slot
+    and backlog rate, e.g. ``{"slot": 900, "rate": 0.2, "burst": 3}``.
+    """
+
+    def __init__(self, config, site_name="Simulated box", upload=None):
+        self.config = config
+        self.site_name = site_name
+        self.upload = upload
+        self.requests = []
+
+    def get(self, url, now):
+        self.requests.append((now, url))
+        if "/phonehome.php" in url:
+            reply = {
+                "site_name": self.site_name,
+                "startup_message": "Running in the host simulator",
+            }
+        elif "/log.php" in url:
+            reply = dict(self.config)
+        elif "/alert.php" in url:
+            return json.dumps({"ok": True})
+        else:
+            raise OSError(404, "not found: " + url)
+        if self.upload:
+            reply["upload"] = self.upload
+        return json.dumps(reply)
+
+    def count(self, endpoint):
+        return sum(1 for _, url in self.requests if endpoint in url)
+
+
+class World:
+    """Everything outside the Pico: clock, wiring, sensors' environment, wifi.
+
+    ``outages`` is a list of ``(start, end)`` offsets in seconds from the
+    start of the simulation during which wifi and the cloud are unreachable.
+    ``faults`` are the hardware faults in place now (see ``FAULTS``).
+    ``latency`` is how long each HTTP request to the cloud takes and
+    ``ntp_rtt`` the round trip to the time server, which varies by up to
+    half as much again, unevenly between the two directions.
+    """
+
+    # Channel currents in amps at full duty (duty 255) on the 24 V supply
+    CHANNEL_AMPS = {0: 0.45, 1: 0.30, 2: 0.30, 3: 0.40}
+    FAN_AMPS = 0.10
+    FAN_MAX_RPM = 3000
+    # Faults that can be injected: the fan stops turning, an LED channel's
+    # driver fails open, or the chamber heats up by 15 C
+    FAULTS = {"fan": None, "red": 0, "green": 1, "blue": 2, "white": 3, "heat": None}
+
+    def __init__(self, clock, cloud, wifi=True, outages=(), seed=0, latency=0.15):
+        self.clock = clock
+        self.cloud = cloud
+        self.wifi = wifi
+        self.outages = list(outages)
+        self.latency = latency
+        self.ntp_rtt = 0.04
+        self.ntp_queries = 0
+        self.random = random.Random(seed)
+        self.supply_volts = 24.0
+        self.duty = {}  # GPIO number -> duty_u16
+        self.buses = {0: {}, 1: {}}  # I2C bus id -> {address: device}
+        self.irqs = {}  # GPIO number -> handler
+        self.i2c_lines = {}  # GPIO number -> (bus id, "sda" or "scl")
+        self.stuck = {}  # bus id -> SCL clocks until the device lets go of SDA
+        self.recovered = 0
+        self.fan_pin = 4
+        self.tach_pin = 5
+        self.fans = {self.fan_pin: self.tach_pin}  # fan PWM GPIO -> tach GPIO
+        self._fan_pulses = {}
+        self.tach_calls = 0
+        self.faults = set()
+        self.energy_wh = 0.0  # Drawn from the 24 V supply, for checking the firmware's figure
+        clock.listeners.append(self._tick)
+
+    def online(self):
+        if not self.wifi:
+            return False
+        elapsed = self.clock.elapsed
+        for start, end in self.outages:
+            if start <= elapsed < end:
+                return False
+        return True
+
+    def add_device(self, bus, device):
+        self.buses[bus][device.address] = device
+        return device
+
+    def add_fan(self, fan_pin, tach_pin):
+        # Another chamber's fan, with its tachometer on tach_pin
+        self.fans[fan_pin] = tach_pin
+
+    def stick_bus(self, bus, clocks=5):
+        # A device stops half way through a byte and holds SDA low
+        self.stuck[bus] = clocks
+
+    def line_level(self, bus, line):
+        return 0 if line == "sda" and bus in self.stuck else 1
+
+    def clock_edge(self, bus, line):
+        # Falling edge driven on a bus line by the firmware
+        if line == "scl" and bus in self.stuck:
+            self.stuck[bus] -= 1
+            if self.stuck[bus] <= 0:
+                del self.stuck[bus]
+                self.recovered += 1
+
+    def fan_rpm(self, fan_pin=None):
+        pin = self.fan_pin if fan_pin is None else fan_pin
+        if pin == self.fan_pin and "fan" in self.faults:
+            return 0.0
+        return self.duty.get(pin, 0) / 65535 * self.FAN_MAX_RPM
+
+    def led_current(self):
+        amps = self.FAN_AMPS * self.duty.get(self.fan_pin, 0) / 65535
+        for pin, full in self.CHANNEL_AMPS.items():
+            if any(self.FAULTS[kind] == pin for kind in self.faults):
+                continue  # Driver failed open
+            amps += full * self.duty.get(pin, 0) / 65535
+        return amps
+
+    def lights_on(self):
+        return any(self.duty.get(pin, 0) for pin in self.CHANNEL_AMPS)
+
+    def temperature(self):
+        # Daily swing around 23 C plus some heat from the LEDs
+        hours = self.clock.now / 3600
+        heat = 15 if "heat" in self.faults else 0
+        return 23 + 2 * math.sin(hours / 24 * 2 * math.pi) + 1.5 * self.lights_on() + heat
+
+    def humidity(self):
+        return 55 - 2 * (self.temperature() - 23)
+
+    def soil_moisture(self):
+        # Dries out slowly, watered every two days
+        days = (self.clock.elapsed / 86400) % 2
+        return 900 - 250 * days
+
+    def _tick(self, seconds):
+        self.energy_wh += self.supply_volts * self.led_current() * seconds / 3600
+        # Fan tachometers give two falling edges per revolution
+        for fan_pin, tach_pin in self.fans.items():
+            handler = self.irqs.get(tach_pin)
+            if handler is None:
+                continue
+            pulses = self._fan_pulses.get(fan_pin, 0.0) + self.fan_rpm(fan_pin) / 30 * seconds
+            whole = int(pulses)
+            self._fan_pulses[fan_pin] = pulses - whole
+            for _ in range(whole):
+                handler(tach_pin)
+            self.tach_calls += whole
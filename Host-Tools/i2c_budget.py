@@ -0,0 +1,165 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Check I2C traffic of the drivers and the main loop against budgets.
+
+Each driver's read path runs against the simulated devices (or a recording
+of real device responses) through the firmware's own lib/i2cbus.py
+accounting wrapper. The unmodified main.py then runs for a simulated
+stretch so its loop can be checked as well, and the energy meter's timer
+callback (lib/energy.py), which reads the INA219 outside the accounting,
+per callback (bus_us is its worst). Any figure over its budget in
+i2c_budgets.json is reported and the exit status is 1, so CI can run it:
+
+    python i2c_budget.py                      # simulated devices
+    python i2c_budget.py --record rec.json    # save device responses
+    python i2c_budget.py --replay rec.json    # use saved responses
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+from gbesim import Simulation
+from gbesim import devices
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIELDS = ("transactions", "bytes", "bus_us")
+
+
+def ina219_path(sandbox, bus):
+    ina = sandbox._import("ina219").INA219(0.1, bus)
+    ina.configure()
+    return lambda: (ina.voltage(), ina.current(), ina.power())
+
+
+def soil_path(sandbox, bus):
+    soil = sandbox._import("stemma_soil_sensor").StemmaSoilSensor(bus)
+    return lambda: (soil.get_moisture(), soil.get_temp())
+
+
+def aht10_path(sandbox, bus):
+    aht = sandbox._import("aht10").AHT10(bus)
+    return aht.measure
+
+
+def ds3231_path(sandbox, bus):
+    rtc = sandbox._import("ds3231").DS3231(bus)
+    return rtc.DateTime
+
+
+# name -> (bus id, simulated model, read path as used by main.py)
+DRIVERS = {
+    "ina219": (0, devices.INA219, ina219_path),
+    "soil": (1, devices.SoilSensor, soil_path),
+    "aht10": (1, devices.AHT10, aht10_path),
+    "ds3231": (0, devices.DS3231, ds3231_path),
+}
+
+
+def check(label, figures, budget, failures):
+    for field, value in zip(FIELDS, figures):
+        limit = budget.get(field)
+        over = limit is not None and value > limit
+        print("  %-28s %-13s %8s  budget %s%s" % (
+            label, field, round(value, 1), limit, "  OVER" if over else ""))
+        if over:
+            failures.append("%s %s %s > %s" % (label, field, value, limit))
+
+
+def run_drivers(budgets, cycles, record, replay, failures):
+    print("Driver read paths (worst of %d cycles)" % cycles)
+    recording = {}
+    for name, (bus_id, model, path) in DRIVERS.items():
+        sim = Simulation(duration=None, sensors=())
+        if replay is not None:
+            entry = replay[name]
+            device = devices.Replay(sim.world, entry["address"], entry["reads"])
+        else:
+            device = model(sim.world)
+            if record:
+                device = devices.Recorder(device)
+        sim.world.add_device(bus_id, device)
+        sandbox = sim.boot()
+        bus = sandbox._import("i2cbus").Bus(sandbox.modules["machine"].I2C(bus_id), name)
+        read = path(sandbox, bus)
+        bus.end_cycle()  # driver set-up
+        for _ in range(cycles):
+            read()
+            bus.end_cycle()
+        check(name, bus.cycle_max, budgets.get(name, {}), failures)
+        if record:
+            recording[name] = {"address": device.address, "reads": device.reads}
+        shutil.rmtree(sim.root, ignore_errors=True)
+    return recording
+
+
+def run_loop(budgets, minutes, failures):
+    print("main.py loop (%d simulated minutes)" % minutes)
+    sim = Simulation(duration=minutes * 60)
+    result = sim.run()
+    shutil.rmtree(sim.root, ignore_errors=True)
+    if result["outcome"] != "completed":
+        failures.append("simulation %s" % result["outcome"])
+        print(result["error"] or result["outcome"])
+        return
+    namespace = sim.sandbox.namespace
+    site_budgets = budgets.get("sites", {})
+    for name in ("i2c0", "i2c1"):
+        bus = namespace[name]
+        check(name + " per loop", bus.cycle_max, budgets.get(name, {}), failures)
+        # The simulation stops part way through a loop; count that loop too
+        loops = bus.cycles + (1 if bus.cycle[0] else 0)
+        for site, totals in sorted(bus.sites.items(), key=lambda item: str(item[0])):
+            if site is None:
+                continue
+            average = [value / max(1, loops) for value in totals]
+            check("%s %s per loop" % (name, site), average, site_budgets.get(site, {}), failures)
+    # The energy meter's timer callback reads the INA219 outside the accounting
+    meter = namespace.get("meter")
+    if meter and meter.ticks:
+        figures = (meter.reads / meter.ticks, meter.reads * 3 / meter.ticks, meter.busy_max)
+        check("energy per callback", figures, budgets.get("energy", {}), failures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check I2C transaction budgets.")
+    parser.add_argument("--budgets", default=os.path.join(HERE, "i2c_budgets.json"))
+    parser.add_argument("--cycles", type=int, default=20, help="read cycles per driver")
+    parser.add_argument("--minutes", type=int, default=15, help="simulated minutes of main.py")
+    parser.add_argument("--record", metavar="FILE", help="save device responses to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="answer reads from a recording")
+    parser.add_argument("--drivers-only", action="store_true", help="skip the main.py run")
+    args = parser.parse_args(argv)
+
+    with open(args.budgets) as budget_file:
+        budgets = json.load(budget_file)
+    replay = None
+    if args.replay:
+        with open(args.replay) as replay_file:
+            replay = json.load(replay_file)
+
+    failures = []
+    recording = run_drivers(budgets.get("drivers", {}), args.cycles,
+                            args.record, replay, failures)
+    if args.record:
+        with open(args.record, "w") as record_file:
+            json.dump(recording, record_file, indent=1)
+    if not args.drivers_only:
+        run_loop(budgets.get("loop", {}), args.minutes, failures)
+
+    if failures:
+        print("\n%d budget(s) exceeded:" % len(failures))
+        for failure in failures:
+            print("  " + failure)
+        return 1
+    print("\nAll I2C budgets met.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
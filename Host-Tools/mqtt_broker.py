@@ -0,0 +1,182 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Minimal MQTT 3.1.1 broker for testing the control box MQTT mode.
+
+Supports CONNECT, PUBLISH (QoS 0 and 1), SUBSCRIBE with + and # wildcards,
+retained messages, PINGREQ and DISCONNECT. Every PUBLISH received is printed
+so a box's samples and hourly records can be watched on a workstation.
+
+    python mqtt_broker.py --port 1883 --config <board_id> gbe_settings.json
+
+The --config option publishes a retained config message to
+gbe/<board_id>/config, which the box applies as soon as it subscribes.
+"""
+
+import argparse
+import asyncio
+import json
+import struct
+
+
+def topic_matches(pattern, topic):
+    pat = pattern.split("/")
+    top = topic.split("/")
+    for idx, part in enumerate(pat):
+        if part == "#":
+            return True
+        if idx >= len(top) or (part != "+" and part != top[idx]):
+            return False
+    return len(pat) == len(top)
+
+
+def encode_len(length):
+    out = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def publish_packet(topic, payload, qos=0, pid=0, retain=False):
+    topic = topic.encode()
+    body = struct.pack("!H", len(topic)) + topic
+    if qos:
+        body += struct.pack("!H", pid)
+    body += payload
+    return bytes([0x30 | qos << 1 | int(retain)]) + encode_len(len(body)) + body
+
+
+class Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = "?"
+        self.subs = []
+        self.pid = 0
+
+    async def read_packet(self):
+        head = await self.reader.readexactly(1)
+        length = 0
+        shift = 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        return head[0], await self.reader.readexactly(length)
+
+    def send(self, data):
+        self.writer.write(data)
+
+    def deliver(self, topic, payload, retain=False):
+        for pattern, qos in self.subs:
+            if topic_matches(pattern, topic):
+                qos = min(qos, 1)
+                if qos:
+                    self.pid = self.pid % 65535 + 1
+                self.send(publish_packet(topic, payload, qos, self.pid, retain))
+                return
+
+    async def run(self):
+        try:
+            while True:
+                op, body = await self.read_packet()
+                ptype = op & 0xF0
+                if ptype == 0x10:
+                    id_len = struct.unpack("!H", body[10:12])[0]
+                    self.client_id = body[12:12 + id_len].decode()
+                    self.send(b"\x20\x02\x00\x00")
+                    print("connect    %s" % self.client_id)
+                elif ptype == 0x30:
+                    qos = (op >> 1) & 3
+                    topic_len = struct.unpack("!H", body[:2])[0]
+                    topic = body[2:2 + topic_len].decode()
+                    pos = 2 + topic_len
+                    if qos:
+                        pid = body[pos:pos + 2]
+                        pos += 2
+                        self.send(b"\x40\x02" + pid)
+                    self.broker.publish(topic, body[pos:], bool(op & 1))
+                elif ptype == 0x80:
+                    pid = body[:2]
+                    pos = 2
+                    granted = bytearray()
+                    while pos < len(body):
+                        topic_len = struct.unpack("!H", body[pos:pos + 2])[0]
+                        pattern = body[pos + 2:pos + 2 + topic_len].decode()
+                        qos = body[pos + 2 + topic_len]
+                        pos += 3 + topic_len
+                        self.subs.append((pattern, qos))
+                        granted.append(min(qos, 1))
+                    self.send(bytes([0x90]) + encode_len(2 + len(granted)) + pid + granted)
+                    print("subscribe  %s %s" % (self.client_id, pattern))
+                    for topic, payload in self.broker.retained.items():
+                        self.deliver(topic, payload, True)
+                elif ptype == 0xC0:
+                    self.send(b"\xd0\x00")
+                elif ptype == 0xE0:
+                    break
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            print("disconnect %s" % self.client_id)
+            self.broker.sessions.discard(self)
+            self.writer.close()
+
+
+class Broker:
+    def __init__(self, quiet=False):
+        self.sessions = set()
+        self.retained = {}
+        self.quiet = quiet
+
+    def publish(self, topic, payload, retain=False):
+        if not self.quiet:
+            print("publish    %s %s" % (topic, payload.decode(errors="replace")))
+        if retain:
+            self.retained[topic] = payload
+        for session in list(self.sessions):
+            session.deliver(topic, payload)
+
+    async def handle(self, reader, writer):
+        session = Session(self, reader, writer)
+        self.sessions.add(session)
+        await session.run()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--prefix", default="gbe", help="topic prefix used by the boxes")
+    parser.add_argument("--config", nargs=2, action="append", default=[],
+                        metavar=("BOARD_ID", "FILE"),
+                        help="publish a retained config for a box")
+    parser.add_argument("--quiet", action="store_true", help="don't print every publish")
+    args = parser.parse_args()
+
+    broker = Broker(args.quiet)
+    for board_id, path in args.config:
+        with open(path) as config_file:
+            payload = json.dumps(json.load(config_file)).encode()
+        broker.retained[args.prefix + "/" + board_id + "/config"] = payload
+
+    server = await asyncio.start_server(broker.handle, args.host, args.port)
+    print("MQTT broker listening on %s:%d" % (args.host, args.port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
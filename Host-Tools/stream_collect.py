@@ -0,0 +1,297 @@
+# GROWING BEYOND EARTH CONTROL BOX
+# HOST-SIDE TOOLS
+
+# FAIRCHILD TROPICAL BOTANIC GARDEN
+
+"""Record the binary sample stream of many boxes over USB to CSV or Parquet.
+
+Each box sends a sample frame on every loop pass, and the power readings
+its energy meter took in between at the rate asked for, to a computer
+that asks for them (lib/telemetry.py). The request is repeated every few
+seconds; when this tool stops, the boxes stop sending. Put a box in
+binary mode ("console": {"mode": "binary"} in device_settings.json, or
+the "mode binary" console command) to leave the status lines out.
+
+    python stream_collect.py /dev/ttyACM0 /dev/ttyACM1 --out stream
+    python stream_collect.py /dev/ttyACM* --rate 20 --seconds 600 --format parquet
+    python stream_collect.py /tmp/box0 /tmp/box1   # python -m gbesim --pty /tmp/box0
+
+Each box gets two files in --out, named after its board ID:
+
+    <board>-samples.csv  one row per loop pass: box time, LED and fan
+                         duties, fan RPM, volts, mA, watts, temperature,
+                         humidity, soil moisture and soil temperature,
+                         blank where the box had no reading
+    <board>-power.csv    one row per power reading: box time and watts
+
+Times are the box's local time, the power readings placed between samples
+by the box's millisecond counter; host_time is when the frame arrived.
+Parquet needs pyarrow. Runs until Ctrl-C or --seconds, then prints the
+rows written per box.
+"""
+
+import argparse
+import asyncio
+import csv
+import datetime
+import os
+import signal
+import struct
+import sys
+import time
+
+from gbeserial import FrameReader, SerialPort, request
+
+TICKS_PERIOD = 1 << 30  # MicroPython's ticks_ms wraps here
+SAMPLE = struct.Struct("<IHBBBBBBBBBBhhhhhhhh")
+POWER = struct.Struct("<If")
+MISSING = -32768
+SCALED = (("rpm", 1), ("volts", 100), ("ma", 1), ("watts", 100),
+          ("temperature", 100), ("humidity", 100), ("soil", 1), ("soil_temperature", 100))
+SAMPLE_FIELDS = ([("board", "str"), ("host_time", "float"), ("time", "time"), ("ticks_ms", "int")]
+                 + [(name, "int") for name in ("red", "green", "blue", "white", "fan")]
+                 + [(name, "float") for name, _ in SCALED])
+POWER_FIELDS = [("board", "str"), ("host_time", "float"), ("time", "time"), ("ticks_ms", "int"),
+                ("watts", "float")]
+
+
+def ticks_diff(a, b):
+    # a - b in ms, for MicroPython ticks
+    return (a - b + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+
+
+def decode_sample(payload):
+    values = SAMPLE.unpack(payload[:SAMPLE.size])
+    ticks, year, month, day, hour, minute, second = values[:7]
+    row = {"ticks_ms": ticks}
+    try:
+        row["time"] = datetime.datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        row["time"] = None  # Clock not set yet
+    for name, value in zip(("red", "green", "blue", "white", "fan"), values[7:12]):
+        row[name] = value
+    for (name, scale), value in zip(SCALED, values[12:]):
+        row[name] = None if value == MISSING else value / scale
+    return row
+
+
+def decode_power(payload):
+    # [(ticks_ms, watts), ...]
+    ticks, mw_per_count = POWER.unpack_from(payload)
+    count = (len(payload) - POWER.size) // 4
+    pairs = struct.unpack_from("<%dH" % (2 * count), payload, POWER.size)
+    readings = []
+    for i in range(count):
+        at = (ticks - ((ticks - pairs[2 * i]) & 0xFFFF)) % TICKS_PERIOD
+        readings.append((at, pairs[2 * i + 1] * mw_per_count / 1000))
+    return readings
+
+
+class CsvSink:
+    def __init__(self, path, fields):
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+        self.names = [name for name, _ in fields]
+        if self.file.tell() == 0:
+            self.writer.writerow(self.names)
+        self.rows = 0
+
+    def write(self, rows):
+        for row in rows:
+            self.writer.writerow(["" if row.get(name) is None else row[name] for name in self.names])
+        self.rows += len(rows)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """Rows gathered and written a row group at a time."""
+
+    GROUP = 10000
+
+    def __init__(self, path, fields):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {"str": pa.string(), "float": pa.float64(), "int": pa.int64(),
+                 "time": pa.timestamp("ms")}
+        self.pa = pa
+        self.schema = pa.schema([(name, types[kind]) for name, kind in fields])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.pending = []
+        self.rows = 0
+
+    def write(self, rows):
+        self.pending.extend(rows)
+        self.rows += len(rows)
+        if len(self.pending) >= self.GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.writer.write_table(self.pa.Table.from_pylist(self.pending, schema=self.schema))
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class Collector:
+    """One box's stream on one serial port."""
+
+    def __init__(self, path, args, names):
+        self.path = path
+        self.args = args
+        self.names = names  # Board IDs taken, shared between collectors
+        self.reader = FrameReader()
+        self.board = None
+        self.hz = None
+        self.samples = None
+        self.power = None
+        self.anchor = None  # (ticks_ms, box time) of the last sample
+        self.error = None
+
+    def _open(self, board):
+        name = board
+        n = 1
+        while name in self.names:  # The same board on two ports (simulated boxes)
+            n += 1
+            name = "%s-%d" % (board, n)
+        self.names.add(name)
+        self.board = name
+        sink = ParquetSink if self.args.format == "parquet" else CsvSink
+        ext = "." + self.args.format
+        self.samples = sink(os.path.join(self.args.out, name + "-samples" + ext), SAMPLE_FIELDS)
+        self.power = sink(os.path.join(self.args.out, name + "-power" + ext), POWER_FIELDS)
+
+    def _box_time(self, ticks):
+        if not self.anchor or self.anchor[1] is None:
+            return None
+        return self.anchor[1] + datetime.timedelta(milliseconds=ticks_diff(ticks, self.anchor[0]))
+
+    def _frame(self, kind, payload):
+        now = time.time()
+        if kind == "T":
+            info = payload.decode("utf-8", "replace").split("\t")
+            if self.board is None:
+                self._open(info[0])
+            self.hz = float(info[3]) if len(info) > 3 else 0
+        elif self.board is None:
+            return  # Samples asked for by an earlier run; wait for the reply
+        elif kind == "S" and len(payload) >= SAMPLE.size:
+            row = decode_sample(payload)
+            self.anchor = (row["ticks_ms"], row["time"])
+            row["board"] = self.board
+            row["host_time"] = now
+            self.samples.write([row])
+        elif kind == "P" and len(payload) >= POWER.size:
+            self.power.write([
+                {"board": self.board, "host_time": now, "time": self._box_time(ticks),
+                 "ticks_ms": ticks, "watts": watts}
+                for ticks, watts in decode_power(payload)])
+        elif kind == "X":
+            self.error = payload.decode("utf-8", "replace")
+
+    async def run(self, stop):
+        port = SerialPort(self.path)
+        seq = 0
+        renew = 0
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                if now >= renew:
+                    seq = (seq + 1) & 255
+                    await port.write(request(seq, "T", "%g" % self.args.rate))
+                    renew = now + self.args.renew
+                    for sink in (self.samples, self.power):
+                        if sink:
+                            sink.flush()
+                try:
+                    data = await port.read(min(1.0, renew - now))
+                except asyncio.TimeoutError:
+                    continue
+                if not data:
+                    self.error = "port closed"
+                    break
+                for kind, _, payload in self.reader.feed(data):
+                    if kind is None:
+                        if self.args.verbose:
+                            print("%s: %s" % (self.path, payload), file=sys.stderr)
+                    else:
+                        self._frame(kind, payload)
+        finally:
+            if not port.closed:
+                await port.write(request(seq + 1, "T", "0"))  # Stop sending
+                port.close()
+            for sink in (self.samples, self.power):
+                if sink:
+                    sink.close()
+
+
+async def collect_all(paths, args):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    if args.seconds:
+        loop.call_later(args.seconds, stop.set)
+    names = set()
+    collectors = [Collector(path, args, names) for path in paths]
+
+    async def one(collector):
+        try:
+            await collector.run(stop)
+        except OSError as e:
+            collector.error = str(e)
+
+    await asyncio.gather(*[one(collector) for collector in collectors])
+    return collectors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record boxes' binary sample streams.")
+    parser.add_argument("ports", nargs="+", help="serial devices of the boxes")
+    parser.add_argument("--out", default="stream", help="directory for the files (default stream)")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--rate", type=float, default=10,
+                        help="power readings a second to ask for (default 10)")
+    parser.add_argument("--seconds", type=float, help="stop after this long")
+    parser.add_argument("--renew", type=float, default=3,
+                        help="seconds between requests that keep the samples coming (default 3)")
+    parser.add_argument("--verbose", action="store_true", help="print the boxes' console output")
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            print("--format parquet needs pyarrow", file=sys.stderr)
+            return 2
+    os.makedirs(args.out, exist_ok=True)
+    collectors = asyncio.run(collect_all(args.ports, args))
+    failed = 0
+    for collector in collectors:
+        line = "%s %s: %d samples, %d power readings" % (
+            collector.path, collector.board or "?",
+            collector.samples.rows if collector.samples else 0,
+            collector.power.rows if collector.power else 0)
+        if collector.hz is not None:
+            line += " at %g Hz" % collector.hz
+        if collector.reader.bad:
+            line += ", %d bad frames" % collector.reader.bad
+        if collector.board is None:
+            line += ", no answer"
+        if collector.error:
+            line += ", " + collector.error
+        if collector.board is None or collector.error:
+            failed += 1
+        print(line)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())